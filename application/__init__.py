@@ -1,20 +1,55 @@
+import functools
+import os
+import weakref
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from config import Config
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = SQLAlchemy()
+
+
+def create_app(config_class=Config):
+    """
+    builds the app; importing the package only defines the models, so the CLI, tests and workers pay for the
+    routes, forms and migrations when an app is created. Engines connect on first use.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    db.init_app(app)
+
+    # alembic is by far the slowest import and only the "flask db" commands need it
+    from flask_migrate import Migrate
+    Migrate(app, db)
 
-from application import routes, models
+    from application import cache, dialect, instrumentation, writequeue
+    cache.cache.init_app(app)
+    dialect.init_app(app)
+    instrumentation.init_app(app)
+    writequeue.writer.init_app(app)
 
-# Ensure FOREIGN KEY for sqlite3
-if 'sqlite' in app.config['SQLALCHEMY_DATABASE_URI']:
-    def _fk_pragma_on_connect(dbapi_con, con_record):  # noqa
-        dbapi_con.execute('pragma foreign_keys=ON')
+    from application import api, cli, routes
+    app.register_blueprint(routes.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(instrumentation.bp)
+    app.register_blueprint(cli.bp)
 
+    os.register_at_fork(after_in_child=functools.partial(_dispose_engines, weakref.ref(app)))
+    return app
+
+
+def _dispose_engines(app_ref):
+    """
+    a forked worker must not reuse the parent's pooled connections; dispose(close=False) drops them from the
+    child's pool without closing the parent's sockets
+    """
+    app = app_ref()
+    if app is None:
+        return
     with app.app_context():
-        from sqlalchemy import event
-        event.listen(db.engine, 'connect', _fk_pragma_on_connect)
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+# the search module's FTS5 tables and triggers are created along with the model tables
+from application import models, search  # noqa: E402
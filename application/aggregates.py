@@ -0,0 +1,48 @@
+from collections import Counter
+from datetime import date
+
+from application import db
+from application.models import CostTotals, MediaStat, SubscriptionStat
+
+
+def record_logs(rows):
+    """
+    updates the materialized counters for newly added logs, given as mappings with subscription_id and media_id;
+    call before the commit that adds them so the counters and the logs land in the same transaction
+    """
+    SubscriptionStat.increment(Counter(int(row['subscription_id']) for row in rows))
+    progress = {}
+    for row in rows:
+        # rows without a date get the column default
+        day = row.get('date') or date.today()
+        media = progress.setdefault(int(row['media_id']), {'log_count': 0, 'last_date': None})
+        media['log_count'] += 1
+        # later rows are inserted later, so they win ties like they do in MediaStat.rebuild
+        if media['last_date'] is None or day >= media['last_date']:
+            media.update(last_date=day, last_season=row.get('season'), last_episode=row.get('episode'),
+                         last_subscription_id=int(row['subscription_id']))
+    MediaStat.record(progress)
+
+
+def record_log(log):
+    record_logs(({
+        'subscription_id': log.subscription_id,
+        'media_id': log.media_id,
+        'date': log.date,
+        'season': log.season,
+        'episode': log.episode
+    },))
+
+
+def refresh_cost_totals():
+    return CostTotals.refresh()
+
+
+def rebuild():
+    """
+    recomputes every materialized aggregate from scratch
+    """
+    SubscriptionStat.rebuild()
+    MediaStat.rebuild()
+    CostTotals.refresh()
+    db.session.commit()
@@ -0,0 +1,256 @@
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+from flask import Blueprint, jsonify, request
+
+from application import costs, db, search, stats
+from application.models import Log, Media, MediaStat, MediaType, Subscription, cents_to_str
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Reports span at most this many days, so one request can't have the month series run over centuries
+MAX_REPORT_DAYS = 10 * 366
+
+
+bp = Blueprint('api', __name__)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+@bp.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify(error=str(e)), 400
+
+
+def _arg(name, type):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return type(value)
+    except ValueError:
+        raise BadRequest(f'invalid {name} {value!r}')
+
+
+def _page_size():
+    limit = _arg('limit', int)
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+def _date_range(default_start):
+    """
+    the start and end args (inclusive): end defaults to today and start to default_start(end). The day after end
+    must exist, since the ranges are computed half-open
+    """
+    end = _arg('end', date.fromisoformat) or date.today()
+    if end == date.max:
+        raise BadRequest(f'end must be before {date.max.isoformat()}')
+    try:
+        start = _arg('start', date.fromisoformat) or default_start(end)
+    except OverflowError:
+        raise BadRequest('start is out of range')
+    if end < start:
+        raise BadRequest('end is before start')
+    if (end - start).days >= MAX_REPORT_DAYS:
+        raise BadRequest(f'the range exceeds {MAX_REPORT_DAYS} days')
+    return start, end
+
+
+def _page(query, limit, to_item, cursor_of):
+    """
+    runs a keyset query fetching one extra row to learn whether another page follows
+    """
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    items = [to_item(row) for row in rows[:limit]]
+    next_cursor = cursor_of(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify(items=items, next=next_cursor)
+
+
+def _log_cursor(value):
+    try:
+        day, id = value.split('_')
+        return date.fromisoformat(day), int(id)
+    except ValueError:
+        raise BadRequest(f'invalid cursor {value!r}')
+
+
+@bp.route('/api/logs', methods=['GET'])
+def api_logs():
+    """
+    newest first; pages seek on (date, id), which ix_log_date covers since SQLite appends the rowid to every index,
+    and ix_log_subscription_id_date and ix_log_media_id_date when filtered by subscription or media
+    """
+    query = sa.select(
+        Log.id,
+        Log.date,
+        Log.subscription_id,
+        Subscription.name.label('subscription'),
+        Log.media_id,
+        Media.title.label('media_title'),
+        Log.season,
+        Log.episode,
+        Log.notes
+    ).join(Subscription, Log.subscription_id == Subscription.id)\
+        .join(Media, Log.media_id == Media.id)\
+        .order_by(Log.date.desc(), Log.id.desc())
+
+    subscription_id = _arg('subscription_id', int)
+    if subscription_id is not None:
+        query = query.filter(Log.subscription_id == subscription_id)
+    media_id = _arg('media_id', int)
+    if media_id is not None:
+        query = query.filter(Log.media_id == media_id)
+    start = _arg('start', date.fromisoformat)
+    if start is not None:
+        query = query.filter(Log.date >= start)
+    end = _arg('end', date.fromisoformat)
+    if end is not None:
+        query = query.filter(Log.date <= end)
+    after = _arg('after', _log_cursor)
+    if after is not None:
+        query = query.filter(sa.tuple_(Log.date, Log.id) < after)
+
+    def to_item(row):
+        item = row._asdict()
+        item['date'] = row.date.isoformat()
+        return item
+
+    return _page(query, _page_size(), to_item, lambda row: f'{row.date.isoformat()}_{row.id}')
+
+
+@bp.route('/api/media', methods=['GET'])
+def api_media():
+    query = sa.select(Media.id, Media.title, Media.type, Media.description).order_by(Media.id)
+    media_type = _arg('type', MediaType)
+    if media_type is not None:
+        query = query.filter(Media.type == media_type)
+    after = _arg('after', int)
+    if after is not None:
+        query = query.filter(Media.id > after)
+
+    def to_item(row):
+        item = row._asdict()
+        item['type'] = str(row.type)
+        return item
+
+    return _page(query, _page_size(), to_item, lambda row: str(row.id))
+
+
+@bp.route('/api/media/<int:media_id>/progress', methods=['GET'])
+def api_media_progress(media_id):
+    """
+    where to resume a title: the last logged date, season and episode, and the episode after it
+    """
+    stat = MediaStat.get(media_id)
+    if stat is None:
+        return jsonify(error='no logs for this media'), 404
+    next_episode = stat.next_episode()
+    return jsonify(
+        media_id=media_id,
+        log_count=stat.log_count,
+        last_date=stat.last_date.isoformat() if stat.last_date else None,
+        last_season=stat.last_season,
+        last_episode=stat.last_episode,
+        subscription_id=stat.last_subscription_id,
+        next_season=next_episode[0] if next_episode else None,
+        next_episode=next_episode[1] if next_episode else None
+    )
+
+
+@bp.route('/api/subscriptions', methods=['GET'])
+def api_subscriptions():
+    query = sa.select(
+        Subscription.id,
+        Subscription.name,
+        Subscription.cost_cents,
+        Subscription.payment_frequency,
+        Subscription.active_date,
+        Subscription.inactive_date
+    ).order_by(Subscription.id)
+    if _arg('active', int):
+        query = query.filter(Subscription.inactive_date.is_(None))
+    after = _arg('after', int)
+    if after is not None:
+        query = query.filter(Subscription.id > after)
+
+    def to_item(row):
+        return {
+            'id': row.id,
+            'name': row.name,
+            'cost': cents_to_str(row.cost_cents),
+            'payment_frequency': str(row.payment_frequency),
+            'active_date': row.active_date.isoformat(),
+            'inactive_date': row.inactive_date.isoformat() if row.inactive_date else None
+        }
+
+    return _page(query, _page_size(), to_item, lambda row: str(row.id))
+
+
+@bp.route('/api/search/logs', methods=['GET'])
+def api_search_logs():
+    """
+    logs whose notes match q, best matches first
+    """
+    limit = min(_page_size(), search.MAX_LIMIT)
+    rows = search.search_logs(request.args.get('q', ''), limit)
+    return jsonify(items=[{**row._asdict(), 'date': row.date.isoformat()} for row in rows])
+
+
+@bp.route('/api/spend', methods=['GET'])
+def api_spend():
+    """
+    prorated spend per month and subscription between start and end (inclusive), at the prices in effect then
+    """
+    start, end = _date_range(costs.month_start)
+    names = dict(db.session.execute(sa.select(Subscription.id, Subscription.name)).all())
+    rows = costs.spend(start, end)
+    return jsonify(
+        total=cents_to_str(sum(row.cents for row in rows)),
+        items=[{
+            'month': row.month.isoformat(),
+            'subscription_id': row.subscription_id,
+            'subscription': names[row.subscription_id],
+            'cost': cents_to_str(row.cents)
+        } for row in rows]
+    )
+
+
+@bp.route('/api/value', methods=['GET'])
+def api_value():
+    """
+    cost per view, per title and per hour watched for each subscription between start and end (inclusive)
+    """
+    start, end = _date_range(lambda end: end - timedelta(days=364))
+    items = []
+    for row in costs.value_for_money(start, end):
+        items.append({
+            'subscription_id': row['subscription_id'],
+            'subscription': row['subscription'],
+            'cost': cents_to_str(row['cents']),
+            'views': row['views'],
+            'titles': row['titles'],
+            'hours': round(row['hours'], 2),
+            'cost_per_view': cents_to_str(row['cents_per_view']),
+            'cost_per_title': cents_to_str(row['cents_per_title']),
+            'cost_per_hour': cents_to_str(row['cents_per_hour'])
+        })
+    return jsonify(start=start.isoformat(), end=end.isoformat(), items=items)
+
+
+@bp.route('/api/stats', methods=['GET'])
+def api_stats():
+    """
+    log counts per day, week or month grouped by subscription, media or media type
+    """
+    grain = request.args.get('grain', stats.MONTH)
+    by = request.args.get('by', stats.BY_TYPE)
+    if grain not in stats.GRAINS or by not in stats.GROUPINGS:
+        raise BadRequest(f'grain must be one of {stats.GRAINS} and by one of {stats.GROUPINGS}')
+    rows = stats.counts(grain, by, start=_arg('start', date.fromisoformat), end=_arg('end', date.fromisoformat))
+    return jsonify(items=[{'bucket': row.bucket.isoformat(), by: str(row.key), 'count': row.count} for row in rows])
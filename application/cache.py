@@ -0,0 +1,241 @@
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import current_app
+
+from application import db
+
+# Writes to these tables change what the dashboard and the stats show
+WATCHED_TABLES = frozenset(('log', 'media', 'subscription', 'subscription_price'))
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """
+    in-process cache evicting the least recently used entry beyond max_entries; entries expire after ttl seconds
+    """
+    def __init__(self, max_entries=512, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    cache kept in a local SQLite file, so it survives restarts and is shared by every process on the host
+    """
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _connection(self):
+        """
+        the thread's connection, opened on first use; a forked process opens its own rather than share the one it
+        inherited, which SQLite forbids
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('pragma journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return pickle.loads(row[0]) if row is not None else None
+
+    def set(self, key, value):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value), time.time() + self.ttl)
+        )
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+
+def make_cache(config):
+    backend = config.get('CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return LRUCache(config.get('CACHE_MAX_ENTRIES', 512), config.get('CACHE_TTL', 300))
+    if backend == 'sqlite':
+        return SQLiteCache(config['CACHE_PATH'], config.get('CACHE_TTL', 300))
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f'unknown CACHE_BACKEND {backend!r}')
+
+
+class Cache:
+    """
+    the backend chosen by CACHE_BACKEND, set up by init_app; nothing is cached before that
+    """
+    def __init__(self):
+        self.backend = NullCache()
+
+    def init_app(self, app):
+        self.backend = make_cache(app.config)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def clear(self):
+        self.backend.clear()
+
+
+cache = Cache()
+
+
+def cached(name):
+    """
+    caches the decorated function's results per arguments until the next commit touching WATCHED_TABLES
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = f'{name}:{args!r}:{sorted(kwargs.items())!r}'
+            value = cache.get(key)
+            if value is None:
+                value = func(*args, **kwargs)
+                cache.set(key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+_commit_hooks = {}
+
+
+def on_commit(table, callback):
+    """
+    calls callback() after every commit that wrote to table, and after every rollback of a flushed write, which
+    reads in the same transaction may have seen
+    """
+    _commit_hooks.setdefault(table, []).append(callback)
+
+
+class CommitCache:
+    """
+    a value loaded by fetch() and kept in process until a commit writes to one of tables; other processes'
+    writes are picked up within ttl seconds, CACHE_TTL by default
+    """
+    def __init__(self, tables, ttl=None):
+        self.ttl = ttl
+        self.version = 0
+        self._loaded = None
+        self._lock = threading.Lock()
+        for table in tables:
+            on_commit(table, self.invalidate)
+
+    def fetch(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def _load(self):
+        with self._lock:
+            version = self.version
+        value = self.fetch()
+        ttl = self.ttl if self.ttl is not None else current_app.config.get('CACHE_TTL', 300)
+        loaded = (version, time.monotonic() + ttl, value)
+        with self._lock:
+            # a commit during the fetch leaves the result stale, so it is returned but not kept
+            if version == self.version:
+                self._loaded = loaded
+        return loaded
+
+    def get(self):
+        loaded = self._loaded
+        if loaded is None or loaded[0] != self.version or loaded[1] < time.monotonic():
+            loaded = self._load()
+        return loaded[2]
+
+
+def mark_dirty(session, table):
+    """
+    records that the session's transaction wrote to table, for writes that bypass the session such as COPY
+    """
+    session.info.setdefault('dirty_tables', set()).add(table)
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _after_flush(session, flush_context):
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        mark_dirty(session, instance.__table__.name)
+
+
+@sa.event.listens_for(db.session, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    # bulk statements such as the ingestion executemany never go through a flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mark_dirty(orm_execute_state.session, orm_execute_state.statement.table.name)
+
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _after_commit(session):
+    tables = session.info.pop('dirty_tables', set())
+    if tables & WATCHED_TABLES:
+        cache.clear()
+    _run_commit_hooks(tables)
+
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _after_rollback(session):
+    _run_commit_hooks(session.info.pop('dirty_tables', set()))
+
+
+def _run_commit_hooks(tables):
+    for table in tables:
+        for callback in _commit_hooks.get(table, ()):
+            callback()
@@ -0,0 +1,150 @@
+import click
+from flask import Blueprint, current_app
+
+from application import db, aggregates, dedup, export, ingest, instrumentation, search, stats
+from application.models import Subscription, SubscriptionAlias
+from application.writequeue import writer
+
+# the commands are registered at the top level of the flask command
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute the dashboard aggregates and watch progress from the log and subscription tables."""
+    aggregates.rebuild()
+    click.echo('Dashboard aggregates rebuilt')
+
+
+@bp.cli.command('refresh-rollups')
+@click.option('--rebuild', is_flag=True, help='Discard the rollups and recompute them from every log.')
+def refresh_rollups(rebuild):
+    """Fold new logs into the day/week/month rollup tables."""
+    added = stats.rebuild() if rebuild else stats.refresh()
+    db.session.commit()
+    click.echo(f'Rolled up {added} logs')
+
+
+@bp.cli.command('rebuild-search')
+def rebuild_search():
+    """Rebuild the full-text indexes over media and log notes."""
+    search.rebuild()
+    click.echo('Search indexes rebuilt')
+
+
+@bp.cli.command('import-logs')
+@click.argument('path', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'format', type=click.Choice(['csv', 'json']), default=None,
+              help='Input format; inferred from the file extension by default.')
+def import_logs(path, format):
+    """Bulk import watch history from a CSV or JSON file."""
+    format = format or ('json' if path.name.endswith('.json') else 'csv')
+    try:
+        result = ingest.ingest_logs(ingest.read_rows(path, format))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Imported {result.inserted} logs ({result.media_created} new media) '
+               f'in {result.seconds:.2f}s, {result.rows_per_second:.0f} rows/s')
+
+
+@bp.cli.command('log-natural-key')
+@click.option('--drop', is_flag=True, help='Drop the index, allowing repeated logs again.')
+def log_natural_key(drop):
+    """Skip logs repeating a logged date, subscription, media, season and episode, deleting existing repeats."""
+    removed = ingest.enforce_natural_key(enabled=not drop)
+    click.echo('Natural key index dropped' if drop else f'Natural key index created ({removed} duplicate logs deleted)')
+
+
+@bp.cli.command('dedup-media')
+@click.option('--threshold', type=click.FloatRange(0, 1), default=dedup.DEFAULT_THRESHOLD, show_default=True,
+              help='Trigram similarity from which titles are merged; 1 merges only titles equal once normalized.')
+@click.option('--apply', is_flag=True, help='Merge the duplicates instead of only listing them.')
+def dedup_media(threshold, apply):
+    """List media that duplicate another title written differently, and with --apply merge them into it."""
+    merges = dedup.find_merges(threshold)
+    for merge in merges:
+        duplicates = ', '.join(f'{title!r} ({id}, {score:.2f})' for id, title, score in merge.duplicates)
+        click.echo(f'{merge.title!r} ({merge.media_id}) <- {duplicates}')
+    count = sum(len(merge.duplicates) for merge in merges)
+    if not apply:
+        click.echo(f'{count} duplicates of {len(merges)} media; rerun with --apply to merge them')
+        return
+    result = dedup.merge(merges)
+    click.echo(f'Merged {result.media_merged} media, moving {result.logs_moved} logs '
+               f'({result.logs_deleted} repeats deleted) in {result.seconds:.2f}s')
+
+
+@bp.cli.command('subscription-alias')
+@click.argument('alias', required=False)
+@click.argument('subscription', required=False)
+@click.option('--remove', is_flag=True, help='Remove ALIAS instead of adding it.')
+def subscription_alias(alias, subscription, remove):
+    """Add ALIAS as another name for SUBSCRIPTION, or list the aliases when no arguments are given."""
+    if alias is None:
+        for row in SubscriptionAlias.get():
+            click.echo(f'{row.name} -> {db.session.get(Subscription, row.subscription_id).name}')
+        return
+    if remove:
+        if not SubscriptionAlias.remove(alias):
+            raise click.ClickException(f'No alias {alias!r}')
+        db.session.commit()
+        click.echo(f'Alias {alias!r} removed')
+        return
+    if subscription is None:
+        raise click.UsageError('Missing argument SUBSCRIPTION')
+    target = Subscription.get_by_name(subscription)
+    if target is None:
+        raise click.ClickException(f'No subscription {subscription!r}')
+    try:
+        SubscriptionAlias.add(alias, target.id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(f'{alias!r} now names {target.name}')
+
+
+@bp.cli.command('drain-log-queue')
+def drain_log_queue():
+    """Write every log still waiting in the write-behind queue."""
+    processed = writer.drain()
+    counts = writer.queue.counts()
+    click.echo(f"Processed {processed} queued logs ({counts['failed']} failed in total)")
+
+
+@bp.cli.command('export')
+@click.argument('name', type=click.Choice(sorted(export.EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(sorted(export.FORMATS)), default='csv')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help='File to write to; stdout by default.')
+def export_table(name, format, output):
+    """Stream the logs or subscriptions as CSV or NDJSON."""
+    for chunk in export.generate(name, format):
+        output.write(chunk)
+
+
+@bp.cli.command('sql-report')
+@click.argument('paths', nargs=-1)
+def sql_report(paths):
+    """Request each page and report its SQL statement count and timings.
+
+    Every GET route without URL parameters is requested when no PATHS are given.
+    """
+    if not paths:
+        paths = sorted(rule.rule for rule in current_app.url_map.iter_rules()
+                       if 'GET' in rule.methods and not rule.arguments and rule.endpoint != 'instrumentation.prometheus_metrics')
+    client = current_app.test_client()
+    click.echo(f"{'path':<28} {'status':>6} {'queries':>8} {'sql ms':>9} {'total ms':>9}")
+    for path in paths:
+        stats = {}
+
+        def capture(sender, response, **extra):
+            stats['request'] = instrumentation.current_stats()
+        with instrumentation.request_finished.connected_to(capture, current_app._get_current_object()):
+            response = client.get(path)
+        request = stats.get('request')
+        if request is None:
+            raise click.ClickException('SQL_INSTRUMENTATION is disabled')
+        click.echo(f'{path:<28} {response.status_code:>6} {request.queries:>8} '
+                   f'{request.query_seconds * 1000:>9.2f} {request.seconds * 1000:>9.2f}')
+        for statement, count in request.repeated_statements():
+            click.echo(f'    possible N+1, ran {count} times: {" ".join(statement.split())[:100]}')
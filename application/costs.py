@@ -0,0 +1,191 @@
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import func as f
+
+from application import db, stats
+from application.dialect import add_months, day_number, greatest, least
+from application.cache import cached
+from application.models import MONTHS_IN_YEAR, LogRollup, Media, PaymentFrequency, Subscription, SubscriptionPrice
+
+# Stands in for "no end" so interval ends can be compared with min()
+OPEN_END = date(9999, 12, 31)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def _price_intervals():
+    """
+    one row per price with the dates it was in effect, [start, end), clipped to the subscription's active period;
+    the first price reaches back to active_date so edits to active_date don't leave a gap
+    """
+    window = {'partition_by': SubscriptionPrice.subscription_id, 'order_by': SubscriptionPrice.effective_date}
+    first = f.row_number().over(**window) == 1
+    next_effective = f.lead(SubscriptionPrice.effective_date).over(**window)
+    monthly_cents = sa.case(
+        (SubscriptionPrice.payment_frequency == PaymentFrequency.monthly, SubscriptionPrice.cost_cents * 1.0),
+        else_=SubscriptionPrice.cost_cents / float(MONTHS_IN_YEAR)
+    )
+    start = sa.case(
+        (first, Subscription.active_date),
+        else_=greatest(SubscriptionPrice.effective_date, Subscription.active_date, type_=sa.Date)
+    )
+    end = least(f.coalesce(next_effective, OPEN_END), f.coalesce(Subscription.inactive_date, OPEN_END), type_=sa.Date)
+    return sa.select(
+        SubscriptionPrice.subscription_id,
+        monthly_cents.label('monthly_cents'),
+        start.label('start'),
+        end.label('end'),
+        # day numbers, so overlaps are plain arithmetic
+        day_number(start).label('start_day'),
+        day_number(end).label('end_day')
+    ).join(Subscription, SubscriptionPrice.subscription_id == Subscription.id).subquery('intervals')
+
+
+def _months(first, last):
+    """
+    calendar months from first to last as (month, start_day, end_day) with [start_day, end_day) in day numbers
+    """
+    months = sa.select(
+        sa.literal(first, sa.Date).label('month'),
+        day_number(sa.literal(first, sa.Date)).label('start_day'),
+        day_number(add_months(sa.literal(first, sa.Date), 1)).label('end_day')
+    ).cte('months', recursive=True)
+    return months.union_all(
+        sa.select(
+            add_months(months.c.month, 1),
+            months.c.end_day,
+            day_number(add_months(months.c.month, 2))
+        ).where(months.c.month < last)
+    )
+
+
+@cached('costs.spend')
+def spend(start, end, subscription_ids=None):
+    """
+    returns (month, subscription_id, cents) rows: what each subscription cost in each calendar month from start
+    to end inclusive, at the price in effect on each day. A month is charged its monthly price (a yearly price
+    spread over twelve months) prorated by the days the subscription was active in it and within [start, end].
+    Computed in one statement over every (price interval, month) pair.
+    """
+    if end < start:
+        raise ValueError('end is before start')
+    intervals = _price_intervals()
+    months = _months(month_start(start), month_start(end))
+    overlap_start = greatest(intervals.c.start_day, months.c.start_day, day_number(sa.literal(start, sa.Date)))
+    overlap_end = least(intervals.c.end_day, months.c.end_day, day_number(sa.literal(end + timedelta(days=1), sa.Date)))
+    month_days = months.c.end_day - months.c.start_day
+    cents = f.round(f.sum(intervals.c.monthly_cents * (overlap_end - overlap_start) / month_days))
+    query = sa.select(months.c.month, intervals.c.subscription_id, sa.cast(cents, sa.Integer).label('cents'))\
+        .join(intervals, sa.and_(intervals.c.start_day < months.c.end_day, intervals.c.end_day > months.c.start_day))\
+        .where(overlap_end > overlap_start)\
+        .group_by(months.c.month, intervals.c.subscription_id)\
+        .order_by(months.c.month, intervals.c.subscription_id)
+    if subscription_ids is not None:
+        query = query.where(intervals.c.subscription_id.in_(subscription_ids))
+    return db.session.execute(query).all()
+
+
+def spend_by_month(start, end):
+    """
+    returns (month, cents) totals over every subscription
+    """
+    totals = {}
+    for month, _, cents in spend(start, end):
+        totals[month] = totals.get(month, 0) + cents
+    return sorted(totals.items())
+
+
+def spend_by_subscription(start, end):
+    """
+    returns {subscription_id: cents} spent over the whole range
+    """
+    totals = {}
+    for _, subscription_id, cents in spend(start, end):
+        totals[subscription_id] = totals.get(subscription_id, 0) + cents
+    return totals
+
+
+def monthly_run_rate(day=None):
+    """
+    the monthly cost, in cents, of the subscriptions active on day at the prices in effect that day
+    """
+    day = day or date.today()
+    intervals = _price_intervals()
+    query = sa.select(f.round(f.sum(intervals.c.monthly_cents)))\
+        .where(intervals.c.start <= day, intervals.c.end > day)
+    total = db.session.scalar(query)
+    return int(total) if total is not None else 0
+
+
+def _rollup_range(start, end):
+    """
+    condition selecting the log rollups that cover [start, end] exactly: month rows for the whole months inside
+    the range and day rows for the partial months at either end
+    """
+    day_after = end + timedelta(days=1)
+    first_whole = start if start.day == 1 else month_start(month_start(start) + timedelta(days=31))
+    after_whole = month_start(day_after)
+    if first_whole >= after_whole:
+        return sa.and_(LogRollup.grain == stats.DAY, LogRollup.bucket.between(start, end))
+    return sa.or_(
+        sa.and_(LogRollup.grain == stats.MONTH, LogRollup.bucket >= first_whole, LogRollup.bucket < after_whole),
+        sa.and_(LogRollup.grain == stats.DAY, LogRollup.bucket >= start, LogRollup.bucket < first_whole),
+        sa.and_(LogRollup.grain == stats.DAY, LogRollup.bucket >= after_whole, LogRollup.bucket <= end)
+    )
+
+
+def _per(cents, amount):
+    return round(cents / amount) if amount else None
+
+
+@cached('costs.value_for_money')
+def value_for_money(start, end):
+    """
+    returns a dict per subscription, most used first, with its prorated spend over [start, end] and the logs,
+    distinct titles and estimated hours (WATCH_HOURS per media type) watched on it in that period, plus the
+    cost in cents per view, per title and per hour. Activity is read from the log rollups, brought up to date
+    first, in one grouped query; spend comes from one spend query.
+    """
+    stats.refresh()
+    hours = sa.case(
+        *((Media.type == media_type, hours) for media_type, hours in current_app.config['WATCH_HOURS'].items()),
+        else_=0.0
+    )
+    pairs = sa.select(LogRollup.subscription_id, LogRollup.media_id, f.sum(LogRollup.count).label('views'))\
+        .where(_rollup_range(start, end))\
+        .group_by(LogRollup.subscription_id, LogRollup.media_id)\
+        .subquery()
+    activity = sa.select(
+        pairs.c.subscription_id,
+        f.sum(pairs.c.views).label('views'),
+        f.count().label('titles'),
+        f.sum(pairs.c.views * hours).label('hours')
+    ).join(Media, pairs.c.media_id == Media.id)\
+        .group_by(pairs.c.subscription_id)
+    activity = {row.subscription_id: row for row in db.session.execute(activity)}
+    spent = spend_by_subscription(start, end)
+
+    report = []
+    for id, name in db.session.execute(sa.select(Subscription.id, Subscription.name)):
+        cents = spent.get(id, 0)
+        row = activity.get(id)
+        if not cents and row is None:
+            continue
+        views, titles, hours = (row.views, row.titles, row.hours) if row is not None else (0, 0, 0.0)
+        report.append({
+            'subscription_id': id,
+            'subscription': name,
+            'cents': cents,
+            'views': views,
+            'titles': titles,
+            'hours': hours,
+            'cents_per_view': _per(cents, views),
+            'cents_per_title': _per(cents, titles),
+            'cents_per_hour': _per(cents, hours)
+        })
+    report.sort(key=lambda item: (-item['views'], item['cents'], item['subscription']))
+    return report
@@ -0,0 +1,236 @@
+"""
+Finds media that are one title written differently ("Spy x Family", "Spy × Family", "SPY x FAMILY ") and merges them
+into one. Titles are compared only within blocks of the same media type and the same numbers, so sequels and seasons
+never merge, and within a block only titles sharing one of their rarest trigrams are scored (prefix filtering), so
+the work grows with the number of similar titles instead of with every pair of titles.
+"""
+import math
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+
+import sqlalchemy as sa
+from sqlalchemy import func as f
+
+from application import db, stats
+from application.models import LOG_NATURAL_KEY_COLUMNS, LOG_NATURAL_KEY_INDEX, Log, Media, MediaStat, SubscriptionStat
+
+# Trigram Jaccard similarity from which two titles of a block are the same media
+DEFAULT_THRESHOLD = 0.85
+# Stays well below SQLite's limit on bound parameters per statement
+CHUNK_SIZE = 500
+
+# Characters NFKC leaves as they are but that are written in place of a letter or a word
+_LOOKALIKES = str.maketrans({'×': 'x', '&': ' and '})
+_SEPARATORS = re.compile(r'[\W_]+')
+_NUMBER = re.compile(r'\d+')
+
+
+def normalize_title(title):
+    """
+    the title casefolded, without accents or punctuation and with single spaces: " SPY × Family!" gives "spy x family"
+    """
+    text = unicodedata.normalize('NFKD', unicodedata.normalize('NFKC', title).translate(_LOOKALIKES).casefold())
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return _SEPARATORS.sub(' ', text).strip()
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(first, second):
+    """
+    the Jaccard similarity of the trigrams of two normalized titles
+    """
+    first, second = trigrams(first), trigrams(second)
+    return len(first & second) / len(first | second)
+
+
+@dataclass
+class Merge:
+    """The media kept for a title and the (id, title, similarity) of the duplicates to merge into it."""
+    media_id: int
+    title: str
+    duplicates: list
+
+
+@dataclass
+class MergeResult:
+    media_merged: int
+    logs_moved: int
+    seconds: float
+    # logs repeating another once repointed, deleted when the natural key is enforced
+    logs_deleted: int = 0
+
+    def to_dict(self):
+        return {
+            'media_merged': self.media_merged,
+            'logs_moved': self.logs_moved,
+            'logs_deleted': self.logs_deleted,
+            'seconds': round(self.seconds, 4)
+        }
+
+
+def _similar_pairs(entries, threshold):
+    """
+    yields the id pairs of (id, normalized title) entries whose trigram similarity is at least threshold (PPJoin).
+    Titles are visited shortest first with their trigrams rarest first. Two titles that similar share one of the
+    first len - ceil(threshold * len) + 1 trigrams of the longer and one of the first
+    len - ceil(2 * threshold / (1 + threshold) * len) + 1 of the shorter, so each title is indexed under the latter,
+    probes with the former and only the titles found are scored
+    """
+    grams = [trigrams(text) for _, text in entries]
+    frequency = Counter(gram for title_grams in grams for gram in title_grams)
+    # trigrams as their rank by frequency, rarest first, so sorting a title's trigrams puts the rarest first
+    rank = {gram: i for i, gram in enumerate(sorted(frequency, key=lambda gram: (frequency[gram], gram)))}
+    ranked = [sorted(rank[gram] for gram in title_grams) for title_grams in grams]
+    tokens = [set(title_ranks) for title_ranks in ranked]
+    sizes = [len(title_ranks) for title_ranks in ranked]
+    index = defaultdict(deque)
+    indexed_share = 2 * threshold / (1 + threshold)
+    for i in sorted(range(len(entries)), key=sizes.__getitem__):
+        size = sizes[i]
+        smallest = threshold * size
+        candidates = set()
+        for token in ranked[i][:size - math.ceil(smallest) + 1]:
+            postings = index[token]
+            # the postings are in size order and sizes only grow, so a title too short now is too short for good
+            while postings and sizes[postings[0]] < smallest:
+                postings.popleft()
+            candidates.update(postings)
+        title_tokens = tokens[i]
+        for j in candidates:
+            shared = len(title_tokens & tokens[j])
+            if shared >= threshold * (size + sizes[j] - shared):
+                yield entries[i][0], entries[j][0]
+        for token in ranked[i][:size - math.ceil(indexed_share * size) + 1]:
+            index[token].append(i)
+
+
+def propose(rows, threshold=DEFAULT_THRESHOLD):
+    """
+    groups (id, title, type, log_count) rows into Merges: titles identical once normalized, and titles at least
+    threshold similar within a block. Each group keeps its most logged media, the oldest on a tie
+    """
+    media = {}
+    exact = defaultdict(list)
+    for id, title, media_type, log_count in rows:
+        text = normalize_title(title)
+        media[id] = (title, text, log_count)
+        exact[(media_type, text)].append(id)
+
+    parent = {}
+
+    def find(id):
+        parent.setdefault(id, id)
+        while parent[id] != id:
+            parent[id] = parent[parent[id]]
+            id = parent[id]
+        return id
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    blocks = defaultdict(list)
+    for (media_type, text), ids in exact.items():
+        for id in ids[1:]:
+            union(ids[0], id)
+        if text:
+            blocks[(media_type, tuple(_NUMBER.findall(text)))].append((ids[0], text))
+    if threshold < 1:
+        for entries in blocks.values():
+            for first, second in _similar_pairs(entries, threshold):
+                union(first, second)
+
+    groups = defaultdict(list)
+    for id in parent:
+        groups[find(id)].append(id)
+    merges = []
+    for ids in groups.values():
+        if len(ids) < 2:
+            continue
+        kept = max(ids, key=lambda id: (media[id][2], -id))
+        duplicates = [(id, media[id][0], round(similarity(media[kept][1], media[id][1]), 3))
+                      for id in sorted(ids) if id != kept]
+        merges.append(Merge(kept, media[kept][0], duplicates))
+    return sorted(merges, key=lambda merge: merge.media_id)
+
+
+def find_merges(threshold=DEFAULT_THRESHOLD):
+    """
+    proposes Merges over the whole media catalog; nothing is changed until they are passed to merge
+    """
+    query = sa.select(Media.id, Media.title, Media.type, f.coalesce(MediaStat.log_count, 0))\
+        .outerjoin(MediaStat, MediaStat.media_id == Media.id)
+    return propose(db.session.execute(query.execution_options(yield_per=10000)), threshold)
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def merge(merges):
+    """
+    repoints the logs of every duplicate at the media kept with set-based UPDATEs, deletes the duplicates and
+    recomputes the stats and rollups of the media involved, all in one transaction. With the natural key enforced,
+    logs that repeat another once repointed are deleted, keeping the earliest
+    """
+    start = time.perf_counter()
+    mapping = {id: merge.media_id for merge in merges for id, _, _ in merge.duplicates}
+    duplicates = sorted(mapping)
+    kept = sorted(set(mapping.values()))
+    if not duplicates:
+        return MergeResult(0, 0, time.perf_counter() - start)
+
+    natural_key = Log.natural_key_enforced()
+    if natural_key:
+        # repointed logs may repeat each other until the repeats are deleted
+        db.session.execute(sa.text(f'DROP INDEX {LOG_NATURAL_KEY_INDEX}'))
+    moved = 0
+    for chunk in _chunks(duplicates):
+        stmt = sa.update(Log)\
+            .where(Log.media_id.in_(chunk))\
+            .values(media_id=sa.case({id: mapping[id] for id in chunk}, value=Log.media_id))
+        moved += db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+
+    deleted = 0
+    if natural_key:
+        for chunk in _chunks(kept):
+            first = sa.select(f.min(Log.id)).where(Log.media_id.in_(chunk)).group_by(sa.text(LOG_NATURAL_KEY_COLUMNS))
+            stmt = sa.delete(Log).where(Log.media_id.in_(chunk), Log.id.not_in(first))
+            deleted += db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+        db.session.execute(sa.text(
+            f'CREATE UNIQUE INDEX {LOG_NATURAL_KEY_INDEX} ON log ({LOG_NATURAL_KEY_COLUMNS})'
+        ))
+        if deleted:
+            SubscriptionStat.rebuild()
+
+    # a duplicate's description fills in a missing one
+    for chunk in _chunks(duplicates):
+        described = db.session.execute(
+            sa.select(Media.id, Media.description).where(Media.id.in_(chunk), Media.description.is_not(None))
+        ).all()
+        if described:
+            db.session.execute(
+                sa.update(Media.__table__)
+                .where(Media.id == sa.bindparam('kept_id'), Media.description.is_(None))
+                .values(description=sa.bindparam('kept_description')),
+                [{'kept_id': mapping[id], 'kept_description': description} for id, description in described]
+            )
+    for chunk in _chunks(kept + duplicates):
+        MediaStat.rebuild(chunk)
+        stats.rebuild_media(chunk)
+    if deleted:
+        stats.trim_watermark()
+    for chunk in _chunks(duplicates):
+        db.session.execute(sa.delete(Media).where(Media.id.in_(chunk)),
+                           execution_options={'synchronize_session': False})
+    db.session.commit()
+    return MergeResult(len(duplicates), moved, time.perf_counter() - start, deleted)
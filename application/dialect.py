@@ -0,0 +1,194 @@
+"""
+SQL written differently for SQLite and PostgreSQL. The date helpers are custom constructs compiled per dialect,
+so a statement built from them is backend-neutral and can be built once and cached like any other.
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from application import db
+from application.cache import mark_dirty
+
+SQLITE = 'sqlite'
+POSTGRESQL = 'postgresql'
+
+# Batches at least this large are bulk loaded with COPY on PostgreSQL
+COPY_THRESHOLD = 1000
+
+
+def init_app(app):
+    """
+    applies the configured pragmas (foreign keys, WAL, ...) to every SQLite connection
+    """
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith(SQLITE):
+        return
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    def on_connect(dbapi_connection, connection_record):
+        for pragma, value in pragmas.items():
+            dbapi_connection.execute(f'pragma {pragma}={value}')
+
+    with app.app_context():
+        sa.event.listen(db.engine, 'connect', on_connect)
+
+
+def name():
+    return db.engine.dialect.name
+
+
+def insert(table):
+    """
+    an INSERT construct supporting on_conflict_do_update/on_conflict_do_nothing on the current backend
+    """
+    return postgresql.insert(table) if name() == POSTGRESQL else sqlite.insert(table)
+
+
+def index_exists(index):
+    if name() == POSTGRESQL:
+        query = sa.text('SELECT 1 FROM pg_indexes WHERE indexname = :name')
+    else:
+        query = sa.text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name")
+    return db.session.scalar(query, {'name': index}) is not None
+
+
+def copy_rows(table, rows):
+    """
+    bulk loads mappings, all with the same keys, with COPY ... FROM STDIN on the session's connection, so they
+    commit with the rest of the transaction. PostgreSQL with the psycopg 3 driver only
+    """
+    columns = list(rows[0])
+    cursor = db.session.connection().connection.driver_connection.cursor()
+    with cursor, cursor.copy(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN') as copy:
+        for row in rows:
+            copy.write_row([row[column] for column in columns])
+    # the driver's cursor bypasses the session events that record which tables a transaction wrote to
+    mark_dirty(db.session(), table.name)
+
+
+def lock_writes(table, session=None):
+    """
+    waits for the transactions writing to table to end and holds off new writes until this transaction ends. Only
+    PostgreSQL needs it: SQLite runs one write transaction at a time
+    """
+    if name() == POSTGRESQL:
+        (session or db.session).execute(sa.text(f'LOCK TABLE {table.name} IN SHARE MODE'))
+
+
+class _DateFunction(FunctionElement):
+    type = sa.Date()
+    inherit_cache = True
+
+
+class month_start(_DateFunction):
+    """the first day of the date's month"""
+    name = 'month_start'
+    inherit_cache = True
+
+
+class week_start(_DateFunction):
+    """the Monday of the date's week"""
+    name = 'week_start'
+    inherit_cache = True
+
+
+class add_months(_DateFunction):
+    """add_months(date, months): the date moved by a whole number of months"""
+    name = 'add_months'
+    inherit_cache = True
+
+
+class day_number(FunctionElement):
+    """
+    a date as a count of days from a fixed origin, for date arithmetic; the origin differs between backends, so
+    only differences are meaningful
+    """
+    type = sa.Float()
+    name = 'day_number'
+    inherit_cache = True
+
+
+class _Extreme(FunctionElement):
+    inherit_cache = True
+
+    def __init__(self, *clauses, type_=None):
+        super().__init__(*clauses)
+        if type_ is not None:
+            self.type = sa.types.to_instance(type_)
+
+
+class least(_Extreme):
+    """the smallest of its arguments"""
+    name = 'least'
+    inherit_cache = True
+
+
+class greatest(_Extreme):
+    """the largest of its arguments"""
+    name = 'greatest'
+    inherit_cache = True
+
+
+def _arguments(compiler, element, **kw):
+    return [compiler.process(clause, **kw) for clause in element.clauses]
+
+
+@compiles(month_start, SQLITE)
+def _month_start_sqlite(element, compiler, **kw):
+    return "date(%s, 'start of month')" % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(month_start, POSTGRESQL)
+def _month_start_postgresql(element, compiler, **kw):
+    return "CAST(date_trunc('month', %s) AS DATE)" % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(week_start, SQLITE)
+def _week_start_sqlite(element, compiler, **kw):
+    return "date(%s, 'weekday 0', '-6 days')" % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(week_start, POSTGRESQL)
+def _week_start_postgresql(element, compiler, **kw):
+    return "CAST(date_trunc('week', %s) AS DATE)" % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(add_months, SQLITE)
+def _add_months_sqlite(element, compiler, **kw):
+    return "date(%s, (%s) || ' months')" % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(add_months, POSTGRESQL)
+def _add_months_postgresql(element, compiler, **kw):
+    return 'CAST(%s + make_interval(months => %s) AS DATE)' % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(day_number, SQLITE)
+def _day_number_sqlite(element, compiler, **kw):
+    return 'julianday(%s)' % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(day_number, POSTGRESQL)
+def _day_number_postgresql(element, compiler, **kw):
+    return 'EXTRACT(EPOCH FROM CAST(%s AS TIMESTAMP)) / 86400.0' % tuple(_arguments(compiler, element, **kw))
+
+
+@compiles(least)
+def _least(element, compiler, **kw):
+    return 'least(%s)' % ', '.join(_arguments(compiler, element, **kw))
+
+
+@compiles(least, SQLITE)
+def _least_sqlite(element, compiler, **kw):
+    # SQLite's scalar min() with several arguments
+    return 'min(%s)' % ', '.join(_arguments(compiler, element, **kw))
+
+
+@compiles(greatest)
+def _greatest(element, compiler, **kw):
+    return 'greatest(%s)' % ', '.join(_arguments(compiler, element, **kw))
+
+
+@compiles(greatest, SQLITE)
+def _greatest_sqlite(element, compiler, **kw):
+    return 'max(%s)' % ', '.join(_arguments(compiler, element, **kw))
@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+
+import sqlalchemy as sa
+
+from application import db
+from application.models import Log, Media, Subscription, cents_to_str
+
+# Rows fetched from the cursor at a time, and bytes buffered before a chunk is sent
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+LOG_COLUMNS = ('id', 'date', 'subscription', 'media_title', 'media_type', 'season', 'episode', 'notes')
+SUBSCRIPTION_COLUMNS = ('id', 'name', 'cost', 'payment_frequency', 'active_date', 'inactive_date')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def _stream(query, batch_size):
+    """
+    yields result rows while holding at most batch_size of them in memory
+    """
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        result.close()
+
+
+def log_rows(batch_size=BATCH_SIZE):
+    query = sa.select(
+        Log.id,
+        Log.date,
+        Subscription.name.label('subscription'),
+        Media.title.label('media_title'),
+        Media.type.label('media_type'),
+        Log.season,
+        Log.episode,
+        Log.notes
+    ).join(Subscription, Log.subscription_id == Subscription.id)\
+        .join(Media, Log.media_id == Media.id)\
+        .order_by(Log.id)
+    return _stream(query, batch_size)
+
+
+def subscription_rows(batch_size=BATCH_SIZE):
+    query = sa.select(
+        Subscription.id,
+        Subscription.name,
+        Subscription.cost_cents,
+        Subscription.payment_frequency,
+        Subscription.active_date,
+        Subscription.inactive_date
+    ).order_by(Subscription.id)
+    for id, name, cost_cents, payment_frequency, active_date, inactive_date in _stream(query, batch_size):
+        yield id, name, cents_to_str(cost_cents), payment_frequency, active_date, inactive_date
+
+
+EXPORTS = {
+    'logs': (log_rows, LOG_COLUMNS),
+    'subscriptions': (subscription_rows, SUBSCRIPTION_COLUMNS)
+}
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _chunked(lines):
+    """
+    joins small lines into chunks of roughly CHUNK_SIZE so each write to the client is worthwhile
+    """
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _csv_lines(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(_to_text(value) for value in row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(rows, columns):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, (_to_text(value) for value in row)))) + '\n'
+
+
+def generate(name, format, batch_size=BATCH_SIZE):
+    """
+    yields the export of the named table ('logs' or 'subscriptions') as text chunks in format ('csv' or 'ndjson')
+    """
+    if name not in EXPORTS:
+        raise ValueError(f'unknown export {name!r}')
+    if format not in FORMATS:
+        raise ValueError(f'unsupported format {format!r}')
+    rows, columns = EXPORTS[name]
+    lines = _csv_lines if format == 'csv' else _ndjson_lines
+    return _chunked(lines(rows(batch_size), columns))
@@ -1,14 +1,66 @@
+import uuid
+
+import sqlalchemy as sa
 from flask_wtf import FlaskForm
-from wtforms import DateField, DecimalField, IntegerField, SelectField, StringField, SubmitField, validators
+from wtforms import DateField, DecimalField, HiddenField, IntegerField, SelectField, StringField, SubmitField, validators
 from wtforms.validators import ValidationError, DataRequired, InputRequired
-import sqlalchemy as sa
-from sqlalchemy import func as f
+
 from application import db
+from application.cache import CommitCache
 from application.models import MediaType, PaymentFrequency, Subscription
 
 NAME_MAX_LENGTH = 64
 NOTES_MAX_LENGTH = 256
 MEDIA_NAME_MAX_LENGTH = 256
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+class SubscriptionChoices(CommitCache):
+    """
+    (id, name) select choices of every subscription, kept in process until a commit writes to the subscription
+    table
+    """
+    def __init__(self, ttl=None):
+        super().__init__([Subscription.__table__.name], ttl)
+
+    def fetch(self):
+        rows = db.session.execute(sa.select(Subscription.id, Subscription.name).order_by(Subscription.id)).all()
+        choices = [tuple(row) for row in rows]
+        return choices, frozenset(id for id, _ in choices)
+
+    def choices(self):
+        return self.get()[0]
+
+    def ids(self):
+        return self.get()[1]
+
+
+subscription_choices = SubscriptionChoices()
+
+
+class SubscriptionSelectField(SelectField):
+    """
+    select of the subscriptions by id, validated with a set lookup instead of a scan of the choices, and with a
+    query only for an id the set doesn't have
+    """
+    def __init__(self, label=None, validators=None, **kwargs):
+        super().__init__(label, validators, coerce=int, **kwargs)
+
+    @property
+    def choices(self):
+        return subscription_choices.choices()
+
+    @choices.setter
+    def choices(self, value):
+        pass
+
+    def pre_validate(self, form):
+        if self.data in subscription_choices.ids():
+            return
+        # the choices are loaded per process, so an id they don't know may be a subscription another worker created
+        if self.data is None or db.session.get(Subscription, self.data) is None:
+            raise ValidationError(self.gettext('Not a valid choice.'))
+        subscription_choices.invalidate()
 
 
 class SubscriptionForm(FlaskForm):
@@ -27,14 +79,12 @@ class SubscriptionForm(FlaskForm):
         name.data = name.data.strip()
         if len(name.data) > NAME_MAX_LENGTH:
             raise ValidationError(f'Name exceeds maximum length of {NAME_MAX_LENGTH}')
-        existing_subscription = db.session.scalar(sa.select(Subscription).where(
-            f.lower(Subscription.name) == name.data.lower()
-        ))
+        existing_subscription = Subscription.get_by_name(name.data)
         if existing_subscription:
             raise ValidationError('Subscription already exists')
 
 class EditSubscriptionForm(FlaskForm):
-    subscription = SelectField(label='Subscription Service Name', validators=[DataRequired()])
+    subscription = SubscriptionSelectField(label='Subscription Service Name', validators=[DataRequired()])
     cost = DecimalField(label='Cost', validators=[validators.optional()])
     payment_frequency = SelectField(
         label='Payment Frequency',
@@ -46,16 +96,12 @@ class EditSubscriptionForm(FlaskForm):
     inactive_date = DateField('Inactive Date', validators=[validators.optional()])
     submit = SubmitField('Submit')
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.subscription.choices = [(c.id, c.name) for c in Subscription.query.all()]
-
     def put(self, url, **kwargs):
         return self.form.send(url, method='PUT', **kwargs)
 
 
 class LogForm(FlaskForm):
-    subscription = SelectField(label='Subscription Service Name', validators=[DataRequired()])
+    subscription = SubscriptionSelectField(label='Subscription Service Name', validators=[DataRequired()])
     date = DateField('Date Watched', validators=[validators.optional()])
     media_title = StringField(
         label='Media Name (e.g. Film title, TV show name)',
@@ -70,9 +116,10 @@ class LogForm(FlaskForm):
     season_number = IntegerField(label='Season Number', validators=[validators.optional()])
     episode_number = IntegerField(label='Episode Number', validators=[validators.optional()])
     notes = StringField(label='Notes', validators=[validators.optional(), validators.length(max=NOTES_MAX_LENGTH)])
+    # generated when the form is rendered, so a resubmission of the same form is recognised as a retry
+    idempotency_key = HiddenField(
+        default=lambda: uuid.uuid4().hex,
+        validators=[validators.optional(), validators.length(max=IDEMPOTENCY_KEY_MAX_LENGTH)]
+    )
 
     submit = SubmitField('Submit')
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.subscription.choices = [(c.id, c.name) for c in Subscription.query.all()]
@@ -0,0 +1,216 @@
+import csv
+import json
+import time
+from dataclasses import dataclass
+from datetime import date
+
+import sqlalchemy as sa
+from sqlalchemy import func as f
+
+from application import db, aggregates, dialect, stats
+from application.forms import IDEMPOTENCY_KEY_MAX_LENGTH, MEDIA_NAME_MAX_LENGTH, NOTES_MAX_LENGTH
+from application.models import LOG_NATURAL_KEY_COLUMNS, LOG_NATURAL_KEY_INDEX, Log, Media, MediaType, Subscription, \
+    subscription_names
+
+# Stays well below SQLite's limit on bound parameters per statement
+LOOKUP_CHUNK_SIZE = 500
+
+
+@dataclass
+class IngestResult:
+    inserted: int
+    media_created: int
+    seconds: float
+    # rows already logged under their idempotency key or natural key
+    skipped: int = 0
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.seconds if self.seconds else float(self.inserted)
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'media_created': self.media_created,
+            'skipped': self.skipped,
+            'seconds': round(self.seconds, 4),
+            'rows_per_second': round(self.rows_per_second, 1)
+        }
+
+
+def _optional_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+
+def _string(row, field):
+    """
+    the field's value, '' when it is missing; JSON rows can carry any type, so anything but a string is invalid
+    """
+    value = row.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    return value
+
+
+def _parse_row(number, row):
+    """
+    validates one raw row (from JSON or CSV) and returns it normalized; subscription names and aliases are
+    resolved in process
+    """
+    try:
+        if not isinstance(row, dict):
+            raise ValueError('must be an object')
+        if row.get('subscription_id') not in (None, ''):
+            subscription_id = int(row['subscription_id'])
+            # the names are loaded per process, so an id they don't know may be a subscription created since
+            if subscription_id not in subscription_names.ids() \
+                    and db.session.get(Subscription, subscription_id) is None:
+                raise ValueError(f'unknown subscription_id {subscription_id}')
+        else:
+            name = _string(row, 'subscription').strip()
+            subscription_id = Subscription.id_for_name(name)
+            if subscription_id is None:
+                raise ValueError(f'unknown subscription {name!r}')
+
+        title = _string(row, 'media_title').strip()
+        if not title or len(title) > MEDIA_NAME_MAX_LENGTH:
+            raise ValueError(f'media_title must be 1 to {MEDIA_NAME_MAX_LENGTH} characters')
+        media_type = MediaType.coerce(row.get('media_type') or MediaType.film)
+
+        notes = _string(row, 'notes') or None
+        if notes is not None and len(notes) > NOTES_MAX_LENGTH:
+            raise ValueError(f'notes exceed maximum length of {NOTES_MAX_LENGTH}')
+
+        idempotency_key = _string(row, 'idempotency_key').strip() or None
+        if idempotency_key is not None and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValueError(f'idempotency_key exceeds maximum length of {IDEMPOTENCY_KEY_MAX_LENGTH}')
+
+        return {
+            'date': date.fromisoformat(row['date']) if row.get('date') else date.today(),
+            'subscription_id': subscription_id,
+            'title': title,
+            'type': media_type,
+            'season': _optional_int(row.get('season')),
+            'episode': _optional_int(row.get('episode')),
+            'notes': notes,
+            'idempotency_key': idempotency_key
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'row {number}: {e}') from e
+
+
+def _media_key(title, media_type):
+    return title.lower(), media_type
+
+
+def resolve_media_ids(keys):
+    """
+    maps (lowercased title, MediaType) keys to existing media ids with one indexed lookup per chunk
+    """
+    keys = list(keys)
+    found = {}
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        chunk = keys[start:start + LOOKUP_CHUNK_SIZE]
+        query = sa.select(Media.id, f.lower(Media.title), Media.type)\
+            .where(f.lower(Media.title).in_({title for title, _ in chunk}))
+        for media_id, title, media_type in db.session.execute(query):
+            found[(title, media_type)] = media_id
+    return {key: found[key] for key in keys if key in found}
+
+
+def ingest_logs(rows, idempotency_key=None):
+    """
+    inserts many logs in a single transaction, creating any missing media in bulk;
+    raises ValueError (and writes nothing) if any row is invalid. Rows already logged are skipped, so a retried
+    import is a no-op: a row may carry its own idempotency_key, and rows without one get
+    "<idempotency_key>:<row number>" when a key is given for the whole batch
+    """
+    if idempotency_key is not None:
+        rows = [
+            row if not isinstance(row, dict) or row.get('idempotency_key') else {**row, 'idempotency_key': f'{idempotency_key}:{number}'}
+            for number, row in enumerate(rows, start=1)
+        ]
+    start = time.perf_counter()
+    parsed = [_parse_row(number, row) for number, row in enumerate(rows, start=1)]
+
+    titles = {}
+    for row in parsed:
+        titles.setdefault(_media_key(row['title'], row['type']), row['title'])
+    media_ids = resolve_media_ids(titles)
+
+    missing = [{'title': titles[key], 'type': key[1]} for key in titles if key not in media_ids]
+    created = 0
+    if missing:
+        # a title may exist already under another case that SQL lower() doesn't fold, or be created concurrently
+        # by another writer; those inserts do nothing and their media are looked up by exact title below
+        inserted_media = db.session.execute(
+            dialect.insert(Media).on_conflict_do_nothing().returning(Media.id, Media.title, Media.type),
+            missing
+        ).all()
+        created = len(inserted_media)
+        for media_id, title, media_type in inserted_media:
+            media_ids[_media_key(title, media_type)] = media_id
+        existing = [media for media in missing if _media_key(media['title'], media['type']) not in media_ids]
+        for start in range(0, len(existing), LOOKUP_CHUNK_SIZE):
+            chunk = existing[start:start + LOOKUP_CHUNK_SIZE]
+            query = sa.select(Media.id, Media.title, Media.type)\
+                .where(Media.title.in_({media['title'] for media in chunk}))
+            for media_id, title, media_type in db.session.execute(query):
+                media_ids.setdefault(_media_key(title, media_type), media_id)
+
+    logs = [{
+        'date': row['date'],
+        'subscription_id': row['subscription_id'],
+        'media_id': media_ids[_media_key(row['title'], row['type'])],
+        'season': row['season'],
+        'episode': row['episode'],
+        'notes': row['notes'],
+        'idempotency_key': row['idempotency_key']
+    } for row in parsed]
+    # only the rows actually inserted are counted, so skipped duplicates leave the aggregates alone
+    inserted = Log.insert(logs)
+    aggregates.record_logs(inserted)
+    db.session.commit()
+    return IngestResult(inserted=len(inserted), media_created=created, seconds=time.perf_counter() - start,
+                        skipped=len(logs) - len(inserted))
+
+
+def enforce_natural_key(enabled=True):
+    """
+    creates (or with enabled=False drops) the unique index making a repeated (date, subscription, media, season,
+    episode) a skipped duplicate. Existing duplicates are deleted first, keeping the earliest, and the aggregates
+    and rollups are rebuilt if any were. returns the number of logs deleted
+    """
+    if not enabled:
+        db.session.execute(sa.text(f'DROP INDEX IF EXISTS {LOG_NATURAL_KEY_INDEX}'))
+        db.session.commit()
+        return 0
+    # an ORM delete rather than text, so the commit clears the cached dashboard and stats
+    first = sa.select(f.min(Log.id)).group_by(sa.text(LOG_NATURAL_KEY_COLUMNS))
+    removed = db.session.execute(
+        sa.delete(Log).where(Log.id.not_in(first)), execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.execute(sa.text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {LOG_NATURAL_KEY_INDEX} ON log ({LOG_NATURAL_KEY_COLUMNS})'
+    ))
+    if removed:
+        aggregates.rebuild()
+        stats.rebuild()
+    db.session.commit()
+    return removed
+
+
+def read_rows(stream, format):
+    """
+    reads raw rows from a text stream of CSV (with a header) or JSON (a list, or an object with a "logs" list)
+    """
+    if format == 'csv':
+        return list(csv.DictReader(stream))
+    if format == 'json':
+        data = json.load(stream)
+        return data['logs'] if isinstance(data, dict) else data
+    raise ValueError(f'unsupported format {format!r}')
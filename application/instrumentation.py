@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+import sqlalchemy as sa
+from flask import Blueprint, current_app, g, has_request_context, request, request_finished, request_started
+
+from application import db
+
+logger = logging.getLogger('application.sql')
+
+# Upper bounds in seconds of the request latency histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# An executemany is logged with only its first few parameter sets
+LOGGED_PARAMETER_SETS = 3
+
+
+class Metrics:
+    """
+    process-wide counters per endpoint, rendered in the Prometheus text format
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.request_seconds = defaultdict(float)
+        self.request_buckets = defaultdict(Counter)
+        self.queries = Counter()
+        self.query_seconds = defaultdict(float)
+        self.slow_queries = Counter()
+        self.n_plus_one = Counter()
+
+    def observe_request(self, endpoint, seconds, queries, query_seconds, slow_queries, n_plus_one):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.request_seconds[endpoint] += seconds
+            for bound in DURATION_BUCKETS:
+                if seconds <= bound:
+                    self.request_buckets[endpoint][bound] += 1
+            self.queries[endpoint] += queries
+            self.query_seconds[endpoint] += query_seconds
+            self.slow_queries[endpoint] += slow_queries
+            self.n_plus_one[endpoint] += n_plus_one
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help, values):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for endpoint, value in sorted(values.items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        with self._lock:
+            family('app_requests_total', 'counter', 'Requests handled.', self.requests)
+            lines.append('# HELP app_request_duration_seconds Request latency.')
+            lines.append('# TYPE app_request_duration_seconds histogram')
+            for endpoint in sorted(self.requests):
+                for bound in DURATION_BUCKETS:
+                    lines.append(f'app_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} '
+                                 f'{self.request_buckets[endpoint][bound]}')
+                lines.append(f'app_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} '
+                             f'{self.requests[endpoint]}')
+                lines.append(f'app_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self.request_seconds[endpoint]}')
+                lines.append(f'app_request_duration_seconds_count{{endpoint="{endpoint}"}} {self.requests[endpoint]}')
+            family('app_sql_queries_total', 'counter', 'SQL statements executed.', self.queries)
+            family('app_sql_duration_seconds_total', 'counter', 'Time spent executing SQL.', self.query_seconds)
+            family('app_sql_slow_queries_total', 'counter', 'SQL statements slower than SLOW_QUERY_MS.', self.slow_queries)
+            family('app_sql_n_plus_one_total', 'counter', 'Requests repeating one statement N_PLUS_ONE_THRESHOLD times or more.',
+                   self.n_plus_one)
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slow_queries = 0
+        self.statements = Counter()
+
+    def repeated_statements(self):
+        threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+        return [(statement, count) for statement, count in self.statements.items() if count >= threshold]
+
+
+def current_stats():
+    """
+    the SQL statistics of the request being handled, or None outside of a request
+    """
+    return g.get('request_stats') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    slow = seconds * 1000 >= current_app.config['SLOW_QUERY_MS']
+    if slow:
+        if executemany:
+            parameters = f'{parameters[:LOGGED_PARAMETER_SETS]!r} ({len(parameters)} sets)'
+        logger.warning('slow query (%.1fms): %s parameters=%s', seconds * 1000, statement, parameters)
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+        stats.slow_queries += slow
+        stats.statements[statement] += 1
+
+
+def _request_started(sender, **extra):
+    g.request_stats = RequestStats()
+
+
+def _request_finished(sender, response, **extra):
+    stats = current_stats()
+    if stats is None:
+        return
+    seconds = stats.seconds = time.perf_counter() - stats.started
+    repeated = stats.repeated_statements()
+    for statement, count in repeated:
+        logger.warning('possible N+1 in %s: statement ran %d times: %s', request.endpoint, count, statement)
+    metrics.observe_request(request.endpoint or 'unmatched', seconds, stats.queries, stats.query_seconds,
+                            stats.slow_queries, 1 if repeated else 0)
+    response.headers['Server-Timing'] = f'sql;desc="{stats.queries} queries";dur={stats.query_seconds * 1000:.2f}, ' \
+                                        f'total;dur={seconds * 1000:.2f}'
+
+
+def init_app(app):
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+    with app.app_context():
+        sa.event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        sa.event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+
+
+bp = Blueprint('instrumentation', __name__)
+
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
@@ -1,15 +1,53 @@
+import dataclasses
 import enum
+import functools
+import re
 from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
 from typing import Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from sqlalchemy import func as f, cast, Float
+from sqlalchemy import func as f
 from sqlalchemy.ext.hybrid import hybrid_property
 
-from application import db
+from application import db, dialect
+from application.cache import CommitCache
 
 
 MONTHS_IN_YEAR = 12
+CENTS = Decimal('0.01')
+# Dividing cents by a NUMERIC literal keeps cost expressions exact on PostgreSQL; SQLite reads it as a REAL
+CENTS_PER_UNIT = sa.literal_column('100.0', sa.Numeric(12, 2))
+
+# Yearly plans are spread over the months rounding half up, matching round_div below
+MONTHLY_COST_CENTS_SQL = f"CASE WHEN payment_frequency = 'monthly' THEN cost_cents " \
+                         f"ELSE (cost_cents + {MONTHS_IN_YEAR // 2}) / {MONTHS_IN_YEAR} END"
+YEARLY_COST_CENTS_SQL = f"CASE WHEN payment_frequency = 'monthly' THEN cost_cents * {MONTHS_IN_YEAR} " \
+                        f"ELSE cost_cents END"
+
+# The hot lookups build their statement once (the functools.cache'd _*_query staticmethods) with sa.bindparam
+# placeholders for the values that change between calls. Reusing the object skips rebuilding the construct and
+# regenerating its cache key, so a call only pays for the compiled-cache lookup and the round trip.
+
+
+def to_cents(value):
+    """
+    converts a cost such as "22.99", Decimal('22.99') or 22.99 to integer cents
+    """
+    if value is None:
+        return None
+    return int(Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP) * 100)
+
+
+def cents_to_str(cents):
+    if cents is None:
+        return None
+    return f'{Decimal(cents) / 100:.2f}'
+
+
+def round_div(numerator, denominator):
+    return (numerator + denominator // 2) // denominator
+
 
 class FormEnum(enum.Enum):
     @classmethod
@@ -38,6 +76,52 @@ class PaymentFrequency(FormEnum):
         return [(choice, str(choice)) for choice in cls if choice != PaymentFrequency.no_change]
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
+class SubscriptionRow:
+    """read-only subscription, as returned by Subscription.rows"""
+    id: int
+    name: str
+    cost_cents: int
+    payment_frequency: PaymentFrequency
+    active_date: date
+    inactive_date: Optional[date]
+
+    @property
+    def cost(self):
+        return cents_to_str(self.cost_cents)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class LogRow:
+    """read-only log, as returned by Log.rows"""
+    id: int
+    date: date
+    subscription_id: int
+    media_id: int
+    season: Optional[int]
+    episode: Optional[int]
+    notes: Optional[str]
+
+
+def project(model, row_type):
+    """
+    a select of the model's columns named by row_type's fields, in field order, so each result row can be passed
+    to row_type positionally
+    """
+    return sa.select(*(getattr(model, field.name) for field in dataclasses.fields(row_type)))
+
+
+def read_rows(query, params=None, row_type=None):
+    """
+    runs a column select for read-only use: rows come back as named tuples, or as row_type instances, and no ORM
+    entity is built or added to the session's identity map
+    """
+    result = db.session.execute(query, params)
+    if row_type is None:
+        return result.all()
+    return [row_type(*row) for row in result]
+
+
 class Media(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     title: so.Mapped[str] = so.mapped_column(sa.String, index=True)
@@ -59,17 +143,25 @@ class Media(db.Model):
     def __repr__(self):
         return f'<Media(title={self.title}, type={self.type})>'
 
+    @staticmethod
+    @functools.cache
+    def _by_title_type_query():
+        return sa.select(Media).where(f.lower(Media.title) == sa.bindparam('title'), Media.type == sa.bindparam('type'))
+
     @classmethod
     def get_by_title_type(cls, title, type):
-            query = sa.select(Media).where(f.lower(Media.title) == title.lower(), Media.type == type)
-            return db.session.scalar(query)
+        return db.session.scalar(cls._by_title_type_query(), {'title': title.lower(), 'type': type})
+
+
+# Case-insensitive lookups filter on lower(); a plain index on the column can't serve them
+sa.Index('ix_media_lower_title_type', f.lower(Media.title), Media.type)
 
 
 class Subscription(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String, index=True, unique=True)
-    # TODO: include a list of other names that should map to the same subscription e.g. Disney Plus is the same as Disney+
-    cost: so.Mapped[str] = so.mapped_column(sa.String)
+    # other names for the same service, such as Disney Plus for Disney+, are SubscriptionAliases
+    cost_cents: so.Mapped[int] = so.mapped_column(sa.Integer)
     payment_frequency: so.Mapped[PaymentFrequency] = so.mapped_column(
         sa.Enum(
             PaymentFrequency,
@@ -81,112 +173,636 @@ class Subscription(db.Model):
     )
     active_date: so.Mapped[date] = so.mapped_column(sa.Date, index=True, default=lambda: date.today())
     inactive_date: so.Mapped[Optional[date]] = so.mapped_column(sa.Date)
+    # Generated from cost_cents so ordering and summing by cost is exact and index-backed
+    monthly_cost_cents: so.Mapped[int] = so.mapped_column(
+        sa.Integer,
+        sa.Computed(MONTHLY_COST_CENTS_SQL, persisted=True),
+        index=True
+    )
+    yearly_cost_cents: so.Mapped[int] = so.mapped_column(
+        sa.Integer,
+        sa.Computed(YEARLY_COST_CENTS_SQL, persisted=True),
+        index=True
+    )
 
     def __repr__(self):
         return f'<Subscription(id={self.id}, name={self.name}, cost={self.cost}, payment_frequency={self.payment_frequency})>'
 
+    @hybrid_property
+    def cost(self):
+        return cents_to_str(self.cost_cents)
+
+    @cost.setter
+    def cost(self, value):
+        self.cost_cents = to_cents(value)
+
+    @cost.expression
+    def cost(cls):
+        return cls.cost_cents / CENTS_PER_UNIT
+
     @hybrid_property
     def cost_to_float(self):
-        return cast(self.cost, Float)
+        return self.cost_cents / 100.0
 
     @hybrid_property
     def monthly_cost(self):
         if self.payment_frequency == PaymentFrequency.monthly:
-            return self.cost_to_float
-        return self.cost_to_float / MONTHS_IN_YEAR
+            return self.cost_cents / 100.0
+        return round_div(self.cost_cents, MONTHS_IN_YEAR) / 100.0
 
     @monthly_cost.expression
     def monthly_cost(cls):
-        return sa.case((cls.payment_frequency == PaymentFrequency.monthly, cls.cost_to_float),
-                       else_=(cls.cost_to_float / MONTHS_IN_YEAR)).label('monthly_cost')
+        return (cls.monthly_cost_cents / CENTS_PER_UNIT).label('monthly_cost')
 
     @hybrid_property
     def yearly_cost(self):
         if self.payment_frequency == PaymentFrequency.monthly:
-            return self.cost_to_float * MONTHS_IN_YEAR
-        return self.cost_to_float
+            return self.cost_cents * MONTHS_IN_YEAR / 100.0
+        return self.cost_cents / 100.0
 
     @yearly_cost.expression
     def yearly_cost(cls):
-        return sa.case((cls.payment_frequency == PaymentFrequency.monthly, cls.cost_to_float * MONTHS_IN_YEAR),
-                       else_=cls.cost_to_float).label('yearly_cost')
+        return (cls.yearly_cost_cents / CENTS_PER_UNIT).label('yearly_cost')
+
+    @staticmethod
+    @functools.cache
+    def _by_name_query():
+        return sa.select(Subscription).filter(f.lower(Subscription.name) == sa.bindparam('name'))
 
     @classmethod
     def get_by_name(cls, name):
-        query = sa.select(Subscription).filter(f.lower(Subscription.name) == name.lower())
-        return db.session.scalar(query)
+        """
+        the subscription id_for_name resolves the name to
+        """
+        subscription_id = cls.id_for_name(name)
+        return db.session.get(Subscription, subscription_id) if subscription_id is not None else None
+
+    @classmethod
+    def id_for_name(cls, name):
+        """
+        the id of the subscription with this name, one of its aliases or a spelling of either with the same name_key;
+        resolved in process, with a query only for names the process has not seen yet
+        """
+        subscription_id = subscription_names.resolve(name)
+        if subscription_id is None:
+            subscription = db.session.scalar(cls._by_name_query(), {'name': name.strip().lower()})
+            subscription_id = subscription.id if subscription is not None else None
+        return subscription_id
+
+    @staticmethod
+    @functools.cache
+    def _all_query():
+        return sa.select(Subscription)
 
     @classmethod
     def get(cls, filterby=None, orderby=None):
-        query = sa.select(Subscription)
+        query = cls._all_query()
         if filterby is not None:
             query = query.filter(filterby)
         if orderby is not None:
             query = query.order_by(orderby)
         return db.session.scalars(query).all()
 
+    @staticmethod
+    @functools.cache
+    def _rows_query(active_only):
+        query = project(Subscription, SubscriptionRow).order_by(Subscription.monthly_cost_cents.desc(), Subscription.id)
+        if active_only:
+            query = query.filter(Subscription.inactive_date.is_(None))
+        return query
+
     @classmethod
-    def total_monthly_cost(cls, exclude_inactive=True):
-        query = db.session.query(f.sum(Subscription.monthly_cost))
+    def rows(cls, active_only=False):
+        """
+        SubscriptionRows, most expensive per month first, for pages and reports that only read
+        """
+        return read_rows(cls._rows_query(active_only), row_type=SubscriptionRow)
+
+    @staticmethod
+    @functools.cache
+    def _total_query(column, exclude_inactive):
+        query = sa.select(f.sum(getattr(Subscription, column)))
         if exclude_inactive:
             query = query.filter(Subscription.inactive_date.is_(None))
-        return query.scalar()
+        return query
+
+    @classmethod
+    def total_monthly_cost_cents(cls, exclude_inactive=True):
+        return db.session.scalar(cls._total_query('monthly_cost_cents', exclude_inactive))
+
+    @classmethod
+    def total_yearly_cost_cents(cls, exclude_inactive=True):
+        return db.session.scalar(cls._total_query('yearly_cost_cents', exclude_inactive))
+
+    @classmethod
+    def total_monthly_cost(cls, exclude_inactive=True):
+        total = cls.total_monthly_cost_cents(exclude_inactive)
+        return total / 100 if total is not None else None
 
     @classmethod
     def total_yearly_cost(cls, exclude_inactive=True):
-        query = db.session.query(f.sum(Subscription.yearly_cost))
-        if exclude_inactive:
-            query = query.filter(Subscription.inactive_date.is_(None))
-        return query.scalar()
+        total = cls.total_yearly_cost_cents(exclude_inactive)
+        return total / 100 if total is not None else None
+
+
+sa.Index('ix_subscription_lower_name', f.lower(Subscription.name))
+
+
+class SubscriptionPrice(db.Model):
+    """A subscription's cost and payment frequency from effective_date until the next price takes over."""
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id))
+    effective_date: so.Mapped[date] = so.mapped_column(sa.Date)
+    cost_cents: so.Mapped[int] = so.mapped_column(sa.Integer)
+    payment_frequency: so.Mapped[PaymentFrequency] = so.mapped_column(sa.Enum(
+        PaymentFrequency,
+        name="paymentfrequency",
+        create_constraint=True,
+        validate_strings=True
+    ))
+
+    __table_args__ = (
+        db.UniqueConstraint('subscription_id', 'effective_date', name='_subscription_price_effective_uc'),
+    )
+
+    def __repr__(self):
+        return f'<SubscriptionPrice(subscription_id={self.subscription_id}, effective_date={self.effective_date}, cost_cents={self.cost_cents})>'
+
+    @classmethod
+    def history(cls, subscription_id):
+        query = sa.select(SubscriptionPrice)\
+            .filter(SubscriptionPrice.subscription_id == subscription_id)\
+            .order_by(SubscriptionPrice.effective_date)
+        return db.session.scalars(query).all()
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _record_prices(session, flush_context):
+    """
+    keeps the price history alongside every subscription: a new subscription's price takes effect on its
+    active_date and a changed cost or payment frequency takes effect today
+    """
+    prices = []
+    for instance in session.new:
+        if isinstance(instance, Subscription):
+            prices.append((instance, instance.active_date))
+    for instance in session.dirty:
+        if isinstance(instance, Subscription):
+            state = sa.inspect(instance)
+            if state.attrs.cost_cents.history.has_changes() or state.attrs.payment_frequency.history.has_changes():
+                prices.append((instance, date.today()))
+    if not prices:
+        return
+    stmt = dialect.insert(SubscriptionPrice)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SubscriptionPrice.subscription_id, SubscriptionPrice.effective_date],
+        set_={'cost_cents': stmt.excluded.cost_cents, 'payment_frequency': stmt.excluded.payment_frequency}
+    )
+    session.connection().execute(stmt, [{
+        'subscription_id': subscription.id,
+        'effective_date': effective_date,
+        'cost_cents': subscription.cost_cents,
+        'payment_frequency': subscription.payment_frequency
+    } for subscription, effective_date in prices])
+
+
+_PLUS_WORD = re.compile(r'\bplus\b')
+_NOT_KEY_CHARACTER = re.compile(r'[^\w+]|_')
+
+
+def name_key(name):
+    """
+    what the spellings of a service name have in common: casefolded, "plus" written as "+", and spaces and other
+    punctuation dropped, so Disney Plus, disney+ and Disney + all give "disney+"
+    """
+    return _NOT_KEY_CHARACTER.sub('', _PLUS_WORD.sub('+', name.casefold()))
+
+
+class SubscriptionAlias(db.Model):
+    """Another name a subscription goes by, e.g. Disney Plus for Disney+."""
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id), index=True)
+    name: so.Mapped[str] = so.mapped_column(sa.String, unique=True)
+    # name_key(name), which resolves the spellings of the alias
+    key: so.Mapped[str] = so.mapped_column(sa.String, unique=True)
+
+    def __repr__(self):
+        return f'<SubscriptionAlias(name={self.name}, subscription_id={self.subscription_id})>'
+
+    @classmethod
+    def add(cls, name, subscription_id):
+        """
+        adds an alias of the subscription; raises ValueError if the name already resolves to a subscription
+        """
+        name = name.strip()
+        key = name_key(name)
+        if not key:
+            raise ValueError(f'{name!r} has no letters or digits')
+        existing = Subscription.get_by_name(name)
+        if existing is not None:
+            raise ValueError(f'{name!r} already names {existing.name}')
+        alias = SubscriptionAlias(name=name, key=key, subscription_id=subscription_id)
+        db.session.add(alias)
+        return alias
+
+    @classmethod
+    def remove(cls, name):
+        """
+        removes the alias; returns whether there was one
+        """
+        result = db.session.execute(sa.delete(SubscriptionAlias).where(SubscriptionAlias.key == name_key(name)))
+        return result.rowcount > 0
+
+    @classmethod
+    def get(cls):
+        return db.session.scalars(sa.select(SubscriptionAlias).order_by(SubscriptionAlias.name)).all()
+
+
+class SubscriptionNames(CommitCache):
+    """
+    subscription ids by lowercased name and by name_key, for every subscription and alias, kept in process until a
+    commit writes to either table
+    """
+    def __init__(self, ttl=None):
+        super().__init__([Subscription.__table__.name, SubscriptionAlias.__table__.name], ttl)
+
+    def fetch(self):
+        names = {}
+        keys = {}
+        subscriptions = db.session.execute(sa.select(Subscription.id, Subscription.name).order_by(Subscription.id))
+        aliases = db.session.execute(sa.select(SubscriptionAlias.subscription_id, SubscriptionAlias.name)
+                                     .order_by(SubscriptionAlias.id))
+        for subscription_id, name in [*subscriptions, *aliases]:
+            # a subscription's own name wins over another's alias or spelling
+            names.setdefault(name.lower(), subscription_id)
+            keys.setdefault(name_key(name), subscription_id)
+        # names without letters or digits have no spellings to resolve
+        keys.pop('', None)
+        return names, keys, frozenset(names.values())
+
+    def resolve(self, name):
+        """
+        the id of the subscription the name or a spelling of it refers to, or None
+        """
+        names, keys, _ = self.get()
+        name = name.strip()
+        subscription_id = names.get(name.lower())
+        if subscription_id is None:
+            subscription_id = keys.get(name_key(name))
+        return subscription_id
+
+    def ids(self):
+        return self.get()[2]
+
+
+subscription_names = SubscriptionNames()
+
+
+# Optional unique index over what a log records, created and dropped by ingest.enforce_natural_key. NULL seasons
+# and episodes are coalesced because a unique index treats NULLs as distinct.
+LOG_NATURAL_KEY_INDEX = 'ux_log_natural_key'
+LOG_NATURAL_KEY_COLUMNS = 'date, subscription_id, media_id, coalesce(season, -1), coalesce(episode, -1)'
 
 
 class Log(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     date: so.Mapped[date] = so.mapped_column(sa.Date, index=True, default=lambda: date.today())
-    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id), index=True)
-    media_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Media.id), index=True)
+    # indexed with the date below
+    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id))
+    media_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Media.id))
     season: so.Mapped[Optional[int]] = so.mapped_column(sa.Integer)
     episode: so.Mapped[Optional[int]] = so.mapped_column(sa.Integer)
     notes: so.Mapped[Optional[str]] = so.mapped_column(sa.String)
+    # Client-chosen key making a submission safe to retry: a second log with the same key is skipped
+    idempotency_key: so.Mapped[Optional[str]] = so.mapped_column(sa.String(64), index=True, unique=True)
 
     def __repr__(self):
         return f'<Log(id={self.id}, date={self.date}, subscription_id={self.subscription_id}, media_id={self.media_id})>'
 
+    @staticmethod
+    @functools.cache
+    def _insert_statement():
+        table = Log.__table__
+        return dialect.insert(table).on_conflict_do_nothing().returning(
+            table.c.id, table.c.date, table.c.subscription_id, table.c.media_id, table.c.season, table.c.episode
+        )
+
+    @classmethod
+    def natural_key_enforced(cls):
+        return dialect.index_exists(LOG_NATURAL_KEY_INDEX)
+
+    @classmethod
+    def insert(cls, rows):
+        """
+        inserts log mappings, all with the same keys, in one statement and returns the ones inserted. A row whose
+        idempotency_key is already logged, or that repeats a logged natural key once LOG_NATURAL_KEY_INDEX exists,
+        is skipped
+        """
+        if not rows:
+            return []
+        if not any(row.get('idempotency_key') for row in rows) and not cls.natural_key_enforced():
+            # nothing can conflict, so skip RETURNING and building a result row per log
+            if dialect.name() == dialect.POSTGRESQL and len(rows) >= dialect.COPY_THRESHOLD:
+                dialect.copy_rows(Log.__table__, rows)
+            else:
+                db.session.execute(sa.insert(Log.__table__), rows)
+            return rows
+        return db.session.execute(cls._insert_statement(), rows).mappings().all()
+
+    @staticmethod
+    @functools.cache
+    def _by_query(by_sub, by_media):
+        query = sa.select(Log)
+        if by_sub:
+            query = query.filter(Log.subscription_id == sa.bindparam('sub_id'))
+        if by_media:
+            query = query.filter(Log.media_id == sa.bindparam('media_id'))
+        return query
+
     @classmethod
     def get_by_sub_id(cls, sub_id):
-        query = sa.select(Log).filter(Log.subscription_id == sub_id)
-        return db.session.scalars(query).all()
+        return db.session.scalars(cls._by_query(True, False), {'sub_id': sub_id}).all()
 
     @classmethod
     def get_by_media_id(cls, media_id):
-        query = sa.select(Log).filter(Log.media_id == media_id)
-        return db.session.scalars(query).all()
+        return db.session.scalars(cls._by_query(False, True), {'media_id': media_id}).all()
 
     @classmethod
     def get_by_sub_and_media(cls, sub_id, media_id):
-        query = sa.select(Log).filter(Log.subscription_id == sub_id, Log.media_id == media_id)
-        return db.session.scalars(query).all()
+        return db.session.scalars(cls._by_query(True, True), {'sub_id': sub_id, 'media_id': media_id}).all()
+
+    @staticmethod
+    @functools.cache
+    def _rows_query(by_sub, by_media):
+        query = project(Log, LogRow).order_by(Log.date, Log.id)
+        if by_sub:
+            query = query.filter(Log.subscription_id == sa.bindparam('sub_id'))
+        if by_media:
+            query = query.filter(Log.media_id == sa.bindparam('media_id'))
+        return query
 
     @classmethod
-    def most_logged_subs(cls):
-        query = sa.select(Subscription.name, sa.func.count().label("count"))\
+    def rows(cls, sub_id=None, media_id=None):
+        """
+        the read-only counterpart of the get_by_* lookups: LogRows, oldest first, for either or both ids
+        """
+        query = cls._rows_query(sub_id is not None, media_id is not None)
+        return read_rows(query, {'sub_id': sub_id, 'media_id': media_id}, LogRow)
+
+    @staticmethod
+    @functools.cache
+    def _most_logged_subs_query():
+        return sa.select(Subscription.name, sa.func.count().label("count"))\
             .join(Log, Log.subscription_id == Subscription.id)\
             .group_by(Subscription.name)\
             .order_by(sa.desc("count"))
-        return db.session.execute(query).all()
 
     @classmethod
-    def most_logged_media(cls):
-        query = sa.select(Media.title, sa.func.count().label("count"))\
+    def most_logged_subs(cls):
+        return db.session.execute(cls._most_logged_subs_query()).all()
+
+    @staticmethod
+    @functools.cache
+    def _most_logged_media_query():
+        return sa.select(Media.title, sa.func.count().label("count"))\
             .join(Log, Log.media_id == Media.id)\
             .group_by(Media.title)\
             .order_by(sa.desc("count"))
-        return db.session.execute(query).all()
+
+    @classmethod
+    def most_logged_media(cls):
+        return db.session.execute(cls._most_logged_media_query()).all()
+
+    @staticmethod
+    @functools.cache
+    def _currently_watching_query():
+        last_date = f.max(Log.date).label('last_date')
+        latest = sa.select(Log.media_id, last_date).group_by(Log.media_id).subquery()
+        return sa.select(Media.title)\
+            .join(latest, latest.c.media_id == Media.id)\
+            .order_by(latest.c.last_date.desc(), Media.id.desc())\
+            .limit(sa.bindparam('limit', type_=sa.Integer))
 
     @classmethod
     def currently_watching(cls, limit=10):
-        query = sa.select(Media.title).distinct()\
-            .join(Log, Log.media_id == Media.id)\
-            .order_by(Log.date.desc())\
-            .limit(limit)
-        return db.session.scalars(query).all()
+        """
+        titles by their latest log, newest first; scans the log table, MediaStat.currently_watching reads the
+        maintained progress instead
+        """
+        return db.session.scalars(cls._currently_watching_query(), {'limit': limit}).all()
+
+
+# A subscription's or a title's logs newest first come straight off these, so /api/logs filtered by either seeks
+# to a page instead of sorting all of them; they serve plain lookups by subscription or media as well
+sa.Index('ix_log_subscription_id_date', Log.subscription_id, Log.date, Log.id)
+sa.Index('ix_log_media_id_date', Log.media_id, Log.date, Log.id)
+
+
+class SubscriptionStat(db.Model):
+    """Materialized per-subscription log counter, maintained on every Log write."""
+    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id), primary_key=True)
+    log_count: so.Mapped[int] = so.mapped_column(sa.Integer, index=True, default=0)
+
+    def __repr__(self):
+        return f'<SubscriptionStat(subscription_id={self.subscription_id}, log_count={self.log_count})>'
+
+    @classmethod
+    def increment(cls, counts):
+        """counts maps subscription_id -> number of new logs"""
+        if not counts:
+            return
+        stmt = dialect.insert(SubscriptionStat)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SubscriptionStat.subscription_id],
+            set_={'log_count': SubscriptionStat.log_count + stmt.excluded.log_count}
+        )
+        db.session.execute(stmt, [{'subscription_id': k, 'log_count': v} for k, v in counts.items()])
+
+    @staticmethod
+    @functools.cache
+    def _most_logged_query(limited):
+        query = sa.select(Subscription.name, SubscriptionStat.log_count.label("count"))\
+            .join(SubscriptionStat, SubscriptionStat.subscription_id == Subscription.id)\
+            .order_by(SubscriptionStat.log_count.desc())
+        if limited:
+            query = query.limit(sa.bindparam('limit', type_=sa.Integer))
+        return query
+
+    @classmethod
+    def most_logged(cls, limit=None):
+        return db.session.execute(cls._most_logged_query(limit is not None), {'limit': limit}).all()
+
+    @classmethod
+    def rebuild(cls):
+        db.session.execute(sa.delete(SubscriptionStat))
+        db.session.execute(sa.insert(SubscriptionStat).from_select(
+            ['subscription_id', 'log_count'],
+            sa.select(Log.subscription_id, f.count()).group_by(Log.subscription_id)
+        ))
+
+
+class MediaStat(db.Model):
+    """Materialized per-media log counter and watch progress, maintained on every Log write."""
+    media_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Media.id), primary_key=True)
+    log_count: so.Mapped[int] = so.mapped_column(sa.Integer, index=True, default=0)
+    # The most recent log, by date and then insertion order
+    last_date: so.Mapped[Optional[date]] = so.mapped_column(sa.Date, index=True)
+    last_season: so.Mapped[Optional[int]] = so.mapped_column(sa.Integer)
+    last_episode: so.Mapped[Optional[int]] = so.mapped_column(sa.Integer)
+    last_subscription_id: so.Mapped[Optional[int]] = so.mapped_column(sa.ForeignKey(Subscription.id))
+
+    def __repr__(self):
+        return f'<MediaStat(media_id={self.media_id}, log_count={self.log_count}, last_date={self.last_date})>'
+
+    def next_episode(self):
+        """(season, episode) after the last one watched, or None if the logs carry no episode numbers"""
+        if self.last_episode is None:
+            return None
+        return self.last_season, self.last_episode + 1
+
+    @classmethod
+    def get(cls, media_id):
+        return db.session.get(MediaStat, media_id)
+
+    @classmethod
+    def record(cls, progress):
+        """
+        progress maps media_id -> {'log_count', 'last_date', 'last_season', 'last_episode', 'last_subscription_id'}
+        for the new logs; a new last log replaces the stored one unless it is dated earlier
+        """
+        if not progress:
+            return
+        stmt = dialect.insert(MediaStat)
+        newer = sa.or_(MediaStat.last_date.is_(None), stmt.excluded.last_date >= MediaStat.last_date)
+        set_ = {
+            column: sa.case((newer, stmt.excluded[column]), else_=getattr(MediaStat, column))
+            for column in ('last_date', 'last_season', 'last_episode', 'last_subscription_id')
+        }
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MediaStat.media_id],
+            set_={'log_count': MediaStat.log_count + stmt.excluded.log_count, **set_}
+        )
+        db.session.execute(stmt, [{'media_id': k, **v} for k, v in progress.items()])
+
+    @staticmethod
+    @functools.cache
+    def _most_logged_query(limited):
+        query = sa.select(Media.title, MediaStat.log_count.label("count"))\
+            .join(MediaStat, MediaStat.media_id == Media.id)\
+            .order_by(MediaStat.log_count.desc())
+        if limited:
+            query = query.limit(sa.bindparam('limit', type_=sa.Integer))
+        return query
+
+    @classmethod
+    def most_logged(cls, limit=None):
+        return db.session.execute(cls._most_logged_query(limit is not None), {'limit': limit}).all()
+
+    @staticmethod
+    @functools.cache
+    def _currently_watching_query():
+        return sa.select(Media.id, Media.title, Media.type, MediaStat.last_date, MediaStat.last_season,
+                         MediaStat.last_episode)\
+            .join(Media, MediaStat.media_id == Media.id)\
+            .where(MediaStat.last_date.is_not(None))\
+            .order_by(MediaStat.last_date.desc(), MediaStat.media_id.desc())\
+            .limit(sa.bindparam('limit', type_=sa.Integer))
+
+    @classmethod
+    def currently_watching(cls, limit=10):
+        """
+        the most recently watched media with their resume point, read from ix_media_stat_last_date
+        """
+        return db.session.execute(cls._currently_watching_query(), {'limit': limit}).all()
+
+    @classmethod
+    def rebuild(cls, media_ids=None):
+        """
+        recomputes the stats of every media, or only of media_ids
+        """
+        latest = sa.select(
+            Log.media_id,
+            f.count().over(partition_by=Log.media_id).label('log_count'),
+            Log.date,
+            Log.season,
+            Log.episode,
+            Log.subscription_id,
+            f.row_number().over(partition_by=Log.media_id, order_by=(Log.date.desc(), Log.id.desc())).label('rank')
+        )
+        delete = sa.delete(MediaStat)
+        if media_ids is not None:
+            latest = latest.where(Log.media_id.in_(media_ids))
+            delete = delete.where(MediaStat.media_id.in_(media_ids))
+        latest = latest.subquery()
+        db.session.execute(delete)
+        db.session.execute(sa.insert(MediaStat).from_select(
+            ['media_id', 'log_count', 'last_date', 'last_season', 'last_episode', 'last_subscription_id'],
+            sa.select(latest.c.media_id, latest.c.log_count, latest.c.date, latest.c.season, latest.c.episode,
+                      latest.c.subscription_id).where(latest.c.rank == 1)
+        ))
+
+
+class CostTotals(db.Model):
+    """Single-row table holding the cost totals of the active subscriptions."""
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    monthly_cost_cents: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+    yearly_cost_cents: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+
+    ROW_ID = 1
+
+    def __repr__(self):
+        return f'<CostTotals(monthly_cost_cents={self.monthly_cost_cents}, yearly_cost_cents={self.yearly_cost_cents})>'
+
+    @classmethod
+    def get(cls):
+        return db.session.get(CostTotals, cls.ROW_ID)
+
+    @classmethod
+    def refresh(cls):
+        """Recompute the totals; the subscription table is small so this stays cheap on every write"""
+        totals = db.session.get(CostTotals, cls.ROW_ID)
+        if totals is None:
+            totals = CostTotals(id=cls.ROW_ID)
+            db.session.add(totals)
+        totals.monthly_cost_cents = Subscription.total_monthly_cost_cents() or 0
+        totals.yearly_cost_cents = Subscription.total_yearly_cost_cents() or 0
+        return totals
+
+
+class Watermark(db.Model):
+    """Progress marker for jobs that process the log table incrementally."""
+    name: so.Mapped[str] = so.mapped_column(sa.String, primary_key=True)
+    value: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+
+    def __repr__(self):
+        return f'<Watermark(name={self.name}, value={self.value})>'
+
+    @classmethod
+    def get(cls, name, session=None):
+        # a query rather than the identity map, which may hold a value another session has since moved
+        session = session or db.session
+        return session.scalar(sa.select(Watermark.value).where(Watermark.name == name)) or 0
+
+    @classmethod
+    def advance(cls, name, current, new, session=None):
+        """
+        moves the watermark from current to new; returns False if another writer moved it first
+        """
+        session = session or db.session
+        session.execute(dialect.insert(Watermark).values(name=name, value=0).on_conflict_do_nothing())
+        result = session.execute(
+            sa.update(Watermark).where(Watermark.name == name, Watermark.value == current).values(value=new)
+        )
+        return result.rowcount == 1
+
+
+class LogRollup(db.Model):
+    """Log counts per subscription and media, bucketed by day, week and month."""
+    grain: so.Mapped[str] = so.mapped_column(sa.String, primary_key=True)
+    bucket: so.Mapped[date] = so.mapped_column(sa.Date, primary_key=True)
+    subscription_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Subscription.id), primary_key=True)
+    media_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(Media.id), primary_key=True)
+    count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+
+    def __repr__(self):
+        return f'<LogRollup(grain={self.grain}, bucket={self.bucket}, subscription_id={self.subscription_id}, media_id={self.media_id}, count={self.count})>'
@@ -1,66 +1,103 @@
-from flask import flash, render_template, redirect, request, url_for
-from application import app, db
-from application.forms import EditSubscriptionForm, LogForm, SubscriptionForm
-from application.models import Log, Media, Subscription, PaymentFrequency
+import hashlib
+import io
+from datetime import date
+from flask import Blueprint, Response, abort, current_app, flash, jsonify, make_response, render_template, redirect, \
+    request, session, stream_with_context, url_for
+from markupsafe import Markup
+from application import db, aggregates, dialect, export, ingest, search
+from application.cache import cache
+from application.forms import IDEMPOTENCY_KEY_MAX_LENGTH, EditSubscriptionForm, LogForm, SubscriptionForm
+from application.models import CostTotals, Log, Media, MediaStat, MediaType, Subscription, SubscriptionStat, \
+    PaymentFrequency, cents_to_str, to_cents
+from application.writequeue import writer
 
-@app.route('/')
-@app.route('/index')
-def index():
+DASHBOARD_CACHE_KEY = 'dashboard'
+
+bp = Blueprint('main', __name__)
+
+
+def render_dashboard():
     user = {'username': 'Lisha'}
-    subs = Subscription.get(orderby=Subscription.monthly_cost.desc(), filterby=Subscription.inactive_date.is_(None))
-    total_monthly_cost = Subscription.total_monthly_cost()
-    total_yearly_cost = Subscription.total_yearly_cost()
-    subs_by_count = Log.most_logged_subs()
-    top_ten = Log.most_logged_media()[:10]
-    currently_watching = Log.currently_watching()
+    subs = Subscription.rows(active_only=True)
+    totals = CostTotals.get()
+    total_monthly_cost = totals.monthly_cost_cents if totals is not None else 0
+    total_yearly_cost = totals.yearly_cost_cents if totals is not None else 0
+    subs_by_count = SubscriptionStat.most_logged()
+    top_ten = MediaStat.most_logged(limit=10)
+    currently_watching = MediaStat.currently_watching()
     content = {
-        "title": "Home",
         "user": user,
         "subscriptions": subs,
-        "total_monthly_cost": f"${total_monthly_cost:.2f}" if total_monthly_cost is not None else "$0.00",
-        "total_yearly_cost": f"${total_yearly_cost:.2f}" if total_yearly_cost is not None else "$0.00",
+        "total_monthly_cost": f"${cents_to_str(total_monthly_cost)}",
+        "total_yearly_cost": f"${cents_to_str(total_yearly_cost)}",
         "subs_by_count": subs_by_count,
         "top_ten": top_ten,
         "currently_watching": currently_watching
     }
-    return render_template('index.html', **content)
+    return render_template('_dashboard.html', **content)
+
+
+@bp.route('/')
+@bp.route('/index')
+def index():
+    """
+    the dashboard fragment is served from the cache until a commit touches logs, media or subscriptions
+    """
+    dashboard = cache.get(DASHBOARD_CACHE_KEY)
+    if dashboard is None:
+        dashboard = render_dashboard()
+        cache.set(DASHBOARD_CACHE_KEY, dashboard)
+    if session.get('_flashes'):
+        # the page carries one-off messages, so it must not be revalidated as unchanged
+        return render_template('index.html', title='Home', dashboard=Markup(dashboard))
+
+    etag = hashlib.sha1(dashboard.encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(render_template('index.html', title='Home', dashboard=Markup(dashboard)))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
-@app.route('/subscription', methods=['GET', 'POST'])
+@bp.route('/subscription', methods=['GET', 'POST'])
 def subscription():
     form = SubscriptionForm()
     if form.validate_on_submit():
         sub = Subscription(
             name=form.name.data,
-            cost=f'{form.cost.data:.2f}',
+            cost_cents=to_cents(form.cost.data),
             payment_frequency=form.payment_frequency.data,
             active_date=form.active_date.data
         )
         db.session.add(sub)
+        aggregates.refresh_cost_totals()
         db.session.commit()
         flash('Subscription was added')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('subscriptionform.html', title='Subscription', form=form)
 
 
-@app.route('/subscription/update', methods=['GET', 'POST'])
+@bp.route('/subscription/update', methods=['GET', 'POST'])
 def subscription_update():
     form = EditSubscriptionForm()
     if request.method == 'POST':
         if form.validate_on_submit():
             existing_sub = db.session.get(Subscription, form.subscription.data)
             if form.cost.data:
-                existing_sub.cost = f'{form.cost.data:.2f}'
+                existing_sub.cost_cents = to_cents(form.cost.data)
             if form.payment_frequency.data != PaymentFrequency.no_change:
                 existing_sub.payment_frequency = form.payment_frequency.data
             if form.active_date.data:
                 existing_sub.active_date = form.active_date.data
             if form.inactive_date.data:
                 existing_sub.inactive_date = form.inactive_date.data
+            aggregates.refresh_cost_totals()
             db.session.commit()
             flash('Subscription was updated')
 
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         return render_template('subscriptionupdate.html', title='Update Subscription', form=form)
     else:
         return render_template('subscriptionupdate.html', title='Update Subscription', form=form)
@@ -70,34 +107,106 @@ def get_or_create_media_id(title, media_type):
     title = title.strip()
     existing_media = Media.get_by_title_type(title, media_type)
     if existing_media:
-        media_id = existing_media.id
-    else:
-        media = Media(title=title, type=media_type)
-        db.session.add(media)
-        db.session.commit()
-        media_id = media.id
+        return existing_media.id
+    # another worker may be creating the same media; the insert then waits for its commit and inserts nothing.
+    # It is not committed here, so the media and the log are committed together
+    media_id = db.session.scalar(
+        dialect.insert(Media).values(title=title, type=media_type).on_conflict_do_nothing().returning(Media.id)
+    )
+    if media_id is None:
+        media_id = Media.get_by_title_type(title, media_type).id
     return media_id
 
 
-@app.route('/log', methods=['GET', 'POST'])
+@bp.route('/log', methods=['GET', 'POST'])
 def log():
     form = LogForm()
     if form.validate_on_submit():
+        idempotency_key = request.headers.get('Idempotency-Key') or form.idempotency_key.data or None
+        if idempotency_key is not None and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            abort(400)
+        if current_app.config['LOG_WRITE_BEHIND']:
+            receipt = writer.submit({
+                'subscription_id': form.subscription.data,
+                'media_title': form.media_title.data,
+                'media_type': str(form.media_type.data),
+                'date': (form.date.data or date.today()).isoformat(),
+                'season': form.season_number.data,
+                'episode': form.episode_number.data,
+                'notes': form.notes.data,
+                'idempotency_key': idempotency_key
+            })
+            flash(f'Log was queued (receipt {receipt})')
+            return redirect(url_for('main.index'))
         media_id = get_or_create_media_id(form.media_title.data, form.media_type.data)
-        to_log = Log(
-            date=form.date.data,
-            subscription_id=form.subscription.data,
-            media_id=media_id,
-            season=form.season_number.data,
-            episode=form.episode_number.data,
-            notes=form.notes.data
-        )
-        db.session.add(to_log)
+        inserted = Log.insert([{
+            'date': form.date.data or date.today(),
+            'subscription_id': form.subscription.data,
+            'media_id': media_id,
+            'season': form.season_number.data,
+            'episode': form.episode_number.data,
+            'notes': form.notes.data or None,
+            'idempotency_key': idempotency_key
+        }])
+        aggregates.record_logs(inserted)
         db.session.commit()
-        flash('Log was submitted')
-        return redirect(url_for('index'))
+        flash('Log was submitted' if inserted else 'Log was already submitted')
+        return redirect(url_for('main.index'))
     return render_template('logform.html', title='Log', form=form)
 
-@app.route('/media', methods=['GET'])
+@bp.route('/log/bulk', methods=['POST'])
+def log_bulk():
+    """
+    accepts a JSON list of logs or a CSV body with a header row and inserts them in one transaction; with an
+    Idempotency-Key header, resending the same body inserts nothing
+    """
+    try:
+        format = 'csv' if request.mimetype == 'text/csv' else 'json'
+        rows = ingest.read_rows(io.StringIO(request.get_data(as_text=True)), format)
+        result = ingest.ingest_logs(rows, idempotency_key=request.headers.get('Idempotency-Key'))
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 400
+    return jsonify(result.to_dict()), 201
+
+@bp.route('/log/queue', methods=['GET'])
+def log_queue():
+    """
+    counts of the write-behind queue entries by status
+    """
+    return jsonify(writer.queue.counts())
+
+@bp.route('/log/queue/<receipt>', methods=['GET'])
+def log_queue_status(receipt):
+    status = writer.status(receipt)
+    if status is None:
+        return jsonify(error='unknown receipt'), 404
+    return jsonify(status)
+
+@bp.route('/export/<name>.<format>', methods=['GET'])
+def export_table(name, format):
+    """
+    streams the logs or subscriptions as CSV or NDJSON without loading them into memory first
+    """
+    if name not in export.EXPORTS or format not in export.FORMATS:
+        abort(404)
+    return Response(
+        stream_with_context(export.generate(name, format)),
+        mimetype=export.FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename={name}.{format}'}
+    )
+
+@bp.route('/media', methods=['GET'])
 def media():
-    pass
+    """
+    prefix search over media titles and descriptions for the log form's autocomplete, e.g. /media?q=flea&type=tv
+    """
+    try:
+        media_type = MediaType.coerce(request.args['type']) if request.args.get('type') else None
+        limit = max(1, min(int(request.args.get('limit', search.DEFAULT_LIMIT)), search.MAX_LIMIT))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    rows = search.search_media(request.args.get('q', ''), media_type, limit)
+    return jsonify(items=[
+        {'id': row.id, 'title': row.title, 'type': str(row.type), 'description': row.description} for row in rows
+    ])
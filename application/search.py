@@ -0,0 +1,167 @@
+import re
+
+import sqlalchemy as sa
+
+from application import db, dialect
+from application.models import Log, Media
+
+# External-content FTS5 indexes: they store only the tokens and read the text back from media and log.
+# The prefix indexes let 'fle*' be answered from the index instead of a scan of every term.
+CREATE_MEDIA_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+    title, description, content='media', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+)"""
+MEDIA_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS media_fts_insert AFTER INSERT ON media BEGIN
+        INSERT INTO media_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS media_fts_delete AFTER DELETE ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS media_fts_update AFTER UPDATE OF title, description ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO media_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END"""
+)
+# Most logs have no notes, so only the ones that do are indexed
+CREATE_LOG_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(
+    notes, content='log', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)"""
+LOG_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS log_fts_insert AFTER INSERT ON log WHEN new.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (rowid, notes) VALUES (new.id, new.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS log_fts_delete AFTER DELETE ON log WHEN old.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (log_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS log_fts_update_old AFTER UPDATE OF notes ON log WHEN old.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (log_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS log_fts_update_new AFTER UPDATE OF notes ON log WHEN new.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (rowid, notes) VALUES (new.id, new.notes);
+    END"""
+)
+
+# Title matches outrank description matches
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+# A lone word shorter than this would match too many terms to rank quickly, so it must match whole
+MIN_PREFIX_LENGTH = 2
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+media_fts = sa.table('media_fts', sa.column('rowid', sa.Integer))
+log_fts = sa.table('log_fts', sa.column('rowid', sa.Integer))
+
+
+def _listen(table, statements, drop):
+    for statement in statements:
+        sa.event.listen(table, 'after_create', sa.DDL(statement).execute_if(dialect='sqlite'))
+    sa.event.listen(table, 'before_drop', sa.DDL(f'DROP TABLE IF EXISTS {drop}').execute_if(dialect='sqlite'))
+
+
+_listen(Media.__table__, (CREATE_MEDIA_FTS, *MEDIA_FTS_TRIGGERS), 'media_fts')
+_listen(Log.__table__, (CREATE_LOG_FTS, *LOG_FTS_TRIGGERS), 'log_fts')
+
+
+def match_expression(text, prefix=True):
+    """
+    turns user input into an FTS5 query matching every word; the last word also matches as a prefix, so
+    'flea' finds 'Fleabag' while typing. Words are quoted, so FTS5 operators in the input are taken literally.
+    returns None when the input has no words
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix and (len(words[-1]) >= MIN_PREFIX_LENGTH or len(words) > 1):
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _contains_words(text, *columns):
+    """
+    condition for backends without FTS5: every word of text appears, case-insensitively, in one of the columns
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return sa.and_(*(sa.or_(*(column.icontains(word, autoescape=True) for column in columns)) for word in words))
+
+
+def search_media(text, type=None, limit=DEFAULT_LIMIT):
+    """
+    returns Media rows matching text in their title or description, best matches first; on backends other than
+    SQLite the words are matched as substrings and shorter titles rank first
+    """
+    if dialect.name() != dialect.SQLITE:
+        condition = _contains_words(text, Media.title, Media.description)
+        if condition is None:
+            return []
+        query = sa.select(Media.id, Media.title, Media.type, Media.description)\
+            .where(condition)\
+            .order_by(sa.func.length(Media.title), Media.id)\
+            .limit(limit)
+        if type is not None:
+            query = query.where(Media.type == type)
+        return db.session.execute(query).all()
+    match = match_expression(text)
+    if match is None:
+        return []
+    rank = sa.func.bm25(sa.literal_column('media_fts'), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+    query = sa.select(Media.id, Media.title, Media.type, Media.description)\
+        .select_from(media_fts)\
+        .join(Media, Media.id == media_fts.c.rowid)\
+        .where(sa.literal_column('media_fts').op('MATCH')(match))\
+        .order_by(rank, sa.func.length(Media.title), Media.id)\
+        .limit(limit)
+    if type is not None:
+        query = query.where(Media.type == type)
+    return db.session.execute(query).all()
+
+
+def search_logs(text, limit=DEFAULT_LIMIT):
+    """
+    returns logs whose notes match text, best matches first, with the matched words highlighted in snippet; on
+    backends other than SQLite the words are matched as substrings, newest first, and snippet is the whole note
+    """
+    if dialect.name() != dialect.SQLITE:
+        condition = _contains_words(text, Log.notes)
+        if condition is None:
+            return []
+        query = sa.select(Log.id, Log.date, Log.subscription_id, Media.title.label('media_title'), Log.notes,
+                          Log.notes.label('snippet'))\
+            .join(Media, Media.id == Log.media_id)\
+            .where(condition)\
+            .order_by(Log.date.desc(), Log.id.desc())\
+            .limit(limit)
+        return db.session.execute(query).all()
+    match = match_expression(text)
+    if match is None:
+        return []
+    snippet = sa.func.snippet(sa.literal_column('log_fts'), 0, '[', ']', '...', 12)
+    query = sa.select(Log.id, Log.date, Log.subscription_id, Media.title.label('media_title'), Log.notes,
+                      snippet.label('snippet'))\
+        .select_from(log_fts)\
+        .join(Log, Log.id == log_fts.c.rowid)\
+        .join(Media, Media.id == Log.media_id)\
+        .where(sa.literal_column('log_fts').op('MATCH')(match))\
+        .order_by(sa.func.bm25(sa.literal_column('log_fts')), Log.id.desc())\
+        .limit(limit)
+    return db.session.execute(query).all()
+
+
+def rebuild():
+    """
+    rebuilds both indexes from the media and log tables
+    """
+    if dialect.name() != dialect.SQLITE:
+        return
+    db.session.execute(sa.text("INSERT INTO media_fts (media_fts) VALUES ('rebuild')"))
+    db.session.execute(sa.text("INSERT INTO log_fts (log_fts) VALUES ('delete-all')"))
+    db.session.execute(sa.text('INSERT INTO log_fts (rowid, notes) SELECT id, notes FROM log WHERE notes IS NOT NULL'))
+    db.session.commit()
@@ -0,0 +1,156 @@
+from datetime import timedelta
+
+import sqlalchemy as sa
+from sqlalchemy import func as f
+
+from application import db, dialect
+from application.cache import cached
+from application.models import Log, LogRollup, Media, Subscription, Watermark
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+GRAINS = (DAY, WEEK, MONTH)
+
+BY_SUBSCRIPTION = 'subscription'
+BY_MEDIA = 'media'
+BY_TYPE = 'type'
+GROUPINGS = (BY_SUBSCRIPTION, BY_MEDIA, BY_TYPE)
+
+WATERMARK = 'log_rollup'
+
+
+def bucket_expression(grain, column):
+    """
+    SQL expression truncating a date column to the start of its bucket; weeks start on Monday
+    """
+    if grain == DAY:
+        return column
+    if grain == WEEK:
+        return dialect.week_start(column)
+    if grain == MONTH:
+        return dialect.month_start(column)
+    raise ValueError(f'unknown grain {grain!r}')
+
+
+def bucket_start(grain, day):
+    if grain == DAY:
+        return day
+    if grain == WEEK:
+        return day - timedelta(days=day.weekday())
+    if grain == MONTH:
+        return day.replace(day=1)
+    raise ValueError(f'unknown grain {grain!r}')
+
+
+def _add_to_rollup(grain, condition, session=None):
+    bucket = bucket_expression(grain, Log.date)
+    select = sa.select(sa.literal(grain), bucket, Log.subscription_id, Log.media_id, f.count())\
+        .where(condition)\
+        .group_by(bucket, Log.subscription_id, Log.media_id)
+    stmt = dialect.insert(LogRollup).from_select(['grain', 'bucket', 'subscription_id', 'media_id', 'count'], select)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LogRollup.grain, LogRollup.bucket, LogRollup.subscription_id, LogRollup.media_id],
+        set_={'count': LogRollup.count + stmt.excluded['count']}
+    )
+    (session or db.session).execute(stmt)
+
+
+def _fold(session):
+    """
+    folds the logs past the watermark into the rollups in session's transaction and returns how many were added;
+    the watermark is the highest log id seen rather than the newest date, because logs can be backdated
+    """
+    watermark = Watermark.get(WATERMARK, session)
+    newest = session.scalar(sa.select(f.max(Log.id))) or 0
+    if newest <= watermark:
+        return 0
+    # PostgreSQL hands out ids before commit, so a log with a lower id than newest may still be in flight and would
+    # be passed over for good; once the writers in flight are done, every log committed later has a higher id
+    dialect.lock_writes(Log.__table__, session)
+    newest = session.scalar(sa.select(f.max(Log.id))) or 0
+    # Claim the range first so a concurrent refresh can't fold the same logs in twice
+    if not Watermark.advance(WATERMARK, watermark, newest, session):
+        return 0
+    condition = Log.id.between(watermark + 1, newest)
+    added = session.scalar(sa.select(f.count()).where(condition))
+    for grain in GRAINS:
+        _add_to_rollup(grain, condition, session)
+    return added
+
+
+def refresh():
+    """
+    folds the logs added since the last refresh into the rollups and returns how many were added. It is reached
+    from read paths, so it commits in a session of its own and leaves whatever the caller's session has pending
+    alone; call it outside a transaction that has written logs, which it would wait on
+    """
+    with db.session.session_factory() as session:
+        added = _fold(session)
+        session.commit()
+    return added
+
+
+def rebuild():
+    """
+    discards the rollups and recomputes them from every log in the caller's transaction, which the caller commits
+    """
+    db.session.execute(sa.delete(LogRollup))
+    db.session.execute(sa.delete(Watermark).where(Watermark.name == WATERMARK))
+    return _fold(db.session)
+
+
+def rebuild_media(media_ids):
+    """
+    recomputes the rollups of media_ids from their logs up to the watermark, after logs moved between media
+    """
+    db.session.execute(sa.delete(LogRollup).where(LogRollup.media_id.in_(media_ids)))
+    watermark = Watermark.get(WATERMARK)
+    if watermark:
+        condition = sa.and_(Log.media_id.in_(media_ids), Log.id <= watermark)
+        for grain in GRAINS:
+            _add_to_rollup(grain, condition)
+
+
+def trim_watermark():
+    """
+    lowers the watermark to the highest log id left after logs were deleted: SQLite hands a deleted highest id out
+    again, and a new log under the watermark would never be folded in
+    """
+    newest = db.session.scalar(sa.select(f.max(Log.id))) or 0
+    db.session.execute(
+        sa.update(Watermark).where(Watermark.name == WATERMARK, Watermark.value > newest).values(value=newest)
+    )
+
+
+@cached('stats.counts')
+def counts(grain=MONTH, by=BY_TYPE, start=None, end=None):
+    """
+    returns (bucket, key, count) rows ordered by bucket, where key is the subscription name, media title or
+    media type depending on by; only the rollup rows within [start, end] are read
+    """
+    if grain not in GRAINS:
+        raise ValueError(f'unknown grain {grain!r}')
+    if by == BY_SUBSCRIPTION:
+        key = Subscription.name
+        join = (Subscription, LogRollup.subscription_id == Subscription.id)
+    elif by == BY_MEDIA:
+        key = Media.title
+        join = (Media, LogRollup.media_id == Media.id)
+    elif by == BY_TYPE:
+        key = Media.type
+        join = (Media, LogRollup.media_id == Media.id)
+    else:
+        raise ValueError(f'unknown grouping {by!r}')
+
+    refresh()
+    query = sa.select(LogRollup.bucket, key.label('key'), f.sum(LogRollup.count).label('count'))\
+        .join(*join)\
+        .where(LogRollup.grain == grain)\
+        .group_by(LogRollup.bucket, key)\
+        .order_by(LogRollup.bucket, sa.desc('count'), key)
+    if start is not None:
+        query = query.where(LogRollup.bucket >= bucket_start(grain, start))
+    if end is not None:
+        query = query.where(LogRollup.bucket <= end)
+    return db.session.execute(query).all()
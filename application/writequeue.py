@@ -0,0 +1,238 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from application import db, ingest
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+# Processed entries are kept this long so their receipts can still be looked up
+RETENTION_SECONDS = 24 * 60 * 60
+# An entry claimed longer ago than this belongs to a writer that died and is claimed again
+CLAIM_TIMEOUT_SECONDS = 5 * 60
+
+
+class LogQueue:
+    """
+    durable queue of log submissions in a local SQLite file; WAL with synchronous=NORMAL makes an enqueue an append
+    to the WAL rather than an fsync. Every process on the host shares the file, and each entry is claimed by one
+    writer before it is written
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS entry (id INTEGER PRIMARY KEY AUTOINCREMENT, receipt TEXT NOT NULL UNIQUE, '
+            'payload TEXT NOT NULL, status TEXT NOT NULL, error TEXT, created REAL NOT NULL, processed REAL, '
+            'claimed REAL)'
+        )
+        columns = {row[1] for row in self._connection().execute('pragma table_info(entry)')}
+        if 'claimed' not in columns:
+            self._connection().execute('ALTER TABLE entry ADD COLUMN claimed REAL')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS ix_entry_status ON entry (status, id)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # a forked process opens its own connection rather than share the one it inherited
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('pragma journal_mode=WAL')
+            connection.execute('pragma synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def put(self, row):
+        receipt = uuid.uuid4().hex
+        self._connection().execute(
+            'INSERT INTO entry (receipt, payload, status, created) VALUES (?, ?, ?, ?)',
+            (receipt, json.dumps(row), PENDING, time.time())
+        )
+        return receipt
+
+    def claim(self, limit):
+        """
+        marks up to limit of the oldest pending entries processing and returns their (id, payload), in one statement
+        so that two writers never claim the same entry. Entries claimed more than CLAIM_TIMEOUT_SECONDS ago are
+        claimed again; a row logged before its writer died carries the form's idempotency key and is skipped
+        """
+        now = time.time()
+        rows = self._connection().execute(
+            'UPDATE entry SET status = ?, claimed = ? WHERE id IN ('
+            'SELECT id FROM entry WHERE status = ? OR (status = ? AND claimed < ?) ORDER BY id LIMIT ?'
+            ') RETURNING id, payload',
+            (PROCESSING, now, PENDING, PROCESSING, now - CLAIM_TIMEOUT_SECONDS, limit)
+        ).fetchall()
+        return sorted(rows)
+
+    def release(self, ids):
+        """
+        returns claimed entries that were not written to the pending ones
+        """
+        self._connection().executemany(
+            'UPDATE entry SET status = ?, claimed = NULL WHERE id = ? AND status = ?',
+            [(PENDING, id, PROCESSING) for id in ids]
+        )
+
+    def mark(self, ids, status, error=None):
+        self._connection().executemany(
+            'UPDATE entry SET status = ?, error = ?, processed = ? WHERE id = ?',
+            [(status, error, time.time(), id) for id in ids]
+        )
+
+    def status(self, receipt):
+        row = self._connection().execute(
+            'SELECT status, error FROM entry WHERE receipt = ?', (receipt,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'receipt': receipt, 'status': row[0], 'error': row[1]}
+
+    def counts(self):
+        rows = self._connection().execute('SELECT status, count(*) FROM entry GROUP BY status').fetchall()
+        return {PENDING: 0, PROCESSING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def prune(self, older_than):
+        self._connection().execute(
+            'DELETE FROM entry WHERE status IN (?, ?) AND processed < ?', (DONE, FAILED, older_than)
+        )
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class LogWriter:
+    """
+    drains the queue in batched transactions from a background thread, started on the first submission in each
+    process; the queue is drained once more when the process exits
+    """
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._drain_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = LogQueue(self.app.config['LOG_QUEUE_PATH'])
+        return self._queue
+
+    def submit(self, row):
+        """
+        queues one raw log row (as accepted by ingest.ingest_logs) and returns its receipt id
+        """
+        receipt = self.queue.put(row)
+        self.start()
+        self._wake.set()
+        return receipt
+
+    def status(self, receipt):
+        return self.queue.status(receipt)
+
+    def drain(self):
+        """
+        writes every pending entry and returns how many were processed
+        """
+        processed = 0
+        with self._drain_lock:
+            while True:
+                entries = self.queue.claim(self.app.config['LOG_QUEUE_BATCH_SIZE'])
+                if not entries:
+                    break
+                try:
+                    with self.app.app_context():
+                        self._write(entries)
+                        db.session.remove()
+                except Exception:
+                    # the entries not written yet go to the next drain, in this process or another
+                    self.queue.release([id for id, _ in entries])
+                    raise
+                processed += len(entries)
+            self.queue.prune(time.time() - RETENTION_SECONDS)
+        return processed
+
+    def _write(self, entries):
+        try:
+            ingest.ingest_logs([json.loads(payload) for _, payload in entries])
+            self.queue.mark([id for id, _ in entries], DONE)
+            return
+        except (KeyError, TypeError, ValueError, sa.exc.SQLAlchemyError):
+            db.session.rollback()
+        # an invalid row, or one the database rejects, fails the whole batch, so fall back to one transaction per
+        # entry to isolate it
+        for id, payload in entries:
+            try:
+                ingest.ingest_logs([json.loads(payload)])
+                self.queue.mark([id], DONE)
+            except sa.exc.OperationalError:
+                # the database is locked or unreachable rather than the entry invalid, so it is retried
+                db.session.rollback()
+                raise
+            except (KeyError, TypeError, ValueError, sa.exc.SQLAlchemyError) as e:
+                db.session.rollback()
+                self.queue.mark([id], FAILED, str(e))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self._wake.wait(self.app.config['LOG_QUEUE_INTERVAL']) and not self._stopping.is_set():
+                # waiting a moment after the first submission lets a burst share one transaction
+                self._stopping.wait(self.app.config['LOG_QUEUE_INTERVAL'])
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception('log queue drain failed')
+
+    def start(self):
+        # a forked worker inherits the parent's thread object but not the thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stops the background thread and writes whatever is still pending
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join()
+        self._thread = None
+        if self._queue is not None:
+            try:
+                self.drain()
+            except Exception:
+                # what is left stays queued for the next drain
+                self.app.logger.exception('log queue drain failed')
+
+    def close(self):
+        self.stop()
+        if self._queue is not None:
+            self._queue.close()
+            self._queue = None
+
+
+writer = LogWriter()
+atexit.register(writer.stop)
@@ -0,0 +1,119 @@
+"""
+Synthetic dataset generator: subscriptions, a media catalog and a log history with skewed popularity.
+
+    python benchmarks/datagen.py /tmp/bench.db --subscriptions 20 --media 50000 --logs 2000000
+
+A few titles get most of the views (Zipf-like weights), tv titles are watched episode by episode through their seasons,
+and logs are spread over the requested number of years.
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHUNK_SIZE = 50000
+TV_SHARE = 0.6
+
+
+def _cumulative_weights(n, skew):
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+
+
+def _pick(rng, cumulative):
+    return bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+
+
+def _logs(rng, subscriptions, media, logs, years, skew):
+    """
+    yields (date, subscription_id, media_id, season, episode) rows in date order
+    """
+    media_weights = _cumulative_weights(media, skew)
+    subscription_weights = _cumulative_weights(subscriptions, 1.0)
+    # each title streams on one service and a tv title resumes where it was left
+    home = {}
+    progress = {}
+    start = date.today() - timedelta(days=365 * years)
+    days = 365 * years
+    for i in range(logs):
+        day = start + timedelta(days=i * days // logs)
+        media_id = _pick(rng, media_weights) + 1
+        if media_id not in home:
+            home[media_id] = _pick(rng, subscription_weights) + 1
+        if media_id % 10 < TV_SHARE * 10:
+            season, episode = progress.get(media_id, (1, 0))
+            episode += 1
+            if episode > 10:
+                season, episode = season + 1, 1
+            progress[media_id] = (season, episode)
+        else:
+            season = episode = None
+        yield day.isoformat(), home[media_id], media_id, season, episode
+
+
+def generate(path, subscriptions=20, media=10000, logs=200000, years=3, skew=1.1, seed=0):
+    """
+    creates the schema in the SQLite file at path and fills it; returns the seconds taken
+    """
+    import sqlalchemy as sa
+    from application import db
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    db.metadata.create_all(sa.create_engine(f'sqlite:///{path}'))
+    connection = sqlite3.connect(path)
+    connection.execute('pragma journal_mode=WAL')
+    connection.execute('pragma synchronous=OFF')
+    first_day = date.today() - timedelta(days=365 * years)
+    subscriptions_rows = [(f'Service {i}', rng.randrange(0, 2500), rng.choice(('monthly', 'yearly')))
+                          for i in range(subscriptions)]
+    connection.executemany(
+        'INSERT INTO subscription (name, cost_cents, payment_frequency, active_date) VALUES (?, ?, ?, ?)',
+        ((name, cost, frequency, first_day.isoformat()) for name, cost, frequency in subscriptions_rows)
+    )
+    # a price rise every year, ending at the current cost
+    connection.executemany(
+        'INSERT INTO subscription_price (subscription_id, effective_date, cost_cents, payment_frequency) '
+        'VALUES (?, ?, ?, ?)',
+        ((id, (first_day + timedelta(days=365 * year)).isoformat(), cost * (10 + year) // (10 + years - 1), frequency)
+         for id, (_, cost, frequency) in enumerate(subscriptions_rows, start=1) for year in range(years))
+    )
+    connection.executemany(
+        'INSERT INTO media (title, type) VALUES (?, ?)',
+        ((f'Title {i}', 'tv' if i % 10 < TV_SHARE * 10 else 'film') for i in range(1, media + 1))
+    )
+    rows = _logs(rng, subscriptions, media, logs, years, skew)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        connection.executemany(
+            'INSERT INTO log (date, subscription_id, media_id, season, episode) VALUES (?, ?, ?, ?, ?)', chunk
+        )
+    connection.commit()
+    connection.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--subscriptions', type=int, default=20)
+    parser.add_argument('--media', type=int, default=10000)
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of title popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    seconds = generate(args.path, args.subscriptions, args.media, args.logs, args.years, args.skew, args.seed)
+    print(f'Generated {args.logs} logs in {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Times the duplicate-media job on a synthetic catalog: finding the merges and applying them to a SQLite database.
+
+    python benchmarks/dedup.py --titles 300000 --duplicates 0.05
+
+Titles are one to five words, drawn with Zipf weights from a vocabulary of random words with English letter
+frequencies, some with a number. A share of them gets a variant: different
+case, punctuation, accents, a letter dropped or two letters swapped.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# English letter frequencies, per thousand letters
+LETTERS = 'etaoinshrdlcumwfgypbvkjxqz'
+LETTER_WEIGHTS = [127, 91, 82, 75, 70, 67, 63, 61, 60, 43, 40, 28, 28, 24, 24, 22, 20, 20, 19, 15, 10, 8, 2, 2, 1, 1]
+
+
+def word(rng):
+    return ''.join(rng.choices(LETTERS, LETTER_WEIGHTS, k=rng.randint(2, 9)))
+
+
+def variant(rng, title):
+    change = rng.randrange(5)
+    if change == 0:
+        return title.upper() + ' '
+    if change == 1:
+        return title.replace(' ', ': ', 1) + '!'
+    if change == 2:
+        return title.replace('e', 'é')
+    i = rng.randrange(len(title) - 1)
+    if change == 3:
+        return title[:i] + title[i + 2:]
+    return title[:i] + title[i + 1] + title[i] + title[i + 2:]
+
+
+def catalog(rng, titles, duplicates):
+    vocabulary = [word(rng) for _ in range(50000)]
+    # a few words are in many titles, like "the" and "love"
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    seen = set()
+    rows = []
+    while len(seen) < titles:
+        words = rng.choices(vocabulary, cum_weights=weights, k=rng.randint(1, 5))
+        if rng.random() < 0.1:
+            words.append(str(rng.randint(2, 9)))
+        title = ' '.join(words).title()
+        if title in seen:
+            continue
+        seen.add(title)
+        rows.append((title, rng.choice(('tv', 'film'))))
+        if rng.random() < duplicates:
+            rows.append((variant(rng, title), rows[-1][1]))
+    return rows
+
+
+def setup(path, rows, logs, rng):
+    import sqlalchemy as sa
+    from application import db
+
+    db.metadata.create_all(sa.create_engine(f'sqlite:///{path}'))
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO subscription (name, cost_cents, payment_frequency, active_date) "
+                       "VALUES ('Service', 999, 'monthly', date('now'))")
+    connection.executemany('INSERT OR IGNORE INTO media (title, type) VALUES (?, ?)', rows)
+    media = connection.execute('SELECT max(id) FROM media').fetchone()[0]
+    connection.executemany('INSERT INTO log (date, subscription_id, media_id) VALUES (?, 1, ?)',
+                           ((date.today().isoformat(), rng.randint(1, media)) for _ in range(logs)))
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--duplicates', type=float, default=0.05, help='share of titles given a variant')
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--threshold', type=float)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = catalog(rng, args.titles, args.duplicates)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        # must be set before config.py is imported
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+        os.environ['SQL_INSTRUMENTATION'] = '0'
+        setup(path, rows, args.logs, rng)
+
+        from application import create_app, aggregates, dedup
+        threshold = args.threshold if args.threshold is not None else dedup.DEFAULT_THRESHOLD
+        with create_app().app_context():
+            aggregates.rebuild()
+            start = time.perf_counter()
+            merges = dedup.find_merges(threshold)
+            find_seconds = time.perf_counter() - start
+            result = dedup.merge(merges)
+
+    print(json.dumps({
+        'media': len(rows),
+        'variants': len(rows) - args.titles,
+        'threshold': threshold,
+        'merges': len(merges),
+        'duplicates_found': sum(len(merge.duplicates) for merge in merges),
+        'find_seconds': round(find_seconds, 2),
+        **{f'merge_{key}': value for key, value in result.to_dict().items()}
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Times the model classmethods and the routes against a synthetic dataset and writes the results as JSON.
+
+    python benchmarks/run.py --logs 1000000 --output bench.json
+    python benchmarks/run.py --compare before.json after.json
+
+To compare backends, run it once as above and once against an empty PostgreSQL database, then --compare the two
+result files; the generated dataset is copied into the server first:
+
+    python benchmarks/run.py --database-url postgresql+psycopg://localhost/subscriptions_bench -o postgres.json
+
+Every benchmark records latency percentiles and the number of SQL statements per call.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def at(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+    return {
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': at(0.5),
+        'p90_ms': at(0.9),
+        'p99_ms': at(0.99),
+        'max_ms': round(latencies[-1] * 1000, 3)
+    }
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        import sqlalchemy as sa
+        self.count = 0
+        sa.event.listen(engine, 'before_cursor_execute', self)
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def measure(name, func, iterations, counter, reset):
+    latencies = []
+    queries = []
+    for i in range(iterations):
+        before = counter.count
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+        queries.append(counter.count - before)
+        reset()
+    return {'name': name, 'iterations': iterations, 'queries_per_call': max(queries), **percentiles(latencies)}
+
+
+def benchmarks(db, client):
+    from application import costs, stats
+    from application.cache import cache
+    from application.models import Log, Media, MediaStat, MediaType, Subscription, SubscriptionStat
+
+    sub = Subscription.get()[0]
+    media = db.session.get(Media, 1)
+    sub_id, sub_name, media_id, media_title = sub.id, sub.name, media.id, media.title
+    db.session.rollback()
+
+    def index(i):
+        cache.clear()
+        client.get('/index')
+
+    yield 'Subscription.get', lambda i: Subscription.get(orderby=Subscription.monthly_cost_cents.desc())
+    yield 'Subscription.rows', lambda i: Subscription.rows()
+    yield 'Subscription.get_by_name', lambda i: Subscription.get_by_name(sub_name)
+    yield 'Subscription.total_monthly_cost', lambda i: Subscription.total_monthly_cost()
+    yield 'Subscription.total_yearly_cost', lambda i: Subscription.total_yearly_cost()
+    yield 'Media.get_by_title_type', lambda i: Media.get_by_title_type(media_title, MediaType.tv)
+    yield 'Log.get_by_sub_id', lambda i: Log.get_by_sub_id(sub_id)
+    yield 'Log.get_by_media_id', lambda i: Log.get_by_media_id(media_id)
+    yield 'Log.get_by_sub_and_media', lambda i: Log.get_by_sub_and_media(sub_id, media_id)
+    yield 'Log.rows (sub_id)', lambda i: Log.rows(sub_id=sub_id)
+    yield 'Log.rows (media_id)', lambda i: Log.rows(media_id=media_id)
+    yield 'Log.most_logged_subs', lambda i: Log.most_logged_subs()
+    yield 'Log.most_logged_media', lambda i: Log.most_logged_media()
+    yield 'Log.currently_watching', lambda i: Log.currently_watching()
+    yield 'SubscriptionStat.most_logged', lambda i: SubscriptionStat.most_logged()
+    yield 'MediaStat.most_logged', lambda i: MediaStat.most_logged(limit=10)
+    yield 'MediaStat.currently_watching', lambda i: MediaStat.currently_watching()
+    yield 'stats.counts', lambda i: (cache.clear(), stats.counts(stats.MONTH, stats.BY_TYPE))
+    yield 'costs.spend (3 years)', lambda i: (cache.clear(), costs.spend(date.today().replace(year=date.today().year - 3),
+                                                                         date.today()))
+    yield 'costs.value_for_money (1 year)', lambda i: (cache.clear(), costs.value_for_money(
+        date.today() - timedelta(days=364), date.today()))
+    yield 'GET /index (cold cache)', index
+    yield 'GET /index (warm cache)', lambda i: client.get('/index')
+    yield 'GET /log', lambda i: client.get('/log')
+    yield 'POST /log', lambda i: client.post('/log', data={
+        'subscription': sub_id, 'media_title': f'Benchmark title {i % 50}', 'media_type': 'tv',
+        'date': date.today().isoformat(), 'season_number': 1, 'episode_number': i
+    })
+    yield 'POST /subscription', lambda i: client.post('/subscription', data={
+        'name': f'Benchmark service {i}', 'cost': '9.99', 'payment_frequency': 'monthly'
+    })
+    yield 'POST /subscription/update', lambda i: client.post('/subscription/update', data={
+        'subscription': sub_id, 'cost': f'{10 + i % 5}.99', 'payment_frequency': 'no change'
+    })
+
+
+def copy_to_server(path):
+    """
+    recreates the schema in the configured server database and bulk loads the SQLite dataset at path into it
+    """
+    import sqlalchemy as sa
+    from application import db, dialect
+
+    db.drop_all()
+    db.create_all()
+    source = sa.create_engine(f'sqlite:///{path}')
+    with source.connect() as connection:
+        for table in db.metadata.sorted_tables:
+            # generated columns are computed again by the server
+            columns = [column.name for column in table.columns if column.computed is None]
+            result = connection.exec_driver_sql(f'SELECT {", ".join(columns)} FROM {table.name}')
+            while rows := result.fetchmany(50000):
+                dialect.copy_rows(table, [dict(zip(columns, row)) for row in rows])
+            if 'id' in table.c and table.c.id.primary_key:
+                db.session.execute(sa.text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), coalesce(max(id), 1)) FROM {table.name}"
+                ))
+    db.session.commit()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    # the database is left behind in the temp dir for inspection
+    directory = tempfile.mkdtemp(prefix='subscriptions-bench-')
+    path = os.path.join(directory, 'bench.db')
+    # must be set before config.py is imported
+    os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{path}'
+    os.environ.setdefault('CACHE_BACKEND', 'memory')
+
+    import datagen
+    generation_seconds = datagen.generate(path, args.subscriptions, args.media, args.logs, args.years, args.skew, args.seed)
+
+    from application import create_app, db, aggregates
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = []
+    with app.app_context():
+        if args.database_url:
+            copy_to_server(path)
+        backend = db.engine.dialect.name
+        aggregates.rebuild()
+        counter = QueryCounter(db.engine)
+        client = app.test_client()
+        for name, func in benchmarks(db, client):
+            if args.filter and args.filter not in name:
+                continue
+            results.append(measure(name, func, args.iterations, counter, db.session.rollback))
+            print(f"{name:<36} p50 {results[-1]['p50_ms']:>9.3f}ms  p99 {results[-1]['p99_ms']:>9.3f}ms  "
+                  f"{results[-1]['queries_per_call']} queries", file=sys.stderr)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'backend': backend,
+        'dataset': {
+            'subscriptions': args.subscriptions, 'media': args.media, 'logs': args.logs,
+            'years': args.years, 'skew': args.skew, 'seed': args.seed,
+            'generation_seconds': round(generation_seconds, 2)
+        },
+        'results': results
+    }
+
+
+def compare(before_path, after_path):
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before = {r['name']: r for r in json.load(before_file)['results']}
+        after = {r['name']: r for r in json.load(after_file)['results']}
+    print(f"{'benchmark':<36} {'p50 before':>12} {'p50 after':>12} {'change':>8} {'queries':>9}")
+    for name in after:
+        if name not in before:
+            continue
+        old, new = before[name]['p50_ms'], after[name]['p50_ms']
+        change = f'{(new - old) / old * 100:+.0f}%' if old else 'n/a'
+        queries = f"{before[name]['queries_per_call']}->{after[name]['queries_per_call']}"
+        print(f'{name:<36} {old:>10.3f}ms {new:>10.3f}ms {change:>8} {queries:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscriptions', type=int, default=20)
+    parser.add_argument('--media', type=int, default=10000)
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--database-url', help='an empty PostgreSQL database to run against instead of SQLite')
+    parser.add_argument('--output', '-o', help='JSON file for the results; stdout by default')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Measures requests per second on GET / and POST /log served by gunicorn (gunicorn.conf.py) as the number of worker
+processes grows, against one generated SQLite (WAL) database or a server database.
+
+    python benchmarks/serve.py --workers 1 2 4 8 --seconds 10
+    python benchmarks/serve.py --database-url postgresql+psycopg://localhost/subscriptions_bench
+
+The load comes from --clients processes per worker on the same machine, each sending requests one after another
+over a keep-alive connection, so leave cores free for them or the clients become the bottleneck.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ('index', 'log')
+
+
+def setup(path, args):
+    """
+    generates the dataset at path, or copies it into the --database-url server, and fills the aggregates
+    """
+    import datagen
+    from run import copy_to_server
+
+    datagen.generate(path, args.subscriptions, args.media, args.logs, args.years)
+    from application import create_app, db, aggregates
+    with create_app().app_context():
+        if args.database_url:
+            copy_to_server(path)
+        aggregates.rebuild()
+        db.session.commit()
+
+
+def start_server(workers, threads, port, env):
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+                               '--threads', str(threads), '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+                              cwd=ROOT, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/index')
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def client(port, endpoint, seconds, results):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    cookie = None
+
+    def send(method, path, body=None):
+        nonlocal cookie
+        headers = {'Cookie': cookie} if cookie else {}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        cookie = (response.getheader('Set-Cookie') or cookie or '').split(';')[0] or None
+        return response.status, response.read().decode()
+
+    # a session cookie and its CSRF token, reused by every POST
+    _, page = send('GET', '/log')
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+    subscription = re.search(r'<option value="(\d+)"', page).group(1)
+
+    ok = errors = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        if endpoint == 'index':
+            status, _ = send('GET', '/index')
+        else:
+            status, _ = send('POST', '/log', urllib.parse.urlencode({
+                'csrf_token': token, 'subscription': subscription, 'media_title': f'Benchmark title {ok % 50}',
+                'media_type': 'tv', 'date': date.today().isoformat(), 'season_number': 1, 'episode_number': ok,
+                'idempotency_key': uuid.uuid4().hex
+            }))
+        latencies.append(time.perf_counter() - start)
+        if status < 400:
+            ok += 1
+        else:
+            errors += 1
+    results.put((ok, errors, latencies))
+
+
+def load(port, endpoint, clients, seconds):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client, args=(port, endpoint, seconds, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    latencies = sorted(latency for r in collected for latency in r[2])
+    return {
+        'requests_per_second': round(sum(r[0] for r in collected) / seconds, 1),
+        'errors': sum(r[1] for r in collected),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', help='worker counts to run; 1, 2, 4, ... up to the cores by default')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=2, help='client processes per worker')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--subscriptions', type=int, default=20)
+    parser.add_argument('--media', type=int, default=10000)
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--database-url', help='an empty server database to run against instead of SQLite')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    cores = multiprocessing.cpu_count()
+    worker_counts = args.workers or sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        env = dict(os.environ, DATABASE_URL=args.database_url or f'sqlite:///{path}',
+                   CACHE_PATH=os.path.join(directory, 'cache.db'),
+                   LOG_QUEUE_PATH=os.path.join(directory, 'log_queue.db'))
+        # writers queueing for the SQLite lock would otherwise be logged as slow queries
+        env.setdefault('SLOW_QUERY_MS', '5000')
+        # must be set before config.py is imported
+        os.environ.update(env)
+        setup(path, args)
+
+        for workers in worker_counts:
+            server = start_server(workers, args.threads, args.port, env)
+            try:
+                for endpoint in ENDPOINTS:
+                    result = load(args.port, endpoint, workers * args.clients, args.seconds)
+                    print(json.dumps({'endpoint': endpoint, 'workers': workers, 'threads': args.threads,
+                                      'cores': cores, **result}), flush=True)
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
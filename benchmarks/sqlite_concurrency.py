@@ -0,0 +1,125 @@
+"""
+Measures read/write throughput of concurrent processes on one SQLite file under each pragma profile.
+
+    python benchmarks/sqlite_concurrency.py --readers 4 --writers 2 --seconds 5
+
+Readers run the dashboard's most-logged query, writers insert one log per transaction.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SQLITE_PROFILES  # noqa: E402
+
+READ_SQL = 'SELECT subscription.name, count(*) AS count FROM subscription JOIN log ON log.subscription_id = subscription.id ' \
+           'GROUP BY subscription.name ORDER BY count DESC'
+WRITE_SQL = "INSERT INTO log (date, subscription_id, media_id) VALUES (date('now'), ?, ?)"
+
+
+def connect(path, pragmas):
+    # timeout=0 leaves waiting for locks to the profile's busy_timeout
+    connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+    for name, value in pragmas.items():
+        connection.execute(f'pragma {name}={value}')
+    return connection
+
+
+def setup(path, logs):
+    import sqlalchemy as sa
+    from application import db
+
+    db.metadata.create_all(sa.create_engine(f'sqlite:///{path}'))
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO subscription (name, cost_cents, payment_frequency, active_date) VALUES (?, 999, 'monthly', date('now'))",
+        ((f'Service {i}',) for i in range(10))
+    )
+    connection.executemany("INSERT INTO media (title, type) VALUES (?, 'tv')", ((f'Title {i}',) for i in range(100)))
+    connection.executemany(WRITE_SQL, ((i % 10 + 1, i % 100 + 1) for i in range(logs)))
+    connection.commit()
+    connection.close()
+
+
+def worker(kind, path, pragmas, seconds, results):
+    connection = connect(path, pragmas)
+    ops = errors = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            if kind == 'read':
+                connection.execute(READ_SQL).fetchall()
+            else:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute(WRITE_SQL, (ops % 10 + 1, ops % 100 + 1))
+                connection.execute('COMMIT')
+            ops += 1
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            errors += 1
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+    results.put((kind, ops, errors, latencies))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(profile, readers, writers, seconds, logs):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        setup(path, logs)
+        pragmas = SQLITE_PROFILES[profile]
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=('read', path, pragmas, seconds, results))
+                     for _ in range(readers)]
+        processes += [multiprocessing.Process(target=worker, args=('write', path, pragmas, seconds, results))
+                      for _ in range(writers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    summary = {'profile': profile}
+    for kind in ('read', 'write'):
+        ops = sum(r[1] for r in collected if r[0] == kind)
+        latencies = [latency for r in collected if r[0] == kind for latency in r[3]]
+        summary[kind] = {
+            'ops_per_second': round(ops / seconds, 1),
+            'errors': sum(r[2] for r in collected if r[0] == kind),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--logs', type=int, default=100000, help='log rows in the table before the run')
+    parser.add_argument('--profile', choices=[*SQLITE_PROFILES, 'both'], default='both')
+    args = parser.parse_args()
+
+    profiles = list(SQLITE_PROFILES) if args.profile == 'both' else [args.profile]
+    for profile in profiles:
+        print(json.dumps(run(profile, args.readers, args.writers, args.seconds, args.logs)))
+
+
+if __name__ == '__main__':
+    main()
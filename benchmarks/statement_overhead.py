@@ -0,0 +1,95 @@
+"""
+Measures the Python-side cost per call of the hot lookups: building the statement on every call, as the model
+classmethods used to, against executing their prebuilt bound-parameter statements.
+
+    python benchmarks/statement_overhead.py --iterations 5000
+
+The database is an in-memory SQLite with a handful of rows, so the times are almost entirely SQLAlchemy overhead.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def per_call(func, iterations):
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def cases(db):
+    import sqlalchemy as sa
+    from sqlalchemy import func as f
+    from application.models import Log, Media, MediaStat, MediaType, Subscription
+
+    def inline_get_by_name():
+        query = sa.select(Subscription).filter(f.lower(Subscription.name) == 'netflix')
+        return db.session.scalar(query)
+
+    def inline_get_by_title_type():
+        query = sa.select(Media).where(f.lower(Media.title) == 'fleabag', Media.type == MediaType.tv)
+        return db.session.scalar(query)
+
+    def inline_total_monthly():
+        query = sa.select(f.sum(Subscription.monthly_cost_cents)).filter(Subscription.inactive_date.is_(None))
+        return db.session.scalar(query)
+
+    def inline_most_logged_subs():
+        query = sa.select(Subscription.name, sa.func.count().label("count"))\
+            .join(Log, Log.subscription_id == Subscription.id)\
+            .group_by(Subscription.name)\
+            .order_by(sa.desc("count"))
+        return db.session.execute(query).all()
+
+    def inline_currently_watching():
+        query = sa.select(Media.id, Media.title, Media.type, MediaStat.last_date, MediaStat.last_season,
+                          MediaStat.last_episode)\
+            .join(Media, MediaStat.media_id == Media.id)\
+            .where(MediaStat.last_date.is_not(None))\
+            .order_by(MediaStat.last_date.desc(), MediaStat.media_id.desc())\
+            .limit(10)
+        return db.session.execute(query).all()
+
+    yield 'Subscription.get_by_name', inline_get_by_name, lambda: Subscription.get_by_name('Netflix')
+    yield 'Media.get_by_title_type', inline_get_by_title_type, \
+        lambda: Media.get_by_title_type('Fleabag', MediaType.tv)
+    yield 'Subscription.total_monthly_cost_cents', inline_total_monthly, Subscription.total_monthly_cost_cents
+    yield 'Log.most_logged_subs', inline_most_logged_subs, Log.most_logged_subs
+    yield 'MediaStat.currently_watching', inline_currently_watching, MediaStat.currently_watching
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    # must be set before config.py is imported
+    os.environ['DATABASE_URL'] = 'sqlite://'
+    os.environ['SQL_INSTRUMENTATION'] = '0'
+    from application import create_app, db, ingest
+    from application.models import PaymentFrequency, Subscription
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add(Subscription(name='Netflix', cost=15.49, payment_frequency=PaymentFrequency.monthly,
+                                    active_date=date(2024, 1, 1)))
+        db.session.commit()
+        ingest.ingest_logs([{'subscription': 'Netflix', 'media_title': 'Fleabag', 'media_type': 'tv',
+                             'date': '2024-02-01', 'season_number': 1, 'episode_number': n} for n in range(1, 7)])
+        db.session.commit()
+
+        print(f"{'lookup':<40} {'built per call':>15} {'prebuilt':>10} {'change':>8}")
+        for name, inline, prebuilt in cases(db):
+            before, after = per_call(inline, args.iterations), per_call(prebuilt, args.iterations)
+            print(f'{name:<40} {before:>13.1f}us {after:>8.1f}us {(after - before) / before * 100:>+7.0f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,78 @@ import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Applied to every new SQLite connection, in order
+SQLITE_DEFAULT_PRAGMAS = {
+    'foreign_keys': 'ON'
+}
+SQLITE_PERFORMANCE_PRAGMAS = {
+    # wait for locks instead of failing with "database is locked"; set first so the journal switch waits too
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+    # readers no longer block behind the writer, and commits append to the WAL instead of rewriting pages
+    'journal_mode': 'WAL',
+    # in WAL mode only checkpoints fsync; a power loss can drop the last commits but never corrupts
+    'synchronous': 'NORMAL',
+    # negative is KiB: 64MB page cache per connection
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY'
+}
+SQLITE_PROFILES = {
+    'default': SQLITE_DEFAULT_PRAGMAS,
+    'performance': SQLITE_PERFORMANCE_PRAGMAS
+}
+
+
+def engine_options(database_uri):
+    """
+    the compiled statement cache size, plus pool settings for file-based SQLite and database servers; in-memory
+    databases keep Flask-SQLAlchemy's single shared connection
+    """
+    # compiled statements kept per engine; the default of 500 is more than the app's distinct statements, but
+    # the report queries vary with their date ranges and would otherwise evict the hot lookups
+    options = {'query_cache_size': int(os.environ.get('SQLALCHEMY_QUERY_CACHE_SIZE', 1200))}
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return options
+    options.update({
+        'pool_size': int(os.environ.get('SQLALCHEMY_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', 10)),
+        'pool_timeout': 30
+    })
+    if not database_uri.startswith('sqlite'):
+        # server connections can be closed under an idle pool
+        options['pool_pre_ping'] = True
+    return options
+
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'temp-password')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(basedir, 'app.db')}")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+
+    # 'performance' or 'default' (foreign keys only)
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'performance')
+    SQLITE_PRAGMAS = SQLITE_PROFILES[SQLITE_PROFILE]
+
+    # Dashboard and query result cache: 'memory' (per process), 'sqlite' (shared file) or 'none'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+    CACHE_MAX_ENTRIES = 512
+    CACHE_PATH = os.environ.get('CACHE_PATH', os.path.join(basedir, 'cache.db'))
+
+    # Estimated hours per log of each media type (an episode or a film) for cost-per-hour reports
+    WATCH_HOURS = {'tv': 0.75, 'film': 2.0}
+
+    # Per-request SQL counts and timings, the Server-Timing header and /metrics
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '1') == '1'
+    # Statements slower than this are logged with their parameters
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    # A request running the same statement this many times is reported as a possible N+1
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+
+    # Write-behind logging: /log submissions are queued in a local SQLite file and written in batches
+    LOG_WRITE_BEHIND = os.environ.get('LOG_WRITE_BEHIND', '0') == '1'
+    LOG_QUEUE_PATH = os.environ.get('LOG_QUEUE_PATH', os.path.join(basedir, 'log_queue.db'))
+    LOG_QUEUE_BATCH_SIZE = int(os.environ.get('LOG_QUEUE_BATCH_SIZE', 500))
+    # Seconds between drains, and how long a burst is gathered before it is written
+    LOG_QUEUE_INTERVAL = float(os.environ.get('LOG_QUEUE_INTERVAL', 0.5))
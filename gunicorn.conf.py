@@ -0,0 +1,23 @@
+"""
+gunicorn settings: a pre-fork server with WEB_CONCURRENCY worker processes of GUNICORN_THREADS threads each.
+
+The app is loaded once in the master and forked into the workers. Nothing connects to the database while the app
+is built, and create_app disposes the engine pools in every forked child, so each worker opens its own connections;
+the SQLite cache and log queue files are likewise opened per process on first use.
+"""
+import multiprocessing
+import os
+
+# with several worker processes the per-process memory cache would keep serving a dashboard another worker has
+# since written to, until CACHE_TTL; the SQLite cache file is shared and cleared on every write
+os.environ.setdefault('CACHE_BACKEND', 'sqlite')
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# more than one thread selects the gthread worker; a thread waiting on the database releases the GIL
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+# keep-alive connections from a reverse proxy
+keepalive = 5
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -45,6 +46,16 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+def include_name(name, type_, parent_names):
+    # the FTS5 tables (and their shadow tables) are managed by hand in migrations, not by the models
+    if type_ == 'table':
+        return not re.match(r'(media|log)_fts(_|$)', name)
+    # the optional natural key index is created and dropped by the log-natural-key command
+    if type_ == 'index':
+        return name != 'ux_log_natural_key'
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -97,9 +108,16 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # batch migrations recreate tables, which would trip the foreign keys
+            # enabled by the connect listener in application/__init__.py
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
+            include_name=include_name,
             **conf_args
         )
 
@@ -0,0 +1,32 @@
+"""case-insensitive lookup indexes
+
+Revision ID: 3b433aceb926
+Revises: e5c510015569
+Create Date: 2026-10-18 10:48:55.204417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b433aceb926'
+down_revision = 'e5c510015569'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('media', schema=None) as batch_op:
+        batch_op.create_index('ix_media_lower_title_type', [sa.text('lower(title)'), 'type'], unique=False)
+
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.create_index('ix_subscription_lower_name', [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.drop_index('ix_subscription_lower_name')
+
+    with op.batch_alter_table('media', schema=None) as batch_op:
+        batch_op.drop_index('ix_media_lower_title_type')
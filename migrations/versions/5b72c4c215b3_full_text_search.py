@@ -0,0 +1,69 @@
+"""full-text search
+
+Revision ID: 5b72c4c215b3
+Revises: cb1367e46974
+Create Date: 2026-10-18 14:02:37.519823
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b72c4c215b3'
+down_revision = 'cb1367e46974'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite's; other backends search with plain substring matches
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("""
+        CREATE VIRTUAL TABLE media_fts USING fts5(
+            title, description, content='media', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )""")
+    op.execute("""CREATE TRIGGER media_fts_insert AFTER INSERT ON media BEGIN
+        INSERT INTO media_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""")
+    op.execute("""CREATE TRIGGER media_fts_delete AFTER DELETE ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""")
+    op.execute("""CREATE TRIGGER media_fts_update AFTER UPDATE OF title, description ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO media_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""")
+    op.execute("INSERT INTO media_fts (media_fts) VALUES ('rebuild')")
+
+    op.execute("""
+        CREATE VIRTUAL TABLE log_fts USING fts5(
+            notes, content='log', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""")
+    op.execute("""CREATE TRIGGER log_fts_insert AFTER INSERT ON log WHEN new.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (rowid, notes) VALUES (new.id, new.notes);
+    END""")
+    op.execute("""CREATE TRIGGER log_fts_delete AFTER DELETE ON log WHEN old.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (log_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+    END""")
+    op.execute("""CREATE TRIGGER log_fts_update_old AFTER UPDATE OF notes ON log WHEN old.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (log_fts, rowid, notes) VALUES ('delete', old.id, old.notes);
+    END""")
+    op.execute("""CREATE TRIGGER log_fts_update_new AFTER UPDATE OF notes ON log WHEN new.notes IS NOT NULL BEGIN
+        INSERT INTO log_fts (rowid, notes) VALUES (new.id, new.notes);
+    END""")
+    # only the logs with notes; a 'rebuild' would index every row
+    op.execute("INSERT INTO log_fts (rowid, notes) SELECT id, notes FROM log WHERE notes IS NOT NULL")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('log_fts_update_new', 'log_fts_update_old', 'log_fts_delete', 'log_fts_insert',
+                    'media_fts_update', 'media_fts_delete', 'media_fts_insert'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS log_fts')
+    op.execute('DROP TABLE IF EXISTS media_fts')
@@ -0,0 +1,31 @@
+"""log filter and date indexes
+
+Revision ID: a41c7d2e9f03
+Revises: 95097a07471d
+Create Date: 2026-10-18 23:12:40.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7d2e9f03'
+down_revision = '95097a07471d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # plain CREATE/DROP INDEX, so the log table and its full-text search triggers are left as they are
+    op.create_index('ix_log_subscription_id_date', 'log', ['subscription_id', 'date', 'id'], unique=False)
+    op.create_index('ix_log_media_id_date', 'log', ['media_id', 'date', 'id'], unique=False)
+    op.drop_index('ix_log_subscription_id', table_name='log')
+    op.drop_index('ix_log_media_id', table_name='log')
+
+
+def downgrade():
+    op.create_index('ix_log_media_id', 'log', ['media_id'], unique=False)
+    op.create_index('ix_log_subscription_id', 'log', ['subscription_id'], unique=False)
+    op.drop_index('ix_log_media_id_date', table_name='log')
+    op.drop_index('ix_log_subscription_id_date', table_name='log')
@@ -0,0 +1,75 @@
+"""subscription cost cents
+
+Revision ID: e5c510015569
+Revises: 6760e4d7019d
+Create Date: 2026-10-18 10:02:17.530841
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from application.models import MONTHLY_COST_CENTS_SQL, YEARLY_COST_CENTS_SQL
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c510015569'
+down_revision = '6760e4d7019d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cost_cents', sa.Integer(), nullable=True))
+
+    # Convert every row in one statement
+    op.execute("UPDATE subscription SET cost_cents = CAST(round(CAST(cost AS NUMERIC) * 100) AS INTEGER)")
+
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.alter_column('cost_cents', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('cost')
+        batch_op.add_column(sa.Column('monthly_cost_cents', sa.Integer(), sa.Computed(MONTHLY_COST_CENTS_SQL, persisted=True), nullable=False))
+        batch_op.add_column(sa.Column('yearly_cost_cents', sa.Integer(), sa.Computed(YEARLY_COST_CENTS_SQL, persisted=True), nullable=False))
+        batch_op.create_index(batch_op.f('ix_subscription_monthly_cost_cents'), ['monthly_cost_cents'], unique=False)
+        batch_op.create_index(batch_op.f('ix_subscription_yearly_cost_cents'), ['yearly_cost_cents'], unique=False)
+
+    with op.batch_alter_table('cost_totals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('monthly_cost_cents', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('yearly_cost_cents', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.drop_column('monthly_cost')
+        batch_op.drop_column('yearly_cost')
+
+    op.execute(
+        "UPDATE cost_totals SET "
+        "monthly_cost_cents = (SELECT coalesce(sum(monthly_cost_cents), 0) FROM subscription WHERE inactive_date IS NULL), "
+        "yearly_cost_cents = (SELECT coalesce(sum(yearly_cost_cents), 0) FROM subscription WHERE inactive_date IS NULL)"
+    )
+
+    with op.batch_alter_table('cost_totals', schema=None) as batch_op:
+        batch_op.alter_column('monthly_cost_cents', existing_type=sa.Integer(), server_default=None)
+        batch_op.alter_column('yearly_cost_cents', existing_type=sa.Integer(), server_default=None)
+
+
+def downgrade():
+    with op.batch_alter_table('cost_totals', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('monthly_cost', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('yearly_cost', sa.Float(), nullable=False, server_default='0'))
+
+    op.execute("UPDATE cost_totals SET monthly_cost = monthly_cost_cents / 100.0, yearly_cost = yearly_cost_cents / 100.0")
+
+    with op.batch_alter_table('cost_totals', schema=None) as batch_op:
+        batch_op.drop_column('yearly_cost_cents')
+        batch_op.drop_column('monthly_cost_cents')
+
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_subscription_yearly_cost_cents'))
+        batch_op.drop_index(batch_op.f('ix_subscription_monthly_cost_cents'))
+        batch_op.drop_column('yearly_cost_cents')
+        batch_op.drop_column('monthly_cost_cents')
+        batch_op.add_column(sa.Column('cost', sa.String(), nullable=True))
+
+    op.execute("UPDATE subscription SET cost = printf('%.2f', cost_cents / 100.0)")
+
+    with op.batch_alter_table('subscription', schema=None) as batch_op:
+        batch_op.alter_column('cost', existing_type=sa.String(), nullable=False)
+        batch_op.drop_column('cost_cents')
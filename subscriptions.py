@@ -1,8 +1,10 @@
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from application import app, db
+from application import create_app, db
 from application.models import Media, Log
 
+app = create_app()
+
 @app.shell_context_processor
 def make_shell_context():
     """
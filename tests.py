@@ -1,11 +1,25 @@
 import os
-os.environ['DATABASE_URL'] = 'sqlite://'
+# TEST_DATABASE_URL runs the suite against another backend, such as a throwaway PostgreSQL database
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
 
 import unittest
 import sqlalchemy as sa
 from datetime import date, timedelta
-from application import app, db
-from application.models import Log, Media, MediaType, PaymentFrequency, Subscription
+import json
+import subprocess
+import sys
+import tempfile
+import weakref
+from config import engine_options
+from sqlalchemy.dialects import postgresql, sqlite
+from application import _dispose_engines, create_app, db, aggregates, costs, dedup, dialect, export, ingest, instrumentation, search, stats
+from application.cache import LRUCache, SQLiteCache, cache
+from application.forms import subscription_choices
+from application.writequeue import writer
+from application.models import CostTotals, Log, LogRow, Media, MediaStat, MediaType, PaymentFrequency, Subscription, SubscriptionStat, \
+    SubscriptionAlias, SubscriptionPrice, SubscriptionRow, Watermark, name_key, subscription_names
+
+app = create_app()
 
 NETFLIX = "Netflix"
 PEACOCK = "Peacock"
@@ -14,16 +28,41 @@ INSIDE_OUT = "Inside Out"
 INSIDE_OUT_2 = "Inside Out 2"
 FLEABAG = "Fleabag"
 
+SQLITE = os.environ['DATABASE_URL'].startswith('sqlite')
+sqlite_only = unittest.skipUnless(SQLITE, 'checks SQLite query plans, pragmas or FTS5')
+
 current_date = date.today()
 yesterday = current_date - timedelta(days=1)
 tomorrow = current_date + timedelta(days=1)
 
 
+def query_plan(func, *args):
+    """
+    runs func and returns the EXPLAIN QUERY PLAN details of the last statement it emitted
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    sa.event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        func(*args)
+    finally:
+        sa.event.remove(db.engine, 'before_cursor_execute', capture)
+    statement, parameters = statements[-1]
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return ' '.join(row.detail for row in rows)
+
+
 class ModelCase(unittest.TestCase):
     def setUp(self):
         self.app_context = app.app_context()
         self.app_context.push()
         db.create_all()
+        cache.clear()
+        subscription_choices.invalidate()
+        subscription_names.invalidate()
 
     def tearDown(self):
         db.session.remove()
@@ -68,6 +107,49 @@ class SubscriptionModelCase(ModelCase):
         result = Subscription.get_by_name(NETFLIX.upper())
         self.assertEqual(result.name, NETFLIX)
 
+    def test_name_key(self):
+        for name in ('Disney+', 'Disney Plus', 'disney +', ' DISNEY-PLUS '):
+            self.assertEqual(name_key(name), 'disney+')
+        self.assertEqual(name_key('Paramount+'), name_key('Paramount Plus'))
+        self.assertEqual(name_key('HBO Max'), 'hbomax')
+        self.assertEqual(name_key('Plusnet'), 'plusnet')
+
+    def test_alias(self):
+        disney = Subscription(name=DISNEY, cost="7.99")
+        db.session.add_all((disney, Subscription(name=NETFLIX, cost="22.99")))
+        db.session.commit()
+        self.assertEqual(Subscription.get_by_name('Disney Plus'), disney)
+
+        SubscriptionAlias.add('D+', disney.id)
+        db.session.commit()
+        self.assertEqual(Subscription.get_by_name('d +'), disney)
+        with self.assertRaises(ValueError):
+            SubscriptionAlias.add('Netflix!', disney.id)
+
+        result = ingest.ingest_logs([{'subscription': 'D Plus', 'media_title': INSIDE_OUT, 'media_type': 'film'}])
+        self.assertEqual(result.inserted, 1)
+        self.assertEqual(Log.rows()[0].subscription_id, disney.id)
+
+        self.assertTrue(SubscriptionAlias.remove('D+'))
+        db.session.commit()
+        self.assertIsNone(Subscription.get_by_name('D+'))
+
+    def test_names_resolved_in_process(self):
+        db.session.add(Subscription(name=DISNEY, cost="7.99"))
+        db.session.commit()
+        Subscription.id_for_name(DISNEY)
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            self.assertIsNotNone(Subscription.id_for_name('Disney Plus'))
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(statements, [])
+
     def test_get(self):
         sub1 = Subscription(name=NETFLIX, cost="22.99")
         sub2 = Subscription(name=PEACOCK, cost="0.00", payment_frequency=PaymentFrequency.yearly)
@@ -89,6 +171,22 @@ class SubscriptionModelCase(ModelCase):
         results = [res.name for res in results]
         self.assertListEqual(results, [DISNEY, NETFLIX])
 
+    def test_rows(self):
+        sub1 = Subscription(name=NETFLIX, cost="22.99")
+        sub2 = Subscription(name=PEACOCK, cost="0.00", payment_frequency=PaymentFrequency.yearly)
+        sub3 = Subscription(name=DISNEY, cost="160.00", inactive_date=yesterday)
+        db.session.add_all((sub1, sub2, sub3))
+        db.session.commit()
+        db.session.expunge_all()
+
+        rows = Subscription.rows()
+        self.assertEqual([row.name for row in rows], [DISNEY, NETFLIX, PEACOCK])
+        self.assertIsInstance(rows[0], SubscriptionRow)
+        self.assertEqual(rows[1].cost, "22.99")
+        self.assertEqual([row.name for row in Subscription.rows(active_only=True)], [NETFLIX, PEACOCK])
+        # read-only rows never enter the identity map
+        self.assertEqual(len(db.session.identity_map), 0)
+
     def test_monthly_cost(self):
         sub1 = Subscription(name=NETFLIX, cost="22.99", payment_frequency=PaymentFrequency.monthly)
         sub2 = Subscription(name=DISNEY, cost="160.00", payment_frequency=PaymentFrequency.yearly)
@@ -121,6 +219,33 @@ class SubscriptionModelCase(ModelCase):
         db.session.add_all((sub1, sub2, sub_ignored))
         self.assertEqual(Subscription.total_yearly_cost(), 24)
 
+    def test_cost_cents(self):
+        sub1 = Subscription(name=NETFLIX, cost="22.99", payment_frequency=PaymentFrequency.monthly)
+        sub2 = Subscription(name=DISNEY, cost="160.00", payment_frequency=PaymentFrequency.yearly)
+        db.session.add_all((sub1, sub2))
+        db.session.flush()
+        self.assertEqual(sub1.cost_cents, 2299)
+        self.assertEqual(sub1.cost, "22.99")
+        self.assertEqual((sub1.monthly_cost_cents, sub1.yearly_cost_cents), (2299, 27588))
+        # yearly plans are spread over the months rounding half up
+        self.assertEqual((sub2.monthly_cost_cents, sub2.yearly_cost_cents), (1333, 16000))
+        self.assertEqual(sub2.monthly_cost, 13.33)
+
+        sub1.cost = "0.1"
+        db.session.flush()
+        db.session.refresh(sub1)
+        self.assertEqual((sub1.cost_cents, sub1.monthly_cost_cents, sub1.yearly_cost_cents), (10, 10, 120))
+        self.assertEqual(Subscription.total_monthly_cost_cents(), 1343)
+
+    @sqlite_only
+    def test_get_by_name_index(self):
+        self.assertIn('USING INDEX ix_subscription_lower_name', query_plan(Subscription.get_by_name, NETFLIX))
+
+    @sqlite_only
+    def test_monthly_cost_index(self):
+        plan = query_plan(Subscription.get, None, Subscription.monthly_cost_cents.desc())
+        self.assertIn('USING INDEX ix_subscription_monthly_cost_cents', plan)
+
 
 class MediaModelCase(ModelCase):
     def test_media(self):
@@ -147,6 +272,11 @@ class MediaModelCase(ModelCase):
         result2 = Media.get_by_title_type(INSIDE_OUT_2.upper(), MediaType.tv)
         self.assertIsNone(result2)
 
+    @sqlite_only
+    def test_get_by_title_type_index(self):
+        plan = query_plan(Media.get_by_title_type, INSIDE_OUT, MediaType.film)
+        self.assertIn('USING INDEX ix_media_lower_title_type (<expr>=? AND type=?)', plan)
+
     def test_media_unique_constraint(self):
         media1 = Media(title=INSIDE_OUT, type=MediaType.film)
         media2 = Media(title=INSIDE_OUT, type=MediaType.tv)
@@ -269,6 +399,13 @@ class LogModelCase(ModelCase):
         self.assertEqual(result[0].subscription_id, sub_id)
         self.assertEqual(result[0].media_id, media_id)
 
+        self.assertEqual(Log.rows(sub_id=sub_id, media_id=media_id), [LogRow(
+            id=log1.id, date=log1.date, subscription_id=sub_id, media_id=media_id, season=None, episode=None, notes=None
+        )])
+        self.assertEqual(len(Log.rows(sub_id=sub_id)), 2)
+        self.assertEqual([row.id for row in Log.rows(media_id=media_id_ignored)], [log2.id])
+        self.assertEqual(len(Log.rows()), 2)
+
     def test_most_logged_subs(self):
         sub1 = Subscription(name=PEACOCK, cost="0.00", active_date=yesterday)
         sub2 = Subscription(name=DISNEY, cost="100.00")
@@ -326,5 +463,905 @@ class LogModelCase(ModelCase):
         self.assertEqual(result, [FLEABAG, INSIDE_OUT_2])
 
 
+class AggregateCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        sub1 = Subscription(name=PEACOCK, cost="0.00")
+        sub2 = Subscription(name=DISNEY, cost="12.00", payment_frequency=PaymentFrequency.yearly)
+        media1 = Media(title=INSIDE_OUT, type=MediaType.film)
+        media2 = Media(title=INSIDE_OUT_2, type=MediaType.film)
+        db.session.add_all((sub1, sub2, media1, media2))
+        db.session.flush()
+        self.sub_id1, self.sub_id2 = sub1.id, sub2.id
+        self.media_id1, self.media_id2 = media1.id, media2.id
+
+    def test_record_logs(self):
+        rows = [
+            {'subscription_id': self.sub_id1, 'media_id': self.media_id1},
+            {'subscription_id': self.sub_id2, 'media_id': self.media_id1},
+            {'subscription_id': self.sub_id2, 'media_id': self.media_id2}
+        ]
+        db.session.execute(sa.insert(Log), rows)
+        aggregates.record_logs(rows)
+        self.assertEqual(SubscriptionStat.most_logged(), [(DISNEY, 2), (PEACOCK, 1)])
+        self.assertEqual(MediaStat.most_logged(limit=1), [(INSIDE_OUT, 2)])
+
+        # counters are incremented, not overwritten
+        log = Log(subscription_id=self.sub_id1, media_id=self.media_id2)
+        db.session.add(log)
+        aggregates.record_log(log)
+        self.assertCountEqual(MediaStat.most_logged(), [(INSIDE_OUT, 2), (INSIDE_OUT_2, 2)])
+        self.assertEqual(SubscriptionStat.most_logged(), Log.most_logged_subs())
+
+    def test_rebuild(self):
+        db.session.add_all((
+            Log(subscription_id=self.sub_id1, media_id=self.media_id1),
+            Log(subscription_id=self.sub_id1, media_id=self.media_id1),
+            Log(subscription_id=self.sub_id2, media_id=self.media_id2)
+        ))
+        self.assertEqual(SubscriptionStat.most_logged(), [])
+        aggregates.rebuild()
+        self.assertEqual(SubscriptionStat.most_logged(), [(PEACOCK, 2), (DISNEY, 1)])
+        self.assertEqual(MediaStat.most_logged(), Log.most_logged_media())
+        self.assertEqual(CostTotals.get().monthly_cost_cents, 100)
+
+    def test_media_progress(self):
+        logs = [
+            {'subscription_id': self.sub_id1, 'media_id': self.media_id1, 'date': current_date, 'season': 1, 'episode': 3},
+            {'subscription_id': self.sub_id2, 'media_id': self.media_id1, 'date': current_date, 'season': 1, 'episode': 4},
+            {'subscription_id': self.sub_id1, 'media_id': self.media_id1, 'date': yesterday, 'season': 1, 'episode': 2},
+            {'subscription_id': self.sub_id1, 'media_id': self.media_id2, 'date': yesterday}
+        ]
+        db.session.execute(sa.insert(Log), logs[:2])
+        aggregates.record_logs(logs[:2])
+        # a backdated log counts but doesn't move the resume point
+        db.session.execute(sa.insert(Log), logs[2:])
+        aggregates.record_logs(logs[2:])
+
+        stat = MediaStat.get(self.media_id1)
+        self.assertEqual((stat.log_count, stat.last_date, stat.last_subscription_id), (3, current_date, self.sub_id2))
+        self.assertEqual(stat.next_episode(), (1, 5))
+        self.assertIsNone(MediaStat.get(self.media_id2).next_episode())
+        self.assertEqual([row.title for row in MediaStat.currently_watching()], [INSIDE_OUT, INSIDE_OUT_2])
+        self.assertEqual([row.title for row in MediaStat.currently_watching()], Log.currently_watching())
+
+        maintained = db.session.execute(sa.select(MediaStat.__table__).order_by(MediaStat.media_id)).all()
+        aggregates.rebuild()
+        self.assertEqual(db.session.execute(sa.select(MediaStat.__table__).order_by(MediaStat.media_id)).all(), maintained)
+
+    @sqlite_only
+    def test_currently_watching_plan(self):
+        self.assertIn('USING INDEX ix_media_stat_last_date', query_plan(MediaStat.currently_watching))
+
+    def test_cost_totals(self):
+        self.assertIsNone(CostTotals.get())
+        aggregates.refresh_cost_totals()
+        self.assertEqual(CostTotals.get().yearly_cost_cents, Subscription.total_yearly_cost_cents())
+
+        Subscription.get_by_name(DISNEY).inactive_date = yesterday
+        aggregates.refresh_cost_totals()
+        self.assertEqual(CostTotals.get().yearly_cost_cents, 0)
+
+
+class CostCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        self.monthly = Subscription(name=NETFLIX, cost="10.00", active_date=date(2024, 1, 16))
+        self.yearly = Subscription(name=DISNEY, cost="120.00", payment_frequency=PaymentFrequency.yearly,
+                                   active_date=date(2024, 1, 1), inactive_date=date(2024, 4, 1))
+        db.session.add_all((self.monthly, self.yearly))
+        db.session.commit()
+
+    def test_price_history(self):
+        self.assertEqual([(p.effective_date, p.cost_cents) for p in SubscriptionPrice.history(self.monthly.id)],
+                         [(date(2024, 1, 16), 1000)])
+        self.monthly.cost = "15.00"
+        db.session.commit()
+        self.monthly.payment_frequency = PaymentFrequency.yearly
+        db.session.commit()
+        history = SubscriptionPrice.history(self.monthly.id)
+        self.assertEqual([(p.effective_date, p.cost_cents, p.payment_frequency) for p in history], [
+            (date(2024, 1, 16), 1000, PaymentFrequency.monthly),
+            (current_date, 1500, PaymentFrequency.yearly)
+        ])
+
+    def test_spend_prorated(self):
+        db.session.add(SubscriptionPrice(subscription_id=self.monthly.id, effective_date=date(2024, 3, 1),
+                                         cost_cents=2000, payment_frequency=PaymentFrequency.monthly))
+        db.session.commit()
+        rows = costs.spend(date(2024, 1, 1), date(2024, 4, 30))
+        self.assertEqual([(row.month.month, row.subscription_id, row.cents) for row in rows], [
+            (1, self.monthly.id, 516),  # 16 of January's 31 days
+            (1, self.yearly.id, 1000),
+            (2, self.monthly.id, 1000),
+            (2, self.yearly.id, 1000),
+            (3, self.monthly.id, 2000),
+            (3, self.yearly.id, 1000),  # inactive from April
+            (4, self.monthly.id, 2000)
+        ])
+        self.assertEqual(costs.spend_by_month(date(2024, 3, 16), date(2024, 3, 31)), [(date(2024, 3, 1), 1548)])
+        self.assertEqual(costs.spend_by_subscription(date(2024, 1, 1), date(2024, 12, 31))[self.yearly.id], 3000)
+        self.assertEqual(costs.monthly_run_rate(date(2024, 2, 1)), 2000)
+        self.assertEqual(costs.monthly_run_rate(date(2024, 5, 1)), 2000)
+        self.assertRaises(ValueError, costs.spend, date(2024, 2, 1), date(2024, 1, 1))
+
+    def test_value_for_money(self):
+        media = Media(title=FLEABAG, type=MediaType.tv)
+        film = Media(title=INSIDE_OUT, type=MediaType.film)
+        db.session.add_all((media, film))
+        db.session.flush()
+        db.session.add_all([Log(subscription_id=self.monthly.id, media_id=media.id, date=date(2024, 2, day))
+                            for day in range(1, 5)])
+        db.session.add(Log(subscription_id=self.monthly.id, media_id=film.id, date=date(2024, 2, 10)))
+        db.session.add(Log(subscription_id=self.monthly.id, media_id=film.id, date=date(2024, 3, 1)))
+        db.session.commit()
+
+        report = costs.value_for_money(date(2024, 2, 1), date(2024, 2, 29))
+        self.assertEqual(report[0], {
+            'subscription_id': self.monthly.id, 'subscription': NETFLIX, 'cents': 1000, 'views': 5, 'titles': 2,
+            'hours': 5.0, 'cents_per_view': 200, 'cents_per_title': 500, 'cents_per_hour': 200
+        })
+        # partial months at both ends are counted from the daily rollups
+        self.assertEqual(costs.value_for_money(date(2024, 2, 2), date(2024, 3, 1))[0]['views'], 5)
+        self.assertEqual(costs.value_for_money(date(2024, 2, 2), date(2024, 2, 3))[0]['views'], 2)
+        # paid for but unused
+        self.assertEqual((report[1]['subscription'], report[1]['views'], report[1]['cents_per_view']), (DISNEY, 0, None))
+
+
+class IngestCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all((
+            Subscription(name=NETFLIX, cost="22.99"),
+            Media(title=FLEABAG, type=MediaType.tv)
+        ))
+        db.session.commit()
+
+    def test_ingest_logs(self):
+        rows = [
+            {'subscription': NETFLIX.upper(), 'media_title': 'fleabag ', 'media_type': 'tv', 'season': 1, 'episode': 1},
+            {'subscription': NETFLIX, 'media_title': INSIDE_OUT, 'media_type': 'film', 'date': '2025-01-02'},
+            {'subscription_id': Subscription.get_by_name(NETFLIX).id, 'media_title': INSIDE_OUT, 'media_type': 'film'}
+        ]
+        result = ingest.ingest_logs(rows)
+        self.assertEqual((result.inserted, result.media_created), (3, 1))
+        self.assertEqual(len(Media.query.all()), 2)
+        self.assertEqual(Log.get_by_media_id(Media.get_by_title_type(FLEABAG, MediaType.tv).id)[0].episode, 1)
+        self.assertCountEqual(MediaStat.most_logged(), [(FLEABAG, 1), (INSIDE_OUT, 2)])
+        self.assertEqual(SubscriptionStat.most_logged(), [(NETFLIX, 3)])
+
+    def test_ingest_invalid_row(self):
+        rows = [
+            {'subscription': NETFLIX, 'media_title': INSIDE_OUT},
+            {'subscription': PEACOCK, 'media_title': INSIDE_OUT}
+        ]
+        with self.assertRaisesRegex(ValueError, 'row 2: unknown subscription'):
+            ingest.ingest_logs(rows)
+        for field in ('subscription', 'media_title', 'notes', 'idempotency_key'):
+            row = {'subscription': NETFLIX, 'media_title': INSIDE_OUT, field: 5}
+            with self.assertRaisesRegex(ValueError, f'row 1: {field} must be a string'):
+                ingest.ingest_logs([row])
+        db.session.rollback()
+        self.assertEqual(Log.query.all(), [])
+        self.assertIsNone(Media.get_by_title_type(INSIDE_OUT, MediaType.film))
+
+    def test_ingest_existing_unfolded_title(self):
+        # SQLite's lower() folds only ASCII, so the lookup misses this title and the insert must not fail
+        db.session.add(Media(title='AMÉLIE', type=MediaType.film))
+        db.session.commit()
+        result = ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': 'AMÉLIE', 'media_type': 'film'}])
+        self.assertEqual((result.inserted, result.media_created), (1, 0))
+        self.assertEqual(MediaStat.most_logged(), [('AMÉLIE', 1)])
+
+    def test_ingest_idempotent(self):
+        rows = [
+            {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'episode': 1},
+            {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'episode': 2, 'idempotency_key': 'e2'}
+        ]
+        self.assertEqual(ingest.ingest_logs(rows, idempotency_key='batch').inserted, 2)
+        retry = ingest.ingest_logs(rows, idempotency_key='batch')
+        self.assertEqual((retry.inserted, retry.skipped), (0, 2))
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 2)])
+        self.assertCountEqual([log.idempotency_key for log in Log.query.all()], ['batch:1', 'e2'])
+
+    def test_natural_key(self):
+        row = {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'date': '2025-01-01', 'episode': 1}
+        ingest.ingest_logs([row, row, {**row, 'episode': 2}])
+        self.assertEqual(ingest.enforce_natural_key(), 1)
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 2)])
+
+        result = ingest.ingest_logs([row, {**row, 'episode': None}, {**row, 'episode': None}])
+        self.assertEqual((result.inserted, result.skipped), (1, 2))
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 3)])
+
+        ingest.enforce_natural_key(enabled=False)
+        self.assertEqual(ingest.ingest_logs([row]).inserted, 1)
+
+
+class ExportCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        ingest.ingest_logs([
+            {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'season': 1, 'episode': i, 'date': '2025-01-01'}
+            for i in range(1, 6)
+        ])
+
+    def test_export_ndjson(self):
+        lines = ''.join(export.generate('logs', 'ndjson', batch_size=2)).splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[-1]), {
+            'id': 5, 'date': '2025-01-01', 'subscription': NETFLIX, 'media_title': FLEABAG,
+            'media_type': 'tv', 'season': 1, 'episode': 5, 'notes': None
+        })
+
+    def test_export_csv(self):
+        text = ''.join(export.generate('subscriptions', 'csv'))
+        self.assertEqual(text.splitlines(), [','.join(export.SUBSCRIPTION_COLUMNS), f'1,{NETFLIX},22.99,monthly,{current_date},'])
+
+    def test_export_unknown(self):
+        with self.assertRaises(ValueError):
+            export.generate('media', 'csv')
+
+
+class StatsCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add_all((Subscription(name=NETFLIX, cost="22.99"), Subscription(name=PEACOCK, cost="0.00")))
+        db.session.commit()
+
+    def log(self, *rows):
+        ingest.ingest_logs([
+            {'subscription': sub, 'media_title': title, 'media_type': type, 'date': day}
+            for sub, title, type, day in rows
+        ])
+
+    def test_counts(self):
+        self.log(
+            (NETFLIX, FLEABAG, 'tv', '2025-01-05'),  # Sunday
+            (NETFLIX, FLEABAG, 'tv', '2025-01-06'),  # Monday
+            (PEACOCK, INSIDE_OUT, 'film', '2025-01-06'),
+            (PEACOCK, INSIDE_OUT, 'film', '2025-02-01')
+        )
+        self.assertEqual(stats.counts(stats.MONTH, stats.BY_TYPE), [
+            (date(2025, 1, 1), MediaType.tv, 2),
+            (date(2025, 1, 1), MediaType.film, 1),
+            (date(2025, 2, 1), MediaType.film, 1)
+        ])
+        self.assertEqual(stats.counts(stats.WEEK, stats.BY_SUBSCRIPTION), [
+            (date(2024, 12, 30), NETFLIX, 1),
+            (date(2025, 1, 6), NETFLIX, 1),
+            (date(2025, 1, 6), PEACOCK, 1),
+            (date(2025, 1, 27), PEACOCK, 1)
+        ])
+        self.assertEqual(
+            stats.counts(stats.DAY, stats.BY_MEDIA, start=date(2025, 1, 6), end=date(2025, 1, 31)),
+            [(date(2025, 1, 6), FLEABAG, 1), (date(2025, 1, 6), INSIDE_OUT, 1)]
+        )
+
+    def test_refresh_is_incremental(self):
+        self.log((NETFLIX, FLEABAG, 'tv', '2025-01-05'))
+        self.assertEqual(stats.refresh(), 1)
+        self.assertEqual(stats.refresh(), 0)
+
+        # a backdated log is still picked up
+        self.log((NETFLIX, FLEABAG, 'tv', '2024-12-31'), (NETFLIX, FLEABAG, 'tv', '2025-01-20'))
+        self.assertEqual(stats.refresh(), 2)
+        self.assertEqual(stats.counts(stats.MONTH, stats.BY_MEDIA), [
+            (date(2024, 12, 1), FLEABAG, 1),
+            (date(2025, 1, 1), FLEABAG, 2)
+        ])
+        self.assertEqual(stats.rebuild(), 3)
+        self.assertEqual(len(stats.counts(stats.DAY, stats.BY_MEDIA)), 3)
+
+    def test_refresh_leaves_caller_transaction(self):
+        self.log((NETFLIX, FLEABAG, 'tv', '2025-01-05'))
+        subscription = Subscription(name=DISNEY, cost="7.99")
+        db.session.add(subscription)
+        # a read path catching the rollups up neither commits nor discards the caller's pending work
+        self.assertEqual(stats.counts(stats.MONTH, stats.BY_MEDIA), [(date(2025, 1, 1), FLEABAG, 1)])
+        self.assertIn(subscription, db.session)
+        db.session.rollback()
+        self.assertIsNone(Subscription.get_by_name(DISNEY))
+        self.assertEqual(stats.refresh(), 0)
+
+
+class SearchCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.add_all([
+            Media(title=FLEABAG, type=MediaType.tv, description='A dry-witted woman navigates life in London'),
+            Media(title='Flea Market Flip', type=MediaType.tv),
+            Media(title=INSIDE_OUT, type=MediaType.film, description='Emotions run a girl\'s mind, and a flea circus')
+        ])
+        db.session.commit()
+
+    def titles(self, text, **kwargs):
+        return [row.title for row in search.search_media(text, **kwargs)]
+
+    def test_match_expression(self):
+        self.assertEqual(search.match_expression('Flea mar'), '"Flea" "mar"*')
+        self.assertEqual(search.match_expression('inside o'), '"inside" "o"*')
+        self.assertEqual(search.match_expression('i'), '"i"')
+        self.assertEqual(search.match_expression('"OR NEAR('), '"OR" "NEAR"*')
+        self.assertIsNone(search.match_expression(' -* '))
+
+    @sqlite_only
+    def test_prefix_search_ranked(self):
+        # title matches come before the description match
+        self.assertCountEqual(self.titles('fle')[:2], [FLEABAG, 'Flea Market Flip'])
+        self.assertEqual(self.titles('fle')[2], INSIDE_OUT)
+        self.assertEqual(self.titles('flea mar'), ['Flea Market Flip'])
+        self.assertEqual(self.titles('flea m'), ['Flea Market Flip', INSIDE_OUT])
+        self.assertEqual(self.titles('london'), [FLEABAG])
+        self.assertEqual(self.titles('fle', type=MediaType.film), [INSIDE_OUT])
+
+    @sqlite_only
+    def test_index_follows_updates(self):
+        media = Media.get_by_title_type(FLEABAG, MediaType.tv)
+        media.title = 'Killing Eve'
+        db.session.commit()
+        self.assertEqual(self.titles('kill'), ['Killing Eve'])
+        self.assertNotIn('Killing Eve', self.titles('fle'))
+        db.session.delete(media)
+        db.session.commit()
+        self.assertEqual(self.titles('kill'), [])
+
+    @sqlite_only
+    def test_log_notes(self):
+        ingest.ingest_logs([
+            {'subscription': NETFLIX, 'media_title': FLEABAG, 'notes': 'the confession scene, wow'},
+            {'subscription': NETFLIX, 'media_title': FLEABAG}
+        ])
+        rows = search.search_logs('confess')
+        self.assertEqual([(row.media_title, row.snippet) for row in rows], [(FLEABAG, 'the [confession] scene, wow')])
+        search.rebuild()
+        self.assertEqual(len(search.search_logs('confess')), 1)
+
+
+class SQLiteProfileCase(ModelCase):
+    @sqlite_only
+    def test_pragmas_applied(self):
+        pragma = lambda name: db.session.execute(sa.text(f'pragma {name}')).scalar()
+        self.assertEqual(pragma('foreign_keys'), 1)
+        self.assertEqual(pragma('busy_timeout'), 5000)
+        self.assertEqual(pragma('synchronous'), 1)
+
+    def test_engine_options(self):
+        self.assertEqual(engine_options('sqlite://'), {'query_cache_size': 1200})
+        self.assertNotIn('pool_size', engine_options('sqlite://'))
+        self.assertEqual(engine_options('sqlite:////tmp/app.db')['pool_size'], 5)
+
+
+class DialectCase(ModelCase):
+    def compile(self, expression, dialect):
+        return str(expression.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    def test_date_functions(self):
+        month = stats.bucket_expression(stats.MONTH, Log.date)
+        self.assertEqual(self.compile(month, sqlite.dialect()), "date(log.date, 'start of month')")
+        self.assertEqual(self.compile(month, postgresql.dialect()), "CAST(date_trunc('month', log.date) AS DATE)")
+        week = stats.bucket_expression(stats.WEEK, Log.date)
+        self.assertEqual(self.compile(week, postgresql.dialect()), "CAST(date_trunc('week', log.date) AS DATE)")
+        later = dialect.add_months(Log.date, 2)
+        self.assertEqual(self.compile(later, sqlite.dialect()), "date(log.date, (2) || ' months')")
+        self.assertEqual(self.compile(later, postgresql.dialect()), 'CAST(log.date + make_interval(months => 2) AS DATE)')
+        self.assertEqual(db.session.scalar(sa.select(dialect.add_months(sa.literal(date(2024, 12, 1), sa.Date), 2))),
+                         date(2025, 2, 1))
+
+    def test_least_greatest(self):
+        least = dialect.least(Log.season, Log.episode, type_=sa.Integer)
+        self.assertEqual(self.compile(least, sqlite.dialect()), 'min(log.season, log.episode)')
+        self.assertEqual(self.compile(least, postgresql.dialect()), 'least(log.season, log.episode)')
+        self.assertEqual(self.compile(dialect.greatest(Log.season, 1), postgresql.dialect()), 'greatest(log.season, 1)')
+        self.assertIsInstance(least.type, sa.Integer)
+
+    def test_insert(self):
+        self.assertEqual(dialect.name(), 'sqlite' if SQLITE else 'postgresql')
+        statement = str(Log._insert_statement().compile(dialect=db.engine.dialect))
+        self.assertIn('ON CONFLICT DO NOTHING RETURNING', statement)
+
+    @unittest.skipIf(SQLITE, 'COPY is PostgreSQL only')
+    def test_copy_bulk_load(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': FLEABAG}])
+        self.assertEqual([row.count for row in stats.counts(stats.MONTH, stats.BY_MEDIA)], [1])
+        # the title exists, so COPY is the only write to a watched table and must still clear the cache
+        result = ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': FLEABAG, 'episode': i}
+                                     for i in range(dialect.COPY_THRESHOLD)])
+        self.assertEqual(result.inserted, dialect.COPY_THRESHOLD)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Log)), dialect.COPY_THRESHOLD + 1)
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, dialect.COPY_THRESHOLD + 1)])
+        self.assertEqual([row.count for row in stats.counts(stats.MONTH, stats.BY_MEDIA)], [dialect.COPY_THRESHOLD + 1])
+
+
+class CacheCase(ModelCase):
+    def test_lru_cache(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+        expired = LRUCache(ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_sqlite_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteCache(os.path.join(directory, 'cache.db'))
+            store.set('rows', [(NETFLIX, 2)])
+            self.assertEqual(SQLiteCache(store.path).get('rows'), [(NETFLIX, 2)])
+            store.clear()
+            self.assertIsNone(store.get('rows'))
+
+    def test_sqlite_cache_connection_per_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SQLiteCache(os.path.join(directory, 'cache.db'))
+            # a preloading server builds the cache in its master, which must not hand a connection to the workers
+            self.assertIsNone(getattr(store._local, 'connection', None))
+            store.set('rows', [(NETFLIX, 2)])
+            inherited = store._local.connection
+            store._local.pid = -1  # as in a forked child
+            self.assertEqual(store.get('rows'), [(NETFLIX, 2)])
+            self.assertIsNot(store._local.connection, inherited)
+            inherited.close()
+
+    def test_invalidated_on_commit(self):
+        cache.set('key', 'value')
+        db.session.add(Watermark(name='unrelated', value=1))
+        db.session.commit()
+        self.assertEqual(cache.get('key'), 'value')
+
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.flush()
+        self.assertEqual(cache.get('key'), 'value')
+        db.session.commit()
+        self.assertIsNone(cache.get('key'))
+
+        # bulk statements skip the flush but still invalidate
+        cache.set('key', 'value')
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': FLEABAG}])
+        self.assertIsNone(cache.get('key'))
+
+
+class RouteCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['WTF_CSRF_ENABLED'] = True
+        super().tearDown()
+
+    def test_log_updates_aggregates(self):
+        self.client.post('/subscription', data={'name': NETFLIX, 'cost': '22.99', 'payment_frequency': 'monthly'})
+        self.assertEqual(CostTotals.get().monthly_cost_cents, 2299)
+
+        sub_id = Subscription.get_by_name(NETFLIX).id
+        for _ in range(2):
+            self.client.post('/log', data={'subscription': sub_id, 'media_title': FLEABAG, 'media_type': 'tv'})
+        self.assertEqual(SubscriptionStat.most_logged(), [(NETFLIX, 2)])
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 2)])
+
+        response = self.client.get('/index')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'$22.99', response.data)
+        self.assertIn(b'Fleabag</i> was watched 2 time(s)', response.data)
+
+    def test_subscription_spelling_exists(self):
+        self.client.post('/subscription', data={'name': DISNEY, 'cost': '7.99', 'payment_frequency': 'monthly'})
+        response = self.client.post('/subscription', data={'name': 'Disney Plus', 'cost': '7.99',
+                                                           'payment_frequency': 'monthly'})
+        self.assertIn(b'Subscription already exists', response.data)
+        self.assertEqual([sub.name for sub in Subscription.get()], [DISNEY])
+
+    def test_index_cached(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        response = self.client.get('/index')
+        self.assertIn(b'Netflix costs', response.data)
+        etag = response.get_etag()[0]
+
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            self.assertEqual(self.client.get('/index').data, response.data)
+            self.assertEqual(self.client.get('/index', headers={'If-None-Match': f'"{etag}"'}).status_code, 304)
+        finally:
+            sa.event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(statements, [])
+
+        self.client.post('/subscription', data={'name': PEACOCK, 'cost': '5.00', 'payment_frequency': 'monthly'})
+        self.client.get('/index')  # consumes the flash message
+        response = self.client.get('/index', headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Peacock costs', response.data)
+
+    def test_log_bulk(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        body = f'subscription,media_title,media_type,date\n{NETFLIX},{FLEABAG},tv,2025-01-01\n{NETFLIX},{FLEABAG},tv,\n'
+        response = self.client.post('/log/bulk', data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['inserted'], 2)
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 2)])
+
+        response = self.client.post('/log/bulk', json=[{'subscription': PEACOCK, 'media_title': FLEABAG}])
+        self.assertEqual(response.status_code, 400)
+        for body in (['x'], [[NETFLIX, FLEABAG]], {'logs': [{'subscription': 5, 'media_title': FLEABAG}]},
+                     [{'subscription': NETFLIX, 'media_title': FLEABAG, 'idempotency_key': [1]}]):
+            self.assertEqual(self.client.post('/log/bulk', json=body).status_code, 400)
+            self.assertEqual(self.client.post('/log/bulk', json=body, headers={'Idempotency-Key': 'k'}).status_code, 400)
+        self.assertEqual(len(Log.query.all()), 2)
+
+        for inserted in (1, 0):
+            response = self.client.post('/log/bulk', json=[{'subscription': NETFLIX, 'media_title': FLEABAG}],
+                                        headers={'Idempotency-Key': 'import-1'})
+            self.assertEqual((response.json['inserted'], response.json['skipped']), (inserted, 1 - inserted))
+        self.assertEqual(len(Log.query.all()), 3)
+
+    def test_natural_key_clears_dashboard(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        row = {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'date': '2025-01-01'}
+        ingest.ingest_logs([row, row])
+        self.assertIn(b'Fleabag</i> was watched 2 time(s)', self.client.get('/index').data)
+        self.assertEqual(ingest.enforce_natural_key(), 1)
+        self.assertIn(b'Fleabag</i> was watched 1 time(s)', self.client.get('/index').data)
+
+    def test_log_retry(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        data = {'subscription': Subscription.get_by_name(NETFLIX).id, 'media_title': FLEABAG, 'media_type': 'tv',
+                'idempotency_key': 'form-1'}
+        self.client.post('/log', data=data)
+        response = self.client.post('/log', data=data, follow_redirects=True)
+        self.assertIn(b'Log was already submitted', response.data)
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 1)])
+        self.assertIn(b'name="idempotency_key"', self.client.get('/log').data)
+
+    def test_api_logs_pagination(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        ingest.ingest_logs([
+            {'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'episode': i, 'date': f'2025-01-0{1 + i % 3}'}
+            for i in range(7)
+        ])
+        seen, cursor = [], None
+        while True:
+            response = self.client.get('/api/logs', query_string={'limit': 3, 'after': cursor} if cursor else {'limit': 3})
+            self.assertEqual(response.status_code, 200)
+            seen.extend((item['date'], item['id']) for item in response.json['items'])
+            cursor = response.json['next']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+        response = self.client.get('/api/logs', query_string={'start': '2025-01-02', 'end': '2025-01-02'})
+        self.assertEqual({item['date'] for item in response.json['items']}, {'2025-01-02'})
+        self.assertEqual(response.json['items'][0]['media_title'], FLEABAG)
+        self.assertEqual(self.client.get('/api/logs', query_string={'after': 'bad'}).status_code, 400)
+
+        if SQLITE:
+            # a filtered page seeks into the subscription's or the title's logs instead of sorting all of them
+            for filter, index in (('subscription_id', 'ix_log_subscription_id_date'), ('media_id', 'ix_log_media_id_date')):
+                plan = query_plan(self.client.get, f'/api/logs?{filter}=1&limit=3&after={seen[2][0]}_{seen[2][1]}')
+                self.assertIn(f'USING INDEX {index}', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_api_media_and_subscriptions(self):
+        db.session.add_all([Media(title=f'{INSIDE_OUT} {i}', type=MediaType.film) for i in range(3)])
+        db.session.add(Subscription(name=NETFLIX, cost="22.99", inactive_date=yesterday))
+        db.session.commit()
+        response = self.client.get('/api/media', query_string={'limit': 2, 'type': 'film'})
+        self.assertEqual([item['id'] for item in response.json['items']], [1, 2])
+        response = self.client.get('/api/media', query_string={'limit': 2, 'after': response.json['next']})
+        self.assertEqual(response.json, {'items': [{'id': 3, 'title': f'{INSIDE_OUT} 2', 'type': 'film', 'description': None}], 'next': None})
+
+        self.assertEqual(self.client.get('/api/subscriptions').json['items'][0]['cost'], '22.99')
+        self.assertEqual(self.client.get('/api/subscriptions', query_string={'active': 1}).json['items'], [])
+        self.assertEqual(self.client.get('/api/media', query_string={'limit': 0}).status_code, 400)
+
+    def test_api_stats(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'date': '2025-01-05'}])
+        response = self.client.get('/api/stats', query_string={'grain': 'month', 'by': 'type'})
+        self.assertEqual(response.json, {'items': [{'bucket': '2025-01-01', 'type': 'tv', 'count': 1}]})
+        self.assertEqual(self.client.get('/api/stats', query_string={'grain': 'year'}).status_code, 400)
+
+    def test_media_progress(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': FLEABAG, 'media_type': 'tv', 'season': 2,
+                             'episode': 6, 'date': '2025-01-05'}])
+        response = self.client.get('/api/media/1/progress')
+        self.assertEqual((response.json['last_date'], response.json['next_season'], response.json['next_episode']),
+                         ('2025-01-05', 2, 7))
+        self.assertIn(b'up next: season 2 episode 7', self.client.get('/index').data)
+        self.assertEqual(self.client.get('/api/media/2/progress').status_code, 404)
+
+    def test_api_spend(self):
+        db.session.add(Subscription(name=NETFLIX, cost="31.00", active_date=date(2025, 1, 2)))
+        db.session.commit()
+        response = self.client.get('/api/spend', query_string={'start': '2025-01-01', 'end': '2025-01-31'})
+        self.assertEqual(response.json, {'total': '30.00', 'items': [
+            {'month': '2025-01-01', 'subscription_id': 1, 'subscription': NETFLIX, 'cost': '30.00'}
+        ]})
+        self.assertEqual(self.client.get('/api/spend', query_string={'start': '2025-02-01', 'end': '2025-01-01'}).status_code, 400)
+        for start, end in (('2024-01-01', '9999-12-31'), ('1900-01-01', '2025-01-01')):
+            self.assertEqual(self.client.get('/api/spend', query_string={'start': start, 'end': end}).status_code, 400)
+
+    def test_api_value(self):
+        db.session.add(Subscription(name=NETFLIX, cost="31.00", active_date=date(2025, 1, 1)))
+        db.session.commit()
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': INSIDE_OUT, 'date': '2025-01-05'}])
+        response = self.client.get('/api/value', query_string={'start': '2025-01-01', 'end': '2025-01-31'})
+        self.assertEqual(response.json['items'][0]['cost_per_view'], '31.00')
+        self.assertEqual(response.json['items'][0]['cost_per_hour'], '15.50')
+        self.assertEqual(self.client.get('/api/value').status_code, 200)
+        for query_string in ({'end': '9999-12-31'}, {'end': '0001-01-05'}, {'start': '1900-01-01'}):
+            self.assertEqual(self.client.get('/api/value', query_string=query_string).status_code, 400)
+
+    def test_media_search(self):
+        db.session.add(Media(title=FLEABAG, type=MediaType.tv))
+        db.session.commit()
+        response = self.client.get('/media', query_string={'q': 'fleab'})
+        self.assertEqual(response.json, {'items': [{'id': 1, 'title': FLEABAG, 'type': 'tv', 'description': None}]})
+        self.assertEqual(self.client.get('/media', query_string={'q': 'fleab', 'type': 'film'}).json['items'], [])
+        self.assertEqual(self.client.get('/media').json['items'], [])
+        self.assertEqual(self.client.get('/media', query_string={'q': 'f', 'type': 'book'}).status_code, 400)
+
+        # SQLite reads a negative LIMIT as no limit
+        db.session.add_all([Media(title=f'{FLEABAG} {i}', type=MediaType.tv) for i in range(2, 5)])
+        db.session.commit()
+        self.assertEqual(len(self.client.get('/media', query_string={'q': 'fleab', 'limit': -1}).json['items']), 1)
+        self.assertEqual(len(self.client.get('/media', query_string={'q': 'fleab', 'limit': 99}).json['items']), 4)
+        self.assertEqual(self.client.get('/api/search/logs', query_string={'q': 'fleab'}).json['items'], [])
+
+    def test_export(self):
+        response = self.client.get('/export/logs.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True).splitlines(), [','.join(export.LOG_COLUMNS)])
+        self.assertEqual(self.client.get('/export/logs.xml').status_code, 404)
+
+
+class WriteBehindCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        self.directory = tempfile.TemporaryDirectory()
+        app.config.update(LOG_WRITE_BEHIND=True, LOG_QUEUE_INTERVAL=60,
+                          LOG_QUEUE_PATH=os.path.join(self.directory.name, 'queue.db'))
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+
+    def tearDown(self):
+        writer.close()
+        app.config.update(LOG_WRITE_BEHIND=False, LOG_QUEUE_INTERVAL=0.5, WTF_CSRF_ENABLED=True)
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_log_queued_then_written(self):
+        response = self.client.post('/log', data={'subscription': 1, 'media_title': FLEABAG, 'media_type': 'tv'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Log.query.all(), [])
+        self.assertEqual(self.client.get('/log/queue').json, {'pending': 1, 'processing': 0, 'done': 0, 'failed': 0})
+
+        self.assertEqual(writer.drain(), 1)
+        log = Log.query.one()
+        self.assertEqual((log.media_id, log.date), (Media.get_by_title_type(FLEABAG, MediaType.tv).id, current_date))
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 1)])
+        self.assertEqual(self.client.get('/log/queue').json['done'], 1)
+        self.assertEqual(self.client.get('/log/queue/unknown').status_code, 404)
+
+    def test_invalid_entry_fails_alone(self):
+        good = writer.submit({'subscription_id': 1, 'media_title': FLEABAG})
+        bad = writer.submit({'subscription_id': 99, 'media_title': FLEABAG})
+        writer.stop()
+        self.assertEqual(len(Log.query.all()), 1)
+        self.assertEqual(self.client.get(f'/log/queue/{good}').json['status'], 'done')
+        response = self.client.get(f'/log/queue/{bad}').json
+        self.assertEqual(response['status'], 'failed')
+        self.assertIn('unknown subscription_id 99', response['error'])
+
+    @sqlite_only
+    def test_rejected_entry_fails_alone(self):
+        db.session.execute(sa.text(
+            "CREATE TRIGGER reject_log BEFORE INSERT ON log WHEN NEW.notes = 'rejected' "
+            "BEGIN SELECT RAISE(ABORT, 'log rejected'); END"
+        ))
+        db.session.commit()
+        bad = writer.submit({'subscription_id': 1, 'media_title': INSIDE_OUT, 'notes': 'rejected'})
+        good = writer.submit({'subscription_id': 1, 'media_title': FLEABAG})
+        self.assertEqual(writer.drain(), 2)
+        self.assertEqual(self.client.get(f'/log/queue/{bad}').json['status'], 'failed')
+        self.assertEqual(self.client.get(f'/log/queue/{good}').json['status'], 'done')
+        self.assertEqual(MediaStat.most_logged(), [(FLEABAG, 1)])
+
+    def test_entries_claimed_once(self):
+        for episode in range(3):
+            writer.queue.put({'subscription_id': 1, 'media_title': FLEABAG, 'episode': episode})
+        first, second = writer.queue.claim(2), writer.queue.claim(2)
+        self.assertEqual(([id for id, _ in first], [id for id, _ in second]), ([1, 2], [3]))
+        self.assertEqual(writer.queue.claim(2), [])
+        self.assertEqual(writer.queue.counts()['processing'], 3)
+
+        writer.queue.release([3])
+        self.assertEqual(writer.drain(), 1)
+        self.assertEqual(writer.queue.counts(), {'pending': 0, 'processing': 2, 'done': 1, 'failed': 0})
+
+
+class InstrumentationCase(ModelCase):
+    def setUp(self):
+        super().setUp()
+        self.client = app.test_client()
+        instrumentation.metrics.reset()
+
+    def tearDown(self):
+        app.config['SLOW_QUERY_MS'] = 100
+        app.config['N_PLUS_ONE_THRESHOLD'] = 5
+        super().tearDown()
+
+    def test_subscription_choices_cached(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        self.assertEqual(self.client.get('/log').headers['Server-Timing'][:19], 'sql;desc="1 queries')
+        self.assertEqual(self.client.get('/log').headers['Server-Timing'][:19], 'sql;desc="0 queries')
+
+        db.session.add(Subscription(name=PEACOCK, cost="5.00"))
+        db.session.commit()
+        self.assertEqual(subscription_choices.choices(), [(1, NETFLIX), (2, PEACOCK)])
+        self.assertEqual(subscription_choices.ids(), {1, 2})
+
+    def test_subscription_choice_validated(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        try:
+            response = self.client.post('/log', data={'subscription': 99, 'media_title': FLEABAG, 'media_type': 'tv'})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = True
+        self.assertIn(b'Not a valid choice', response.data)
+        self.assertEqual(Log.query.all(), [])
+
+    def test_subscription_choice_created_elsewhere(self):
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+        self.assertEqual(subscription_choices.ids(), {1})
+        # as another worker would, without this process's commit hooks
+        db.session.connection().exec_driver_sql(
+            "INSERT INTO subscription (name, cost_cents, payment_frequency, active_date) "
+            "VALUES ('Peacock', 500, 'monthly', '2025-01-01')"
+        )
+        db.session.commit()
+        app.config['WTF_CSRF_ENABLED'] = False
+        try:
+            response = self.client.post('/log', data={'subscription': 2, 'media_title': FLEABAG, 'media_type': 'tv'})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = True
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(SubscriptionStat.most_logged(), [(PEACOCK, 1)])
+        self.assertEqual(subscription_choices.ids(), {1, 2})
+
+    def test_server_timing(self):
+        response = self.client.get('/api/subscriptions')
+        self.assertRegex(response.headers['Server-Timing'], r'^sql;desc="1 queries";dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics(self):
+        self.client.get('/api/media')
+        self.client.get('/api/media')
+        body = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('app_requests_total{endpoint="api.api_media"} 2', body)
+        self.assertIn('app_sql_queries_total{endpoint="api.api_media"} 2', body)
+        self.assertIn('app_request_duration_seconds_bucket{endpoint="api.api_media",le="+Inf"} 2', body)
+
+    def test_slow_query_and_n_plus_one(self):
+        app.config['SLOW_QUERY_MS'] = 0
+        app.config['N_PLUS_ONE_THRESHOLD'] = 1
+        with self.assertLogs('application.sql', 'WARNING') as logs:
+            self.client.get('/api/media', query_string={'type': 'film'})
+        self.assertTrue(any('slow query' in line and "'film'" in line for line in logs.output))
+        self.assertTrue(any('possible N+1 in api.api_media' in line for line in logs.output))
+        self.assertEqual(instrumentation.metrics.n_plus_one['api.api_media'], 1)
+
+
+class DedupCase(ModelCase):
+    SPY = 'Spy x Family'
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(Subscription(name=NETFLIX, cost="22.99"))
+        db.session.commit()
+
+    def log(self, title, day='2025-01-05', episode=None):
+        ingest.ingest_logs([{'subscription': NETFLIX, 'media_title': title, 'media_type': 'tv', 'date': day,
+                             'season': 1 if episode else None, 'episode': episode}])
+
+    def test_normalize_title(self):
+        for title in ('Spy × Family', 'SPY x FAMILY ', 'Spy: x Family!', 'Spy x Fámily'):
+            self.assertEqual(dedup.normalize_title(title), 'spy x family')
+
+    def test_propose(self):
+        rows = [
+            (1, self.SPY, MediaType.tv, 1), (2, 'Spy × Family', MediaType.tv, 3), (3, 'SPY x FAMILY ', MediaType.tv, 0),
+            (4, 'Spy x Family', MediaType.film, 0),
+            (5, INSIDE_OUT, MediaType.film, 0), (6, INSIDE_OUT_2, MediaType.film, 0),
+            (7, 'The Marvelous Mrs. Maisel', MediaType.tv, 0), (8, 'The Marvelous Mrs Maisell', MediaType.tv, 0)
+        ]
+        merges = dedup.propose(rows)
+        self.assertEqual([(merge.media_id, [id for id, _, _ in merge.duplicates]) for merge in merges],
+                         [(2, [1, 3]), (7, [8])])
+        self.assertEqual(merges[0].duplicates[0], (1, self.SPY, 1.0))
+        self.assertEqual(len(dedup.propose(rows, threshold=1)), 1)
+
+    def test_merge(self):
+        for title in (self.SPY, self.SPY, 'Spy × Family', 'Spy: x Family!', FLEABAG):
+            self.log(title)
+        merges = dedup.find_merges()
+        self.assertEqual(len(merges), 1)
+        result = dedup.merge(merges)
+        self.assertEqual((result.media_merged, result.logs_moved), (2, 2))
+
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count()).select_from(Media)), 2)
+        self.assertEqual(Log.most_logged_media(), [(self.SPY, 4), (FLEABAG, 1)])
+        self.assertEqual(MediaStat.most_logged(), [(self.SPY, 4), (FLEABAG, 1)])
+        self.assertEqual(stats.counts(stats.MONTH, stats.BY_MEDIA),
+                         [(date(2025, 1, 1), self.SPY, 4), (date(2025, 1, 1), FLEABAG, 1)])
+
+    def test_merge_natural_key(self):
+        ingest.enforce_natural_key()
+        self.log(self.SPY, episode=1)
+        self.log('Spy × Family', episode=1)
+        self.log('Spy × Family', episode=2)
+        result = dedup.merge(dedup.find_merges())
+        # the most logged title is kept
+        self.assertEqual((result.logs_moved, result.logs_deleted), (1, 1))
+        self.assertTrue(Log.natural_key_enforced())
+        self.assertEqual(Log.most_logged_media(), [('Spy × Family', 2)])
+        self.assertEqual(SubscriptionStat.most_logged(), [(NETFLIX, 2)])
+
+    def test_merge_deletes_newest_log(self):
+        ingest.enforce_natural_key()
+        self.log('Spy × Family', episode=1)
+        self.log('Spy × Family', episode=2)
+        self.log(self.SPY, episode=1)
+        self.assertEqual(stats.refresh(), 3)
+        self.assertEqual(dedup.merge(dedup.find_merges()).logs_deleted, 1)
+
+        # SQLite gives the deleted log's id to the next one
+        self.log('Spy × Family', day='2024-01-02', episode=3)
+        self.assertEqual(stats.refresh(), 1)
+        self.assertEqual(stats.counts(stats.DAY, stats.BY_MEDIA)[0], (date(2024, 1, 2), 'Spy × Family', 1))
+
+
+class AppFactoryCase(ModelCase):
+    def test_import_time(self):
+        # importing the package defines the models only; the routes, forms and migrations load with create_app
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import application'],
+                                capture_output=True, text=True, check=True, env=dict(os.environ, DATABASE_URL='sqlite://'))
+        modules = {line.split('|')[-1].strip(): int(line.split('|')[1]) for line in result.stderr.splitlines()
+                   if line.startswith('import time:') and line.split('|')[1].strip().isdigit()}
+        for module in ('alembic', 'flask_migrate', 'flask_wtf', 'application.routes', 'application.forms'):
+            self.assertNotIn(module, modules)
+        self.assertLess(modules['application'], 1_500_000)
+
+    def test_dispose_engines_after_fork(self):
+        pool = db.engine.pool
+        _dispose_engines(weakref.ref(app))
+        self.assertIsNot(db.engine.pool, pool)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,8 @@
+"""
+WSGI entry point for production servers, e.g. gunicorn with the settings in gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py
+"""
+from application import create_app
+
+app = create_app()